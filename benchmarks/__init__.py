@@ -0,0 +1,15 @@
+"""Benchmark suite for the daily journal hot paths. Builds synthetic journals in temporary sqlite files
+and times the repository, model and controller code against them, without needing a display.
+
+Run from the repository root:
+    python -m benchmarks run --sizes 1k,50k --output results.json
+    python -m benchmarks compare baseline.json results.json
+"""
+
+import pathlib
+import sys
+
+#the app modules import each other by their plain names, so the app folder has to be on the path
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / 'daily_journal'
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
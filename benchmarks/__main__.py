@@ -0,0 +1,58 @@
+"""Command line for the benchmark suite, see the package docstring for usage"""
+
+import argparse
+import sys
+
+from . import runner, synthetic
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Daily journal benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and write the results as json')
+    run_parser.add_argument('--sizes', default='1k,50k', help=f'comma separated journal sizes, from {", ".join(synthetic.SIZES)}')
+    run_parser.add_argument('--repeat', type=int, default=20, help='timed calls per case')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', default='bench_results.json')
+    run_parser.add_argument('--workdir', default=None, help='folder for the temporary journal files')
+    run_parser.add_argument('--baseline', default=None, help='compare against this results file once the run is done')
+    run_parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before a case is flagged, 0.2 is 20%%')
+
+    compare_parser = commands.add_parser('compare', help='compare a results file against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    if args.command == 'run':
+        sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+        unknown = [size for size in sizes if size not in synthetic.SIZES]
+        if unknown:
+            print(f'Unknown sizes: {", ".join(unknown)}', file=sys.stderr)
+            return 2
+        results = runner.run(sizes, args.repeat, args.seed, args.workdir)
+        runner.save(results, args.output)
+        runner.print_results(results)
+        print(f'\nResults written to {args.output}')
+        if args.baseline is None:
+            return 0
+        current = results
+        baseline = runner.load(args.baseline)
+    else:
+        baseline = runner.load(args.baseline)
+        current = runner.load(args.current)
+
+    regressions = runner.compare(baseline, current, args.threshold)
+    runner.print_regressions(regressions)
+    #a non zero exit lets scripts and ci fail on a regression
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
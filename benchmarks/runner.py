@@ -0,0 +1,89 @@
+"""Runs the suites over synthetic journals, and compares a run against a saved baseline"""
+
+import datetime
+import json
+import pathlib
+import platform
+import sqlite3
+import tempfile
+
+from . import suites, synthetic
+
+
+def run(sizes: list[str], repeat: int = 20, seed: int = 0, workdir: str | None = None) -> dict:
+    """Builds a journal for every size and runs all the suites on it. Returns the results as a dict"""
+    results = {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for size in sizes:
+            count = synthetic.SIZES[size]
+            path = str(pathlib.Path(tmp) / f'journal_{size}.db')
+            print(f'Building {size} journal ({count} entries)...')
+            conn = synthetic.build_journal(path, count, seed)
+            entries = suites.repository.Entries(conn)
+
+            print(f'Running suites on {size} journal...')
+            size_results = {}
+            size_results.update(suites.repository_suite(entries, count, repeat, seed))
+            size_results.update(suites.model_suite(entries, count, repeat, seed))
+            #the controller suite closes the connection, so it goes last
+            size_results.update(suites.controller_suite(conn, entries, count, repeat, seed))
+            results['results'][size] = size_results
+    return results
+
+
+def save(results: dict, path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+
+
+def load(path: str) -> dict:
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.2) -> list[dict]:
+    """Returns every case whose median got slower than the baseline by more than threshold (0.2 is 20%).
+    Cases missing from either run are left out"""
+    regressions = []
+    for size, cases in current['results'].items():
+        base_cases = baseline['results'].get(size, {})
+        for case, stats in cases.items():
+            base = base_cases.get(case)
+            if base is None or base['median_ms'] == 0:
+                continue
+            ratio = stats['median_ms'] / base['median_ms']
+            if ratio > 1 + threshold:
+                regressions.append({
+                    'size': size,
+                    'case': case,
+                    'baseline_ms': base['median_ms'],
+                    'current_ms': stats['median_ms'],
+                    'ratio': ratio,
+                })
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    for size, cases in results['results'].items():
+        print(f'\n{size}')
+        for case, stats in cases.items():
+            print(f'  {case:<45} median {stats["median_ms"]:9.3f} ms   min {stats["min_ms"]:9.3f} ms')
+
+
+def print_regressions(regressions: list[dict]) -> None:
+    if not regressions:
+        print('\nNo regressions against the baseline')
+        return
+    print(f'\n{len(regressions)} regression(s) against the baseline:')
+    for item in regressions:
+        print(f'  {item["size"]:<5} {item["case"]:<45} {item["baseline_ms"]:9.3f} -> {item["current_ms"]:9.3f} ms ({item["ratio"]:.2f}x)')
@@ -0,0 +1,167 @@
+"""The benchmark cases. Each suite takes an open journal and returns {case name: timing stats}"""
+
+import datetime
+import random
+import sqlite3
+import time
+
+import config
+import model
+import repository
+from worker import DBWorker
+
+from . import synthetic
+from .timing import measure
+
+
+def random_date(rng: random.Random, count: int) -> datetime.date:
+    return synthetic.first_date(count) + datetime.timedelta(days=rng.randrange(count))
+
+
+def month_bounds(date: datetime.date) -> tuple[datetime.date, datetime.date]:
+    return model.Month(date.month, date.year).start_and_end_dates()
+
+
+def repository_suite(entries: repository.Entries, count: int, repeat: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    text = synthetic.generate_entry(rng)
+    #new entries go after the end of the journal, and are deleted again by the delete case
+    new_dates = [synthetic.LAST_DATE + datetime.timedelta(days=i + 1) for i in range(repeat)]
+    existing_dates = [random_date(rng, count) for _ in range(repeat)]
+    months = [month_bounds(random_date(rng, count)) for _ in range(repeat)]
+    search_terms = [rng.choice(synthetic.WORDS) for _ in range(repeat)]
+
+    return {
+        'repository.store_entry': measure(lambda i: entries.store_entry(new_dates[i], text), repeat),
+        'repository.update_entry': measure(lambda i: entries.update_entry(existing_dates[i], text), repeat),
+        'repository.upsert_entry': measure(lambda i: entries.upsert_entry(existing_dates[i], text), repeat),
+        'repository.upsert_many_31': measure(lambda i: entries.upsert_many((date, text) for date in existing_dates[:31]), repeat),
+        'repository.get_entry': measure(lambda i: entries.get_entry(existing_dates[i]), repeat),
+        'repository.get_entries_month': measure(lambda i: entries.get_entries(*months[i]), repeat),
+        'repository.get_entry_index_month': measure(lambda i: entries.get_entry_index(*months[i]), repeat),
+        'repository.get_recent_entries': measure(lambda i: entries.get_recent_entries(3), repeat),
+        'repository.search': measure(lambda i: entries.search(search_terms[i], 20), repeat),
+        'repository.delete_entry': measure(lambda i: entries.delete_entry(new_dates[i]), repeat),
+    }
+
+
+def model_suite(entries: repository.Entries, count: int, repeat: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    dates = [random_date(rng, count) for _ in range(repeat)]
+    #the rows are fetched up front so only the model work is timed
+    index_rows = [entries.get_entry_index(*month_bounds(date)) for date in dates]
+
+    return {
+        'model.Month.__init__': measure(lambda i: model.Month(dates[i].month, dates[i].year), repeat),
+        'model.Month.populate_days_with_entries': measure(
+            lambda i: model.Month(dates[i].month, dates[i].year).populate_days_with_entries(index_rows[i]), repeat),
+        'model.Month.month_matrix': measure(lambda i: model.Month(dates[i].month, dates[i].year).month_matrix, repeat),
+    }
+
+
+#------------------------------ controller ------------------------------
+
+class StubRoot:
+    """Stands in for tk.Tk. Scheduled callbacks are kept and only run when run_pending is called"""
+    def __init__(self) -> None:
+        self._jobs = {}
+        self._next_id = 0
+
+    def after(self, ms, func=None, *args):
+        self._next_id += 1
+        self._jobs[self._next_id] = (func, args)
+        return self._next_id
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, job_id) -> None:
+        self._jobs.pop(job_id, None)
+
+    def protocol(self, *args) -> None:
+        pass
+
+    def destroy(self) -> None:
+        pass
+
+    def run_pending(self) -> None:
+        jobs, self._jobs = self._jobs, {}
+        for func, args in jobs.values():
+            func(*args)
+
+
+class StubPage:
+    """Stands in for every ui page, any method call is accepted and ignored"""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def headless_controller_class():
+    #controller imports the ui module, which needs tkinter installed, but no display is used
+    import controller
+
+    class HeadlessController(controller.Controller):
+        def init_ui_pages(self, init_day):
+            return {page: StubPage() for page in controller.PageId}
+
+    return HeadlessController
+
+
+def wait_for_month(cont, root: StubRoot) -> None:
+    #keeps running the polled callbacks until the worker has filled in the focus month
+    while not cont.month_loaded:
+        root.run_pending()
+        time.sleep(0)
+    root.run_pending()
+
+
+def controller_suite(conn: sqlite3.Connection, entries: repository.Entries, count: int, repeat: int, seed: int) -> dict:
+    """Times month navigation through the controller. This stops the worker, which closes conn"""
+    try:
+        controller_class = headless_controller_class()
+    except ImportError as error:
+        print(f'Skipping controller suite: {error}')
+        return {}
+
+    root = StubRoot()
+    worker = DBWorker(conn)
+    worker.start()
+    prefetch = config.MONTH_PREFETCH
+    #the stub root runs timers straight away, so the backup timer is kept off for the suite
+    backup_interval = config.BACKUP_INTERVAL_MINUTES
+    config.BACKUP_INTERVAL_MINUTES = None
+
+    def settle(i=None):
+        #lets the idle prefetch run and waits for the worker to finish it, like the user pausing between clicks
+        root.run_pending()
+        worker.submit(lambda: None).result()
+        root.run_pending()
+
+    try:
+        cont = controller_class(entries, root, worker)
+        cont.focus_month = synthetic.LAST_DATE
+        wait_for_month(cont, root)
+
+        def navigate(i):
+            cont.rev_focus_month()
+            wait_for_month(cont, root)
+
+        #every step goes to the db, nothing is cached or prefetched
+        config.MONTH_PREFETCH = False
+        uncached = measure(navigate, repeat, before=lambda i: cont.month_cache.clear())
+
+        #walking back through history with prefetch on, so each step should already be cached
+        config.MONTH_PREFETCH = True
+        cont.month_cache.clear()
+        cont.focus_month = synthetic.LAST_DATE
+        wait_for_month(cont, root)
+        prefetched = measure(navigate, repeat, before=settle)
+
+        return {
+            'controller.navigate_uncached': uncached,
+            'controller.navigate_prefetched': prefetched,
+        }
+    finally:
+        config.MONTH_PREFETCH = prefetch
+        config.BACKUP_INTERVAL_MINUTES = backup_interval
+        worker.stop()
@@ -0,0 +1,61 @@
+"""Generates synthetic journals. Entry sizes are skewed like a real journal: mostly short notes,
+some longer entries and a few very long ones. The same seed always gives the same journal"""
+
+import datetime
+import random
+import sqlite3
+from itertools import islice
+from typing import Iterator
+
+import repository
+
+WORDS = (
+    'today went walk park dog coffee work meeting friend dinner read book wrote code tired happy '
+    'rain sun morning evening night family call plan week weekend garden cook music run gym '
+    'project idea learned finally started finished tomorrow remember grateful busy quiet long short'
+).split()
+
+#(share of entries, min words, max words)
+SIZE_MIX = (
+    (0.70, 10, 80),
+    (0.27, 80, 400),
+    (0.03, 400, 2000),
+)
+
+#the journal ends here and goes back one day per entry
+LAST_DATE = datetime.date(2024, 12, 31)
+
+SIZES = {'1k': 1_000, '50k': 50_000, '500k': 500_000}
+
+
+def generate_entry(rng: random.Random) -> str:
+    roll = rng.random()
+    for share, min_words, max_words in SIZE_MIX:
+        if roll < share:
+            break
+        roll -= share
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    #break the text into lines now and then, like a real entry
+    for i in range(12, len(words), 12):
+        words[i] = words[i] + '\n'
+    return ' '.join(words)
+
+
+def generate_entries(count: int, seed: int = 0) -> Iterator[tuple[datetime.date, str]]:
+    rng = random.Random(seed)
+    for offset in range(count):
+        yield LAST_DATE - datetime.timedelta(days=offset), generate_entry(rng)
+
+
+def first_date(count: int) -> datetime.date:
+    return LAST_DATE - datetime.timedelta(days=count - 1)
+
+
+def build_journal(path: str, count: int, seed: int = 0, batch_size: int = 5000) -> sqlite3.Connection:
+    """Creates a journal with count entries at path and returns an open connection to it"""
+    conn = repository.open_connection(path, repository.logger.journal_logger())
+    entries = repository.Entries(conn)
+    rows = generate_entries(count, seed)
+    while batch := list(islice(rows, batch_size)):
+        entries.import_entries(batch)
+    return conn
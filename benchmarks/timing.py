@@ -0,0 +1,28 @@
+"""Timing helpers shared by the suites"""
+
+import statistics
+import time
+from typing import Callable
+
+
+def measure(func: Callable[[int], object], repeat: int, before: Callable[[int], object] | None = None) -> dict:
+    """Calls func(i) for i in range(repeat) and returns timing stats in milliseconds.
+    before(i), if given, runs untimed ahead of each call. Rows returned by func are counted when it returns a list"""
+    times = []
+    rows = 0
+    for i in range(repeat):
+        if before:
+            before(i)
+        start = time.perf_counter()
+        result = func(i)
+        times.append((time.perf_counter() - start) * 1000)
+        if isinstance(result, list):
+            rows += len(result)
+    return {
+        'runs': repeat,
+        'min_ms': min(times),
+        'median_ms': statistics.median(times),
+        'mean_ms': statistics.fmean(times),
+        'max_ms': max(times),
+        'rows': rows,
+    }
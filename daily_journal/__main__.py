@@ -0,0 +1,232 @@
+"""Command line for the journal, for quick edits and scripts without starting the gui.
+Nothing here imports the ui or tkinter, the repository is used through the data controller.
+
+Run from the repository root:
+    python -m daily_journal append "walked the dog"
+    echo "notes from cron" | python -m daily_journal append --date yesterday
+    python -m daily_journal show 2024-12-07
+    python -m daily_journal list 2024-12-01 2024-12-31
+    python -m daily_journal search "dog*"
+    python -m daily_journal tag 2024-12-07 work travel
+    python -m daily_journal tagged work travel --from 2024-01-01 --not holiday
+    python -m daily_journal mood 2024-12-07 4
+    python -m daily_journal export journal.jsonl
+    python -m daily_journal split journal_shards
+    python -m daily_journal backup
+"""
+
+import argparse
+import calendar
+import datetime
+import pathlib
+import sqlite3
+import sys
+
+#the app modules import each other by their plain names, so the app folder has to be on the path
+APP_DIR = pathlib.Path(__file__).resolve().parent
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+import config
+import logger
+import repository
+import shards
+from data_controller import DataController
+from worker import DBWorker
+
+
+def parse_date(value: str) -> datetime.date:
+    #argparse type for dates, takes YYYY-MM-DD as well as today and yesterday
+    today = datetime.date.today()
+    relative = {'today': today, 'yesterday': today - datetime.timedelta(days=1)}
+    if value.lower() in relative:
+        return relative[value.lower()]
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not a date: {value}, use YYYY-MM-DD, today or yesterday')
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m daily_journal', description='Daily journal command line')
+    parser.add_argument('--db', default=config.DB_SHARD_DIR if config.DB_SHARDED else config.DB_NAME,
+                        help='journal database file, or the shard folder when DB_SHARDED is on')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in (('add', "write the date's entry, replacing any text it has"),
+                            ('append', "add a line to the end of the date's entry")):
+        write_parser = commands.add_parser(name, help=help_text)
+        write_parser.add_argument('text', nargs='*', help='entry text, read from stdin when left out or -')
+        write_parser.add_argument('--date', type=parse_date, default=datetime.date.today(), help='defaults to today')
+
+    show_parser = commands.add_parser('show', help="print a date's entry")
+    show_parser.add_argument('date', type=parse_date, nargs='?', default=datetime.date.today(), help='defaults to today')
+
+    list_parser = commands.add_parser('list', help='list the entries in a date range')
+    list_parser.add_argument('start', type=parse_date, nargs='?', default=None, help='defaults to the 1st of this month')
+    list_parser.add_argument('end', type=parse_date, nargs='?', default=None, help='defaults to the end of the start month')
+    list_parser.add_argument('--full', action='store_true', help='print the whole entries instead of snippets')
+
+    search_parser = commands.add_parser('search', help='full text search, a trailing * matches word prefixes')
+    search_parser.add_argument('query', nargs='+')
+    search_parser.add_argument('--limit', type=int, default=20)
+
+    tag_parser = commands.add_parser('tag', help="add tags to a date's entry, or list its tags when none are given")
+    tag_parser.add_argument('date', type=parse_date)
+    tag_parser.add_argument('names', nargs='*', help='tag names, with or without the #')
+    tag_parser.add_argument('--remove', action='store_true', help='remove the tags instead')
+
+    tagged_parser = commands.add_parser('tagged', help='list the dates that have all of the tags, or every tag with its count when none are given')
+    tagged_parser.add_argument('names', nargs='*')
+    tagged_parser.add_argument('--any', action='store_true', help='dates with any one of the tags')
+    tagged_parser.add_argument('--not', dest='exclude', nargs='+', default=[], help='leave out dates with these tags')
+    tagged_parser.add_argument('--from', dest='start', type=parse_date, default=datetime.date.min)
+    tagged_parser.add_argument('--to', dest='end', type=parse_date, default=datetime.date.max)
+
+    mood_parser = commands.add_parser('mood', help="rate a date's entry, or print its rating when none is given")
+    mood_parser.add_argument('date', type=parse_date)
+    mood_parser.add_argument('rating', nargs='?', help=f'{config.MOOD_RANGE[0]} to {config.MOOD_RANGE[1]}, or clear')
+
+    export_parser = commands.add_parser('export', help='export every entry, the format is taken from the extension')
+    export_parser.add_argument('path', help='a .csv, .jsonl or .txt file')
+
+    commands.add_parser('backup', help='snapshot the journal into the backup folder from config')
+
+    split_parser = commands.add_parser('split', help='copy the journal in --db into one db file per year')
+    split_parser.add_argument('shard_dir', nargs='?', default=config.DB_SHARD_DIR, help='an empty folder for the yearly files')
+
+    return parser.parse_args(argv)
+
+
+def read_text(words: list[str]) -> str:
+    #text given as arguments is joined, otherwise it is piped in
+    if words and words != ['-']:
+        return ' '.join(words)
+    return sys.stdin.read().rstrip('\n')
+
+
+def one_line(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def run_command(args: argparse.Namespace, data: DataController) -> int:
+    if args.command in ('add', 'append'):
+        text = read_text(args.text)
+        if not text:
+            print('Nothing to write', file=sys.stderr)
+            return 2
+        write = data.queue_save if args.command == 'add' else data.append_entry
+        write(args.date, text).result()
+        return 0
+
+    if args.command == 'show':
+        entry = data.get_entry(args.date).result()
+        if entry is None:
+            print(f'No entry for {args.date.isoformat()}', file=sys.stderr)
+            return 1
+        print(entry)
+        return 0
+
+    if args.command == 'list':
+        start = args.start or datetime.date.today().replace(day=1)
+        end = args.end or start.replace(day=calendar.monthrange(start.year, start.month)[1])
+        if args.full:
+            for date, entry in sorted(data.get_months_entries(start, end).result()):
+                print(f'=== {date} ===\n{entry}\n')
+            return 0
+        for date, length, snippet in sorted(data.get_months_entry_index(start, end).result()):
+            more = '...' if length > len(snippet) else ''
+            print(f'{date}  {one_line(snippet)}{more}')
+        return 0
+
+    if args.command == 'search':
+        for date, snippet in data.search(' '.join(args.query), args.limit).result():
+            print(f'{date}  {one_line(snippet)}')
+        return 0
+
+    if args.command == 'tag':
+        if args.names:
+            change = data.untag_entry if args.remove else data.tag_entry
+            #nothing changes when the tags were all there already, so the entry is looked up to tell the two apart
+            if not change(args.date, *args.names).result() and data.get_entry(args.date).result() is None:
+                print(f'No entry for {args.date.isoformat()}', file=sys.stderr)
+                return 1
+        for name, source in data.get_tags(args.date).result():
+            print(f'#{name}  ({source})')
+        return 0
+
+    if args.command == 'tagged':
+        if not args.names:
+            for name, count in data.list_tags().result():
+                print(f'{count:>6}  #{name}')
+            return 0
+        match = repository.TagMatch.ANY if args.any else repository.TagMatch.ALL
+        for date in data.find_by_tags(args.names, match, args.start, args.end, args.exclude).result():
+            print(date)
+        return 0
+
+    if args.command == 'mood':
+        if args.rating is None:
+            moods = data.get_moods(args.date, args.date).result()
+            print(moods[0][1] if moods else 'No rating')
+            return 0
+        if not data.set_mood(args.date, None if args.rating == 'clear' else int(args.rating)).result():
+            print(f'No entry for {args.date.isoformat()}', file=sys.stderr)
+            return 1
+        return 0
+
+    if args.command == 'backup':
+        for snapshot in data.backup().result():
+            print(f'Saved {snapshot}')
+        return 0
+
+    count = data.export_entries(args.path).result()
+    print(f'Exported {count} entries to {args.path}')
+    return 0
+
+
+def split_command(args: argparse.Namespace, log) -> int:
+    #runs straight away rather than on the worker, nothing else is using the journal
+    try:
+        counts = shards.split_journal(args.db, args.shard_dir, log)
+    except (sqlite3.Error, OSError, ValueError) as error:
+        log.exception('Split failed:')
+        print(f'Error: {error}', file=sys.stderr)
+        return 1
+    for year, count in counts.items():
+        print(f'{year}  {count} entries')
+    print(f'Split {sum(counts.values())} entries into {args.shard_dir}, set DB_SHARDED in config.py to use it')
+    return 0
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logger.configure_logger()
+    log = logger.journal_logger('cli')
+
+    try:
+        if args.command == 'split':
+            return split_command(args, log)
+        if config.DB_SHARDED:
+            conn = shards.Shards(args.db, log)
+            entries = shards.ShardedEntries(conn)
+        else:
+            conn = repository.open_connection(args.db, log)
+            entries = repository.Entries(conn)
+        worker = DBWorker(conn)
+        try:
+            data = DataController(entries, worker)
+            worker.start()
+            return run_command(args, data)
+        except (sqlite3.Error, OSError, ValueError) as error:
+            log.exception('Command %s failed:', args.command)
+            print(f'Error: {error}', file=sys.stderr)
+            return 1
+        finally:
+            worker.stop()
+    finally:
+        logger.stop_logging()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Online backups of the journal. Snapshots are copied from the live db files with sqlite's backup api,
+a few pages at a time with a short sleep between steps, on a thread of their own, so saves carry on while a
+backup runs. Every snapshot is checked with PRAGMA integrity_check before it is kept, and old snapshots are
+removed by the retention settings in config"""
+
+import datetime
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable
+
+import config
+import logger
+
+SNAPSHOT_TIME_FORMAT = '%Y%m%d-%H%M%S'
+PARTIAL_SUFFIX = '.partial' #snapshots are written under this suffix, and only renamed once they have been checked
+
+
+class BackupError(Exception):
+    """A snapshot failed its integrity check"""
+
+
+class CopyRestarted(Exception):
+    """Raised from the progress callback to stop a stepped copy that keeps being restarted by commits"""
+
+
+def snapshot_path(source: Path, backup_dir: Path, taken: datetime.datetime) -> Path:
+    #journal.db is backed up as journal-20241207-093000.db
+    return backup_dir / f'{source.stem}-{taken.strftime(SNAPSHOT_TIME_FORMAT)}{source.suffix}'
+
+
+def list_snapshots(source: Path, backup_dir: Path) -> list[tuple[datetime.datetime, Path]]:
+    """(time taken, path) for each snapshot of source, newest first"""
+    snapshots = []
+    for path in backup_dir.glob(f'{source.stem}-*{source.suffix}'):
+        try:
+            taken = datetime.datetime.strptime(path.stem[len(source.stem) + 1:], SNAPSHOT_TIME_FORMAT)
+        except ValueError:
+            continue
+        snapshots.append((taken, path))
+    return sorted(snapshots, reverse=True)
+
+
+def copy_database(source: Path, target: Path, pages: int = config.BACKUP_PAGES_PER_STEP,
+                  step_sleep: float = config.BACKUP_STEP_SLEEP, progress: Callable[[int, int], None] | None = None,
+                  max_restarts: int = config.BACKUP_MAX_RESTARTS) -> int:
+    """Copies source into target with the backup api, pages at a time. The source is only read locked while
+    a step runs, the sleep between steps gives the writer room to commit. A commit from another connection
+    makes sqlite start the copy again from the first page, so on a busy journal a stepped copy may never finish.
+    After max_restarts restarts the copy is done again in one step, which holds a read transaction until it ends.
+    With the WAL journal mode that doesn't block the writer. progress gets (pages copied, total pages).
+    Returns the number of restarts"""
+    source_conn = sqlite3.connect(source)
+    target_conn = sqlite3.connect(target)
+    restarts = 0
+    copied_before = 0
+
+    def report(remaining, total):
+        if progress is not None:
+            progress(total - remaining, total)
+
+    def step(status, remaining, total):
+        nonlocal restarts, copied_before
+        #a step that copied pages but didn't get past the last step means the copy went back to the start.
+        #a busy or locked step copies nothing, so it doesn't count
+        if status == sqlite3.SQLITE_OK and total - remaining <= copied_before:
+            restarts += 1
+            if restarts > max_restarts:
+                raise CopyRestarted
+        copied_before = total - remaining
+        report(remaining, total)
+        if remaining:
+            time.sleep(step_sleep)
+
+    try:
+        try:
+            source_conn.backup(target_conn, pages=pages, progress=step)
+        except CopyRestarted:
+            source_conn.backup(target_conn, pages=-1, progress=lambda status, remaining, total: report(remaining, total))
+    finally:
+        target_conn.close()
+        source_conn.close()
+    return restarts
+
+
+def check_integrity(path: Path) -> list[str]:
+    """Returns the problems PRAGMA integrity_check finds in the db file, an empty list when there are none"""
+    conn = sqlite3.connect(path)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    finally:
+        conn.close()
+    return [] if problems == ['ok'] else problems
+
+
+def prune_snapshots(source: Path, backup_dir: Path, keep: int | None = config.BACKUP_KEEP_COUNT,
+                    max_age_days: int | None = config.BACKUP_MAX_AGE_DAYS) -> list[Path]:
+    """Removes the snapshots of source beyond the newest keep, and those older than max_age_days.
+    The newest snapshot is always kept. Returns the removed paths"""
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=max_age_days) if max_age_days is not None else None
+    removed = []
+    for position, (taken, path) in enumerate(list_snapshots(source, backup_dir)):
+        if position == 0:
+            continue
+        if (keep is not None and position >= keep) or (cutoff is not None and taken < cutoff):
+            path.unlink()
+            removed.append(path)
+    return removed
+
+
+class BackupManager:
+    """Takes snapshots of every db file of the journal. Only one backup runs at a time, start returns the
+    Future of the one already running rather than starting a second"""
+    def __init__(self, backup_dir: str = config.BACKUP_DIR) -> None:
+        self.backup_dir = Path(backup_dir)
+        self.logger = logger.journal_logger('backup')
+        self._lock = threading.Lock()
+        self._running = None
+
+    def backup(self, sources: list[Path], progress: Callable[[int, int], None] | None = None) -> list[Path]:
+        """Snapshots each source in turn and prunes its old snapshots. Returns the new snapshot paths.
+        Raises BackupError if a snapshot is damaged, the damaged copy is not kept"""
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        taken = datetime.datetime.now()
+        snapshots = []
+        for source in sources:
+            target = snapshot_path(source, self.backup_dir, taken)
+            partial = target.with_name(target.name + PARTIAL_SUFFIX)
+            #a backup cut short by the app closing leaves its partial file behind, under the time it was started
+            for leftover in self.backup_dir.glob(f'{source.stem}-*{source.suffix}{PARTIAL_SUFFIX}'):
+                leftover.unlink(missing_ok=True)
+            started = time.perf_counter()
+            restarts = copy_database(source, partial, progress=progress)
+            if restarts > config.BACKUP_MAX_RESTARTS:
+                self.logger.warning('Backup of %s was restarted by commits %s times, copied it in one step', source, restarts)
+            problems = check_integrity(partial)
+            if problems:
+                partial.unlink()
+                self.logger.error('Snapshot of %s failed its integrity check: %s', source, problems[:10])
+                raise BackupError(f'The snapshot of {source.name} is damaged: {problems[0]}')
+            partial.replace(target)
+            removed = prune_snapshots(source, self.backup_dir)
+            self.logger.info('Backed up %s to %s in %.0fms, removed %s old snapshots',
+                             source, target, (time.perf_counter() - started) * 1000, len(removed))
+            snapshots.append(target)
+        return snapshots
+
+    def start(self, sources: list[Path], progress: Callable[[int, int], None] | None = None) -> Future:
+        """Runs backup on a background thread, returns a Future of the snapshot paths"""
+        with self._lock:
+            if self._running is not None:
+                return self._running
+            future = self._running = Future()
+
+        def run():
+            try:
+                snapshots, error = self.backup(sources, progress), None
+            except Exception as exc:
+                self.logger.exception('Backup failed:')
+                snapshots, error = None, exc
+            #cleared first, so a callback on the future can start the next backup
+            with self._lock:
+                self._running = None
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(snapshots)
+
+        future.set_running_or_notify_cancel()
+        threading.Thread(target=run, name='db-backup', daemon=True).start()
+        return future
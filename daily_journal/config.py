@@ -1,11 +1,66 @@
 # UI section
 WINDOW_GEOMETRY = '500x800+150+100' #500px wide by 800px tall, top left corner is at coord 150x,100y
 WINDOW_RESIZEABLE = (False,False)
+EDITOR_CHUNK_BATCH = 4 #chunks of a large entry fetched per db call, the editor opens once the first batch is in
 
 
 # DB section
 DB_NAME = 'journal.db'
+DB_SHARDED = False #keep each year in its own db file, split an existing journal with: python -m daily_journal split
+DB_SHARD_DIR = 'journal_shards' #folder the yearly db files are kept in when DB_SHARDED is on
+DB_SHARD_NAME = 'journal_{year}.db'
 ENTRIES_TABLE = 'entries'
+#connection profile, applied as PRAGMAs to every connection when it is opened
+DB_PRAGMAS = {
+    'journal_mode': 'WAL', #readers don't block the writer, and commits don't rewrite the whole journal
+    'synchronous': 'NORMAL', #safe with WAL, only the last commits can be lost on power failure, never corrupted
+    'cache_size': -16000, #negative is in KiB, so about 16MB of page cache
+    'mmap_size': 64 * 1024 * 1024, #read pages through memory mapping instead of read() calls
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+DB_READER_POOL_SIZE = 2 #read only connections, and threads, for reads that don't have to wait behind writes. 0 reads on the writer
+DB_READER_PRAGMAS = { #readers only keep the settings that affect reading, the journal mode belongs to the writer
+    'cache_size': -8000,
+    'mmap_size': 64 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+ENTRY_SNIPPET_LENGTH = 45 #characters of each entry loaded with the month, the full text is loaded when the day is opened
+ENTRY_COMPRESS_THRESHOLD = 4096 #bodies of at least this many bytes are stored zlib compressed, None to store everything as text
+ENTRY_COMPRESS_LEVEL = 6 #zlib level, 1 is fastest and 9 is smallest
+ENTRY_CHUNK_THRESHOLD = 256 * 1024 #entries of at least this many characters are stored in chunks, None to never chunk
+ENTRY_CHUNK_SIZE = 64 * 1024 #characters per chunk, saves only rewrite the chunks an edit touched
+CHUNKS_TABLE = 'entry_chunks'
+ENTRIES_TEXT_VIEW = 'entries_text' #the entries with their bodies decompressed and chunks joined, reads go through this
+STATS_TABLE = 'entry_stats' #entry, word and character counts per month, kept up to date by triggers on the entries table
+SEARCH_TABLE = 'entries_search' #fts5 index over the entries table, kept in sync by triggers
+SEARCH_CONTENT_VIEW = 'search_content' #what the search index is built from, entries stored in their row and each chunk of the chunked ones
+SEARCH_HIGHLIGHT = ('[', ']') #markers placed around matched terms in search snippets
+SEARCH_SNIPPET_TOKENS = 12 #number of words shown in each search snippet
+REVISIONS_TABLE = 'revisions' #older versions of each entry, stored as deltas against the next newer version
+REVISION_KEYFRAME_INTERVAL = 16 #every nth revision is stored in full, so rebuilding one never applies more than n deltas
+REVISION_DIFF_MAX_LINES = 2000 #changed lines diffed line by line for a revision, a bigger change is stored as one replacement
+REVISION_KEEP_COUNT = 100 #revisions kept per entry by compaction, None to keep any number
+REVISION_MAX_AGE_DAYS = 365 #revisions older than this are removed by compaction, None to keep them forever
+TAGS_TABLE = 'tags' #one row per tag name
+ENTRY_TAGS_TABLE = 'entry_tags' #which dates have which tags, keyed both ways so lookups by tag or by date read only the index
+TAG_MAX_LENGTH = 50 #characters, longer #hashtags in the text are not picked up as tags
+MOOD_RANGE = (1, 5) #lowest and highest mood rating an entry can be given
+
+
+# Import/export section
+EXPORT_CHUNK_SIZE = 1000 #rows read from the db at a time while exporting
+IMPORT_BATCH_SIZE = 5000 #rows written per transaction while importing
+
+
+# Backup section
+BACKUP_DIR = 'backups' #snapshots of the journal, named after the db file and the time they were taken
+BACKUP_INTERVAL_MINUTES = 60 #minutes between backups while the app is open, None to only back up from the options page
+BACKUP_PAGES_PER_STEP = 256 #pages copied per backup step, the journal is only read locked for the length of a step
+BACKUP_STEP_SLEEP = 0.005 #seconds between backup steps, so saves get in while a backup runs
+BACKUP_MAX_RESTARTS = 3 #times a commit can send a stepped backup back to the first page before the rest is copied in one step
+BACKUP_KEEP_COUNT = 10 #snapshots kept of each db file, None to keep any number
+BACKUP_MAX_AGE_DAYS = 90 #snapshots older than this are removed, None to keep them forever. the newest one is always kept
 
 
 # Logging section
@@ -13,3 +68,35 @@ LOGGING_FILE_NAME = 'logs/journal.log'
 LOGGING_MAX_LOG_SIZE = 5 * 1024 * 1024
 LOGGING_FILE_BACKUP_COUNT = 5
 LOGGING_LEVEL = 'DEBUG'
+LOGGING_MODULE_LEVELS = { #levels for the module loggers, e.g. 'repository': 'WARNING'
+    'repository': 'INFO',
+    'model': 'INFO',
+}
+LOGGING_SAMPLING = {} #module: rate, only one in rate records of each message below WARNING is written
+
+
+# Autosave section
+AUTOSAVE_ENABLED = True
+AUTOSAVE_DELAY = 1500 #milliseconds without typing before the entry is saved
+
+
+# Cache section
+MONTH_CACHE_SIZE = 24 #number of populated months kept in memory
+MONTH_PREFETCH = True #load the months on either side of the focus month while the ui is idle
+
+
+# Background worker section
+DB_POLL_INTERVAL = 20 #milliseconds between checks for finished db calls in the tk mainloop
+
+
+# Metrics section
+METRICS_ENABLED = False #opt in, records call counts, latency histograms and rows returned for the hot paths
+METRICS_MODE = 'timer' #'timer' for lightweight timers only, 'cprofile' to also profile the instrumented calls
+METRICS_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000) #upper bounds of the latency histogram buckets
+METRICS_DUMP_FILE = 'logs/metrics.json' #written when the app closes, the cprofile stats go next to it as .prof
+STARTUP_BUDGET_MS = 500 #time to first paint, a warning is logged when startup takes longer
+SLOW_CALL_MS = 100 #instrumented calls slower than this are listed on the diagnostics page, even with metrics off. None to not keep them
+SLOW_CALL_LOG_SIZE = 50 #most recent slow calls kept
+TRACEMALLOC_AT_STARTUP = False #trace memory allocations from launch, otherwise tracing starts when the diagnostics are first opened
+TRACEMALLOC_TOP = 10 #allocation sites listed on the diagnostics page
+DIAGNOSTICS_DUMP_DIR = 'logs' #diagnostics snapshots are written here from the options page
@@ -1,11 +1,19 @@
 """this is the module that will hold the controller for the daily journal app"""
 import datetime
+import queue
 import tkinter as tk
+from concurrent.futures import Future
 from enum import StrEnum
-from dateutil.relativedelta import relativedelta
+from typing import Callable
 
 import model
 import ui
+import config
+import logger
+import metrics
+from cache import LRUCache
+from worker import DBWorker
+from data_controller import DataController
 
 
 class PageId(StrEnum):
@@ -18,19 +26,42 @@ class PageId(StrEnum):
 class Controller:
     """Controller for Daily Journal. Will be responsible for interactions with the repository,
     passing entry objects between ui and the repository"""
-    def __init__(self, repository_, root: tk.Tk) -> None:
-        self.data_controller = DataController(repository_)
+    def __init__(self, repository_, root: tk.Tk, worker: DBWorker) -> None:
+        self.data_controller = DataController(repository_, worker)
         self.root = root
+        self.logger = logger.journal_logger('controller')
+
+        #finished db calls hand their callbacks to this queue, the tk mainloop polls it and runs them
+        self._ui_calls = queue.SimpleQueue()
+        self.poll_ui_calls()
+
+        #populated months are kept here so navigating back and forth doesn't go to the db every time
+        self.month_cache = LRUCache(config.MONTH_CACHE_SIZE)
+        self._month_callbacks = {}
+        self._prefetch_job = None
+        #pages by id, each one is built the first time it is shown, see get_page
+        self.ui_pages = {}
+
+        #the first month is waited on, so the main page has today's entry before the window is shown
+        today = datetime.date.today()
+        self.load_month(today.year, today.month, wait=True)
 
         #set the focus month at the beginning so it can be used by the ui. the focus day is set in the focus month setter
-        self.focus_month = datetime.date.today()
-        self.distribute_entries_to_month()
-        
-        #initialize the ui management after the initial business logic is complete
-        self.ui_pages = self.init_ui_pages(self._focus_day)
+        self.focus_month = today
+        self.load_day_entry(self._focus_day, wait=True)
+        self._opening_date = None
+
+        #initialize the ui management after the initial business logic is complete.
+        #only the main page is built now, the others are built the first time they are shown
+        self.ui_pages.update(self.init_ui_pages(self._focus_day))
         self.show_page(PageId.MAIN)
 
-        # self.get_recent_entries()
+        #unsaved text is flushed before the window closes
+        self.root.protocol('WM_DELETE_WINDOW', self.close)
+
+        #the journal is backed up on a timer while the app is open, the first one waits a full interval
+        self._backup_job = None
+        self.schedule_backup()
 
     #----------------------- focus day management -------------------
 
@@ -38,7 +69,7 @@ class Controller:
     def focus_day(self) -> model.Day:
         #using property decorator for the _focus_day variable so that it can be called easily
         return self._focus_day
-    
+
     @focus_day.setter
     def focus_day(self, day: model.Day) -> None:
         self._focus_day = day
@@ -48,125 +79,370 @@ class Controller:
     @property
     def focus_month(self) -> model.Month:
         return self._focus_month
-    
+
     @focus_month.setter
     def focus_month(self, date) -> None:
-        self._focus_month = model.Month(date.month, date.year)
+        #the month comes out of the cache, if it isn't there yet its entries are filled in once the worker returns them
+        self._focus_month = self.load_month(date.year, date.month)
         #get the focus day here so that it will stay in sync with the focus month
         self._focus_day = self._focus_month[date.day]
+        self.schedule_prefetch()
 
     @property
     def month_cal(self) -> list[list[model.Day | None]]:
         #this returns the current month calendar reference matrix to be used in the ui to build the button matrix
         return self._focus_month.month_matrix
-    
+
     @property
-    def month_year_str(self) -> str: 
+    def month_year_str(self) -> str:
         #wanted to handle the string formatting here in controller rather than in the ui
         return f'{self._focus_month.month_name} {self._focus_month.year}'
-    
+
+    @property
+    def month_loaded(self) -> bool:
+        #the ui uses this to show the calendar as pending while the month's entries are still loading
+        return self._focus_month.entries_loaded
+
+    @metrics.instrument()
     def adv_focus_month(self) -> None:
-        #Had to have a way to keep track of the current date, so just used the focus date. 
+        #Had to have a way to keep track of the current date, so just used the focus date.
         #Since the calendar is used only to choose a previous date
-        cur_date = datetime.date(self._focus_month.year, self._focus_month.month_num, 1)
-        next_month = cur_date + relativedelta(months = 1)
-        self.focus_month = next_month
-        self.distribute_entries_to_month()
+        year, month_num = model.shift_month(self._focus_month.year, self._focus_month.month_num, 1)
+        self.focus_month = datetime.date(year, month_num, 1)
+        #the calendar page draws the month straight away, it only needs redrawing if the entries were still loading
+        if not self.month_loaded:
+            self.when_month_loaded(self._focus_month, self.refresh_calendar)
 
+    @metrics.instrument()
     def rev_focus_month(self) -> None:
-        #Had to have a way to keep track of the current date, so just used the focus date. 
+        #Had to have a way to keep track of the current date, so just used the focus date.
         #Since the calendar is used only to choose a previous date
-        cur_date = datetime.date(self._focus_month.year, self._focus_month.month_num, 1)
-        next_month = cur_date + relativedelta(months = -1)
-        self.focus_month = next_month
-        self.distribute_entries_to_month()
-    
+        year, month_num = model.shift_month(self._focus_month.year, self._focus_month.month_num, -1)
+        self.focus_month = datetime.date(year, month_num, 1)
+        #the calendar page draws the month straight away, it only needs redrawing if the entries were still loading
+        if not self.month_loaded:
+            self.when_month_loaded(self._focus_month, self.refresh_calendar)
+
+    #------------------------ month cache management ------------------
+
+    def load_month(self, year: int, month_num: int, wait: bool = False) -> model.Month:
+        """Returns the month for year and month_num, only going to the db when it isn't cached.
+        A month that isn't cached is returned straight away and filled in when the worker is done,
+        unless wait is set"""
+        key = (year, month_num)
+        month = self.month_cache.get(key)
+        if month is None:
+            month = model.Month(month_num, year)
+            self.month_cache.put(key, month)
+            future = self.request_month_entries(key, month)
+            if wait:
+                month.populate_days_with_entries(future.result())
+        return month
+
+    def request_month_entries(self, key: tuple[int, int], month: model.Month) -> Future:
+        #only the entry index is loaded with the month, the full text is loaded when a day is opened
+        start_date, end_date = month.start_and_end_dates()
+        future = self.data_controller.get_months_entry_index(start_date, end_date)
+        self.run_async(future, lambda entries: self.month_entries_loaded(key, month, entries))
+        return future
+
+    def month_entries_loaded(self, key: tuple[int, int], month: model.Month, entries: list[tuple]) -> None:
+        if self.month_cache.peek(key) is not month:
+            #the month was invalidated while it was loading, so these entries may already be out of date.
+            #the focus month is asked for again, anything else will be loaded the next time it's needed
+            if month is self._focus_month:
+                self.month_cache.put(key, month)
+                self.request_month_entries(key, month)
+            return
+        if not month.entries_loaded:
+            month.populate_days_with_entries(entries)
+        for callback in self._month_callbacks.pop(key, []):
+            callback()
+
+    def when_month_loaded(self, month: model.Month, callback: Callable[[], None]) -> None:
+        #runs the callback once the month has its entries, straight away if it already has them
+        if month.entries_loaded:
+            callback()
+        else:
+            self._month_callbacks.setdefault((month.year, month.month_num), []).append(callback)
+
+    def load_day_entry(self, day: model.Day, on_loaded: Callable[[], None] | None = None, wait: bool = False) -> None:
+        """Makes sure the day holds its full entry text, then runs on_loaded. The text is kept on the cached month,
+        so a day that was opened before doesn't go back to the db"""
+        if day.entry_loaded or day.entry_streaming:
+            #a streaming entry is opened with the chunks that are in, the editor is handed the rest as they arrive
+            if on_loaded:
+                on_loaded()
+            return
+        if not wait and config.ENTRY_CHUNK_THRESHOLD is not None and day.entry_length >= config.ENTRY_CHUNK_THRESHOLD:
+            self.request_entry_chunks(day, 0, on_loaded)
+            return
+        future = self.data_controller.get_entry(day.date)
+        if wait:
+            self.day_entry_loaded(day, future.result(), on_loaded)
+        else:
+            self.run_async(future, lambda entry: self.day_entry_loaded(day, entry, on_loaded))
+
+    def day_entry_loaded(self, day: model.Day, entry: str | None, on_loaded: Callable[[], None] | None) -> None:
+        #a save made while the text was loading is newer than what came back, so it is kept
+        if not day.entry_loaded:
+            day.set_entry(entry or '')
+        if on_loaded:
+            on_loaded()
+
+    def request_entry_chunks(self, day: model.Day, start: int, on_loaded: Callable[[], None] | None = None) -> None:
+        #large entries are read a batch of chunks at a time, each batch is its own job on the worker
+        future = self.data_controller.get_entry_chunks(day.date, start, config.EDITOR_CHUNK_BATCH)
+        self.run_async(future, lambda chunks: self.entry_chunks_loaded(day, start, chunks, on_loaded))
+
+    def entry_chunks_loaded(self, day: model.Day, start: int, chunks: list[str], on_loaded: Callable[[], None] | None) -> None:
+        """The day is opened once the first batch is in, later batches are passed on to the editor"""
+        #a save made while the text was loading is newer than what came back, so the rest isn't needed
+        if day.entry_loaded:
+            return
+        complete = len(chunks) < config.EDITOR_CHUNK_BATCH
+        day.add_loaded_chunks(chunks, complete)
+        if start == 0:
+            if on_loaded:
+                on_loaded()
+        else:
+            self.ui_pages[PageId.MAIN].append_chunks(day, chunks, complete)
+        if not complete:
+            self.request_entry_chunks(day, start + len(chunks))
+
+    def invalidate_month(self, date: datetime.date) -> None:
+        self.month_cache.invalidate((date.year, date.month))
+
+    def schedule_prefetch(self) -> None:
+        #the prefetch waits until tk is idle, so the month that was asked for is queued first.
+        #only the latest request matters, so any prefetch still waiting is cancelled.
+        #the adjacent months are only needed for browsing, so nothing is prefetched until the calendar is opened
+        if not config.MONTH_PREFETCH or PageId.CALENDAR not in self.ui_pages:
+            return
+        if self._prefetch_job is not None:
+            self.root.after_cancel(self._prefetch_job)
+        self._prefetch_job = self.root.after_idle(self.prefetch_adjacent_months)
+
+    def prefetch_adjacent_months(self) -> None:
+        """Loads the months before and after the focus month into the cache"""
+        self._prefetch_job = None
+        for step in (1, -1):
+            self.load_month(*model.shift_month(self._focus_month.year, self._focus_month.month_num, step))
+
+    #------------------------- background call management ---------------------
+
+    def run_async(self, future: Future, on_success: Callable | None = None, on_error: Callable | None = None) -> None:
+        """Runs on_success with the result of future, or on_error with its exception, on the tk thread"""
+        future.add_done_callback(lambda f: self.call_in_ui(self.handle_result, f, on_success, on_error))
+
+    def call_in_ui(self, func: Callable, *args) -> None:
+        #tkinter can only be used from the mainloop thread, so the worker queues calls here instead
+        self._ui_calls.put((func, args))
+
+    def handle_result(self, future: Future, on_success: Callable | None, on_error: Callable | None) -> None:
+        error = future.exception()
+        if error is not None:
+            self.logger.error('Background db call failed', exc_info=error)
+            if on_error:
+                on_error(error)
+        elif on_success:
+            on_success(future.result())
+
+    def poll_ui_calls(self) -> None:
+        while True:
+            try:
+                func, args = self._ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            func(*args)
+        self.root.after(config.DB_POLL_INTERVAL, self.poll_ui_calls)
+
     #------------------------- UI management ---------------------
 
     def init_ui_pages(self, init_day: model.Day) -> dict:
         pages = {
             PageId.MAIN: ui.MainPage(self.root, self, init_day),
-            PageId.CALENDAR: ui.CalendarPage(self.root, self),
-            PageId.OPTIONS: ui.OptionsPage(self.root, self)
         }
         return pages
-    
-    def show_page(self, page_name: PageId) -> None:
-        #This is to let controller manage the ui view, raising the appropriate page to the top
+
+    def get_page(self, page_name: PageId):
+        """Returns the page, building it the first time it is asked for. The calendar page loads the
+        calendar and recent entries when it is built, so those queries wait until it is first opened"""
         page = self.ui_pages.get(page_name)
+        if page is None:
+            if page_name == PageId.CALENDAR:
+                page = ui.CalendarPage(self.root, self)
+            elif page_name == PageId.OPTIONS:
+                page = ui.OptionsPage(self.root, self)
+            else:
+                return None
+            self.ui_pages[page_name] = page
+            if page_name == PageId.CALENDAR:
+                self.schedule_prefetch()
+        return page
+
+    def show_page(self, page_name: PageId) -> None:
+        #This is to let controller manage the ui view, raising the appropriate page to the top.
+        #any unsaved text is saved first, since the other pages can change the focus day
+        if page_name != PageId.MAIN:
+            self.ui_pages[PageId.MAIN].flush_autosave()
+        page = self.get_page(page_name)
         if page:
             page.tkraise()
 
+    def close(self) -> None:
+        #the final save is queued before the window goes, the db worker writes it before it stops
+        self.ui_pages[PageId.MAIN].flush_autosave()
+        self.root.destroy()
+
+    def refresh_calendar(self) -> None:
+        #a calendar that hasn't been built yet draws the current month when it is
+        page = self.ui_pages.get(PageId.CALENDAR)
+        if page is not None:
+            page.refresh_calendar_frame()
+
+    def show_focus_day(self, raise_page: bool = True) -> None:
+        #the day's full text is loaded before the main page shows it
+        self.load_day_entry(self._focus_day, lambda: self.open_focus_day(raise_page))
+
+    def open_focus_day(self, raise_page: bool = True) -> None:
+        self.ui_pages[PageId.MAIN].init_day_info(self._focus_day)
+        self.refresh_calendar()
+        if raise_page:
+            self.show_page(PageId.MAIN)
+
+    @metrics.instrument()
     def calendar_button_clicked(self, day_of_month: int) -> None:
-        """Call back method bound to calendar buttons. This switches focus to given day_of_month"""
+        """Call back method bound to calendar buttons. This switches focus to given day_of_month
+        once its full entry text is loaded"""
         day = self._focus_month[day_of_month]
+        #if another day is clicked while this one is loading, only the last click is opened
+        self._opening_date = day.date
+        self.load_day_entry(day, lambda: self.open_clicked_day(day))
+
+    def open_clicked_day(self, day: model.Day) -> None:
+        if day.date != self._opening_date:
+            return
+        self._opening_date = None
         self.focus_day = day
-        self.ui_pages[PageId.MAIN].init_day_info(day)
-        self.show_page(PageId.MAIN)
+        #the calendar marks the focused day, the pooled buttons make this refresh cheap
+        self.open_focus_day()
 
+    @metrics.instrument()
     def today_clicked(self) -> None:
+        self._opening_date = None
         self.focus_month = datetime.date.today()
-        self.distribute_entries_to_month()
-        self.ui_pages[PageId.MAIN].init_day_info(self._focus_day)
-        self.ui_pages[PageId.CALENDAR].refresh_calendar_frame()
-        self.show_page(PageId.MAIN)
+        self.refresh_calendar()
+        self.when_month_loaded(self._focus_month, self.show_focus_day)
 
-    def get_recent_entries(self) -> list[tuple]:
-        entries = self.data_controller.get_recent_entries(3)
-        return entries
+    def get_recent_entries(self, on_loaded: Callable[[list[tuple]], None]) -> None:
+        future = self.data_controller.get_recent_entries(3)
+        self.run_async(future, on_loaded)
 
-    
+    #--------------------- Data Controller interaction ----------------------
 
+    def export_entries(self, path: str, progress=None, on_done=None, on_error=None) -> None:
+        future = self.data_controller.export_entries(path, self.ui_progress(progress))
+        self.run_async(future, on_done, on_error)
 
-    #--------------------- Data Controller interaction ----------------------
+    def import_entries(self, path: str, conflict: str, progress=None, on_done=None, on_error=None) -> None:
+        future = self.data_controller.import_entries(path, conflict, self.ui_progress(progress))
+        self.run_async(future, lambda count: self.entries_imported(count, on_done), on_error)
 
+    def entries_imported(self, count: int, on_done=None) -> None:
+        #imported entries can land in any month, so none of the cached months can be trusted
+        self.month_cache.clear()
+        self.focus_month = self._focus_day.date
+        self.when_month_loaded(self._focus_month, lambda: self.show_focus_day(raise_page=False))
+        if on_done:
+            on_done(count)
+
+    def load_diagnostics(self, on_loaded: Callable[[dict], None], on_error=None) -> None:
+        """Reads the db figures, slow calls and top memory allocations on the worker, then adds the month cache
+        figures, which are kept on the tk thread. Memory tracing starts the first time this is called"""
+        metrics.start_memory_tracing()
+        future = self.data_controller.diagnostics()
+        self.run_async(future, lambda info: on_loaded(self.process_diagnostics(info)), on_error)
+
+    def process_diagnostics(self, info: dict) -> dict:
+        lookups = self.month_cache.hits + self.month_cache.misses
+        info['month_cache'] = {
+            'months': len(self.month_cache),
+            'hits': self.month_cache.hits,
+            'misses': self.month_cache.misses,
+            'hit_rate': round(self.month_cache.hits / lookups, 3) if lookups else 0.0,
+        }
+        return info
+
+    def dump_diagnostics(self, on_done: Callable[[str], None], on_error=None) -> None:
+        #the snapshot is written on the worker too, once the figures are in
+        self.load_diagnostics(lambda info: self.run_async(self.data_controller.dump_diagnostics(info), on_done, on_error), on_error)
+
+    def run_maintenance(self, task: str, on_done=None, on_error=None) -> None:
+        """Runs 'vacuum' or 'analyze' on the worker, queued behind any saves"""
+        future = self.data_controller.vacuum() if task == 'vacuum' else self.data_controller.analyze()
+        self.run_async(future, on_done, on_error)
+
+    def backup_now(self, progress=None, on_done=None, on_error=None) -> None:
+        """Starts a backup straight away. progress gets (pages copied, total pages) on the tk thread,
+        on_done the list of new snapshot paths"""
+        future = self.data_controller.backup(self.ui_progress(progress))
+        self.run_async(future, on_done, on_error)
+
+    def schedule_backup(self) -> None:
+        if config.BACKUP_INTERVAL_MINUTES:
+            self._backup_job = self.root.after(config.BACKUP_INTERVAL_MINUTES * 60 * 1000, self.scheduled_backup)
+
+    def scheduled_backup(self) -> None:
+        #a failed backup is logged by the backup thread, the timer carries on either way
+        self.backup_now()
+        self.schedule_backup()
+
+    def ui_progress(self, progress):
+        #progress is reported from the worker thread, so it is passed back to the tk thread before reaching the ui
+        if progress is None:
+            return None
+        return lambda *counts: self.call_in_ui(progress, *counts)
+
+    @metrics.instrument()
     def save_day(self, entry) -> None:
         #wanted to make sure to extract the needed data to pass to the data controller,
         #rather than pass the day object
-        date = self._focus_day.date
-        if self._focus_day.entry:
-            self.data_controller.update_entry(date, entry)
-        else:
-            self.data_controller.save_entry(date, entry)
-        self._focus_day.set_entry(entry)
+        day = self._focus_day
+        date = day.date
+        #nothing to write if the text hasn't changed since the last save.
+        #a large entry that is still streaming in is never saved, the editor only has part of it
+        if entry == day.entry or day.entry_streaming:
+            return
+        future = self.data_controller.queue_save(date, entry)
+        #the day is updated straight away, the cached month holds this same day so it stays in sync.
+        #if the month is still loading, its entries would overwrite the day, so it is dropped and loaded again
+        month = self.month_cache.peek((date.year, date.month))
+        if month is not None and not month.entries_loaded:
+            self.invalidate_month(date)
+        day.set_entry(entry)
+        self.ui_pages[PageId.MAIN].set_saving(True)
+        self.run_async(future, lambda _: self.day_saved(date), lambda _: self.day_save_failed(date))
+
+    def day_saved(self, date: datetime.date) -> None:
+        self.ui_pages[PageId.MAIN].set_saving(False)
+        #the day may have just gained an entry, which the calendar shows
+        self.refresh_calendar()
+
+    def day_save_failed(self, date: datetime.date) -> None:
+        #the day already holds the unsaved text, so the month is dropped to get it back in line with the db
+        self.invalidate_month(date)
+        self.ui_pages[PageId.MAIN].set_saving(False)
+        self.ui_pages[PageId.MAIN].show_save_error()
 
     def delete_entry(self, date: datetime.date) -> None:
-        if self._focus_day.entry:
-            self.data_controller.delete_entry(date)
+        if self._focus_day.has_entry:
+            future = self.data_controller.delete_entry(date)
             self._focus_day.delete_entry()
+            self.run_async(future, on_error=lambda _: self.invalidate_month(date))
 
-    def distribute_entries_to_month(self) -> None:
+    def distribute_entries_to_month(self, month: model.Month | None = None) -> None:
         #this should just request the entries from the data controller and pass it directly to the month instance
-        start_date, end_date = self.focus_month.start_and_end_dates()
-        entries = self.data_controller.get_months_entries(start_date, end_date)
-        self._focus_month.populate_days_with_entries(entries)
-
-    
-
-    
-    
-
-class DataController:
-    """This controller will interact with the repository and pass data to the main controller
-    The data and main controller are separated in case the data controller needs to do more with the repository"""
-    def __init__(self, repository_) -> None:
-        self.entries = repository_
-
-    def save_entry(self, date: datetime.date, entry: str) -> None:
-        self.entries.store_entry(date, entry)
-
-    def update_entry(self, date: datetime.date, entry: str) -> None:
-        self.entries.update_entry(date, entry)
-    
-    def get_months_entries(self, start_date: datetime.date, end_date: datetime.date) -> list[tuple]:
-        entries_list = self.entries.get_entries(start_date, end_date)
-        return entries_list
-    
-    def delete_entry(self, date: datetime.date) -> None:
-        self.entries.delete_entry(date)
-
-    def get_recent_entries(self, num_entries) -> list[tuple]:
-        entries = self.entries.get_recent_entries(num_entries)
-        return entries
-    
-    
\ No newline at end of file
+        if month is None:
+            month = self._focus_month
+        self.request_month_entries((month.year, month.month_num), month)
@@ -0,0 +1,192 @@
+"""The data controller sits between the controllers and the repository. Every call is queued on the db worker,
+so this module has no ui dependencies and can be used by the command line as well as the gui controller"""
+
+import datetime
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+import backup
+import config
+import metrics
+import transfer
+from repository import ConflictPolicy, TagMatch
+from worker import DBWorker
+
+
+class DataController:
+    """This controller will interact with the repository and pass data to the main controller
+    The data and main controller are separated in case the data controller needs to do more with the repository.
+    Every call is queued on the db worker and returns a Future. Calls that only read use submit_read,
+    so they can run on a reader connection while the worker is busy"""
+    def __init__(self, repository_, worker: DBWorker) -> None:
+        self.entries = repository_
+        self.worker = worker
+        self.backups = backup.BackupManager()
+
+        #saves waiting on the worker, by date. a newer save for the same date replaces the queued text
+        #instead of queueing a second write
+        self._save_lock = threading.Lock()
+        self._queued_saves = {}
+        self._save_futures = {}
+
+    def queue_save(self, date: datetime.date, entry: str) -> Future:
+        """Queues a write of entry for date. Saves for the same date are coalesced while the write is waiting,
+        so only the latest text is written. Returns the Future of the write that will carry entry"""
+        with self._save_lock:
+            self._queued_saves[date] = entry
+            future = self._save_futures.get(date)
+            if future is None:
+                future = self.worker.submit(self.write_queued_save, date)
+                self._save_futures[date] = future
+        return future
+
+    def write_queued_save(self, date: datetime.date) -> None:
+        #runs on the worker thread, the latest text is only picked up now that the write is starting.
+        #the repository decides between insert and update, so a day that was never loaded can't be written the wrong way
+        with self._save_lock:
+            entry = self._queued_saves.pop(date)
+            del self._save_futures[date]
+        self.entries.upsert_entry(date, entry)
+
+    def run_in_transaction(self, func: Callable, *args) -> Future:
+        """Runs func(entries, *args) on the worker inside one transaction, so all the repository calls it makes
+        are committed together"""
+        def unit_of_work():
+            with self.entries.transaction():
+                return func(self.entries, *args)
+        return self.worker.submit(unit_of_work)
+
+    def append_entry(self, date: datetime.date, entry: str) -> Future:
+        """Adds entry to the end of the date's entry on a new line, or stores it if the date has none"""
+        return self.worker.submit(self.entries.import_entries, [(date, entry)], ConflictPolicy.APPEND)
+
+    def save_many(self, rows: list[tuple[datetime.date, str]]) -> Future:
+        return self.worker.submit(self.entries.upsert_many, rows)
+
+    def delete_many(self, dates: list[datetime.date]) -> Future:
+        return self.worker.submit(self.entries.delete_many, dates)
+
+    def save_entry(self, date: datetime.date, entry: str) -> Future:
+        return self.worker.submit(self.entries.store_entry, date, entry)
+
+    def update_entry(self, date: datetime.date, entry: str) -> Future:
+        return self.worker.submit(self.entries.update_entry, date, entry)
+
+    def get_months_entries(self, start_date: datetime.date, end_date: datetime.date) -> Future:
+        return self.worker.submit_read(self.entries.get_entries, start_date, end_date)
+
+    def get_months_entry_index(self, start_date: datetime.date, end_date: datetime.date) -> Future:
+        return self.worker.submit_read(self.entries.get_entry_index, start_date, end_date)
+
+    def get_entry(self, date: datetime.date) -> Future:
+        return self.worker.submit_read(self.entries.get_entry, date)
+
+    def get_entry_chunks(self, date: datetime.date, start: int = 0, limit: int | None = None) -> Future:
+        return self.worker.submit_read(self.entries.get_entry_chunks, date, start, limit)
+
+    def delete_entry(self, date: datetime.date) -> Future:
+        return self.worker.submit(self.entries.delete_entry, date)
+
+    def get_recent_entries(self, num_entries) -> Future:
+        return self.worker.submit_read(self.entries.get_recent_entries, num_entries)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Future:
+        return self.worker.submit_read(self.entries.search, query, limit, offset)
+
+    def rebuild_search_index(self) -> Future:
+        return self.worker.submit(self.entries.rebuild_search_index)
+
+    def get_year_stats(self, year: int) -> Future:
+        return self.worker.submit_read(self.entries.get_year_stats, year)
+
+    def rebuild_stats(self) -> Future:
+        return self.worker.submit(self.entries.rebuild_stats)
+
+    def list_revisions(self, date: datetime.date) -> Future:
+        return self.worker.submit_read(self.entries.list_revisions, date)
+
+    def get_revision(self, date: datetime.date, revision: int) -> Future:
+        return self.worker.submit_read(self.entries.get_revision, date, revision)
+
+    def restore_revision(self, date: datetime.date, revision: int) -> Future:
+        return self.worker.submit(self.entries.restore_revision, date, revision)
+
+    def compact_revisions(self, keep: int | None = config.REVISION_KEEP_COUNT,
+                          max_age_days: int | None = config.REVISION_MAX_AGE_DAYS) -> Future:
+        return self.worker.submit(self.entries.compact_revisions, keep, max_age_days)
+
+    def tag_entry(self, date: datetime.date, *names: str) -> Future:
+        return self.worker.submit(self.entries.tag_entry, date, *names)
+
+    def untag_entry(self, date: datetime.date, *names: str) -> Future:
+        return self.worker.submit(self.entries.untag_entry, date, *names)
+
+    def get_tags(self, date: datetime.date) -> Future:
+        return self.worker.submit_read(self.entries.get_tags, date)
+
+    def list_tags(self) -> Future:
+        return self.worker.submit_read(self.entries.list_tags)
+
+    def find_by_tags(self, names: list[str], match: TagMatch = TagMatch.ALL, start_date: datetime.date = datetime.date.min,
+                     end_date: datetime.date = datetime.date.max, exclude: list[str] = ()) -> Future:
+        return self.worker.submit_read(self.entries.find_by_tags, names, match, start_date, end_date, exclude)
+
+    def set_mood(self, date: datetime.date, mood: int | None) -> Future:
+        return self.worker.submit(self.entries.set_mood, date, mood)
+
+    def get_moods(self, start_date: datetime.date, end_date: datetime.date) -> Future:
+        return self.worker.submit_read(self.entries.get_moods, start_date, end_date)
+
+    def recompress_entries(self, batch_size: int = 500, progress=None) -> Future:
+        """Re-encodes every entry with the current compression settings in the background. Each batch is its own
+        job on the worker, so saves and month loads queued in the meantime run between batches.
+        The Future gives the number of rows rewritten"""
+        done = Future()
+
+        def recompress_from(after_id: int, rewritten: int):
+            try:
+                last_id, count = self.entries.recompress_batch(after_id, batch_size)
+            except Exception as error:
+                done.set_exception(error)
+                return
+            if last_id is None:
+                done.set_result(rewritten)
+                return
+            if progress is not None:
+                progress(rewritten + count)
+            self.worker.submit(recompress_from, last_id, rewritten + count)
+
+        self.worker.submit(recompress_from, 0, 0)
+        return done
+
+    def storage_stats(self) -> Future:
+        return self.worker.submit_read(self.entries.storage_stats)
+
+    def diagnostics(self) -> Future:
+        """The db figures, with the slow calls and top memory allocations. They are all read on the worker,
+        a tracemalloc snapshot of a long session takes too long for the tk thread"""
+        def read():
+            return {'db': self.entries.diagnostics(), 'slow_calls': metrics.slow_calls(), 'memory_top': metrics.memory_top()}
+        return self.worker.submit_read(read)
+
+    def dump_diagnostics(self, diagnostics: dict) -> Future:
+        #no db work, but the profile stats written next to the json can be large
+        return self.worker.submit_read(metrics.dump_snapshot, diagnostics)
+
+    def vacuum(self) -> Future:
+        return self.worker.submit(self.entries.vacuum)
+
+    def analyze(self) -> Future:
+        return self.worker.submit(self.entries.analyze)
+
+    def backup(self, progress=None) -> Future:
+        """Snapshots the journal on the backup thread rather than the worker, so saves aren't held up by it.
+        The Future gives the paths of the new snapshots"""
+        return self.backups.start(self.entries.database_files(), progress)
+
+    def export_entries(self, path: str, progress=None) -> Future:
+        return self.worker.submit_read(transfer.export_entries, self.entries, path, progress=progress)
+
+    def import_entries(self, path: str, conflict: str, progress=None) -> Future:
+        return self.worker.submit(transfer.import_entries, self.entries, path, conflict=conflict, progress=progress)
@@ -0,0 +1,58 @@
+"""Line based deltas between two versions of an entry's text, used to keep revision history small.
+A delta is a compact json list of operations: a positive int copies that many lines from the source,
+a negative int skips that many lines, and a string is inserted as is"""
+
+import json
+from difflib import SequenceMatcher
+
+from config import REVISION_DIFF_MAX_LINES
+
+
+def make_delta(source: str, target: str, max_lines: int | None = REVISION_DIFF_MAX_LINES) -> str:
+    """Returns a delta that turns source into target. The lines the two have in common at the start and end
+    are copied without being diffed, so the cost follows the size of the edit rather than of the text.
+    When more than max_lines lines in between changed they are replaced as a whole instead of diffed"""
+    source_lines = source.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    shortest = min(len(source_lines), len(target_lines))
+    start = 0
+    while start < shortest and source_lines[start] == target_lines[start]:
+        start += 1
+    end = 0
+    while end < shortest - start and source_lines[-1 - end] == target_lines[-1 - end]:
+        end += 1
+    source_changed = source_lines[start:len(source_lines) - end]
+    target_changed = target_lines[start:len(target_lines) - end]
+
+    ops = [start] if start else []
+    if max_lines is not None and max(len(source_changed), len(target_changed)) > max_lines:
+        opcodes = [('replace', 0, len(source_changed), 0, len(target_changed))]
+    else:
+        opcodes = SequenceMatcher(None, source_changed, target_changed, autojunk=False).get_opcodes()
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(-(i2 - i1))
+        if j2 > j1:
+            ops.append(''.join(target_changed[j1:j2]))
+    if end:
+        ops.append(end)
+    return json.dumps(ops, separators=(',', ':'), ensure_ascii=False)
+
+
+def apply_delta(source: str, delta: str) -> str:
+    """Applies a delta made by make_delta to source and returns the target text"""
+    source_lines = source.splitlines(keepends=True)
+    parts = []
+    position = 0
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.extend(source_lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(parts)
@@ -0,0 +1,81 @@
+"""Encoding of entry bodies for storage. Small entries are stored as plain text, bodies above
+ENTRY_COMPRESS_THRESHOLD bytes are stored zlib compressed. The codec of each row is kept next to it,
+so rows written before compression existed, or with other settings, keep working.
+Entries of ENTRY_CHUNK_THRESHOLD characters or more are split into chunks, each chunk encoded on its own"""
+
+import sqlite3
+import zlib
+from enum import StrEnum
+
+from config import ENTRY_COMPRESS_THRESHOLD, ENTRY_COMPRESS_LEVEL, ENTRY_CHUNK_SIZE, ENTRY_CHUNK_THRESHOLD
+
+
+class Codec(StrEnum):
+    PLAIN = 'plain'
+    ZLIB = 'zlib'
+    #the text is in the chunks table. pending is only seen inside a write, while the chunks are being replaced
+    CHUNKED = 'chunked'
+    PENDING = 'pending'
+
+
+def is_chunked(text: str) -> bool:
+    return ENTRY_CHUNK_THRESHOLD is not None and len(text) >= ENTRY_CHUNK_THRESHOLD
+
+
+def split_chunks(text: str, size: int = ENTRY_CHUNK_SIZE) -> list[str]:
+    """Splits text into chunks of at most size characters. Chunks end after a line break where there is one,
+    so an edit only changes the chunks around it, and a line is only split when it is longer than a chunk.
+    A long line is split after a space, so no word is cut in two, the search index and word counts go by chunk"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + size
+        if end < len(text):
+            cut = text.rfind('\n', start, end)
+            if cut < start:
+                cut = text.rfind(' ', start, end)
+            if cut >= start:
+                end = cut + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+def encode_entry(text: str) -> tuple[str | bytes, str]:
+    """Returns (stored value, codec) for text. Compression is only kept when it makes the row smaller"""
+    raw = text.encode('utf-8')
+    if ENTRY_COMPRESS_THRESHOLD is not None and len(raw) >= ENTRY_COMPRESS_THRESHOLD:
+        compressed = zlib.compress(raw, ENTRY_COMPRESS_LEVEL)
+        if len(compressed) < len(raw):
+            return compressed, Codec.ZLIB.value
+    return text, Codec.PLAIN.value
+
+
+def decode_entry(data: str | bytes | None, codec: str) -> str | None:
+    if data is None or codec == Codec.PLAIN:
+        return data
+    return zlib.decompress(data).decode('utf-8')
+
+
+def decode_prefix(data: str | bytes | None, codec: str, length: int) -> str | None:
+    """Returns the first length characters, only inflating as much of the body as that needs"""
+    if data is None or codec == Codec.PLAIN:
+        return data[:length] if data is not None else None
+    decompressor = zlib.decompressobj()
+    #a character is at most 4 bytes of utf-8, the partial last character is dropped by errors='ignore'
+    raw = decompressor.decompress(data, length * 4)
+    return raw.decode('utf-8', errors='ignore')[:length]
+
+
+def count_words(data: str | bytes | None, codec: str) -> int:
+    text = decode_entry(data, codec)
+    return len(text.split()) if text else 0
+
+
+def register_functions(conn: sqlite3.Connection) -> None:
+    """Makes the decoders available to sql as entry_text(entry, codec), entry_prefix(entry, codec, length)
+    and word_count(entry, codec). The search index and the stats triggers use these, so every connection
+    that writes entries needs them"""
+    conn.create_function('entry_text', 2, decode_entry, deterministic=True)
+    conn.create_function('entry_prefix', 3, decode_prefix, deterministic=True)
+    conn.create_function('word_count', 2, count_words, deterministic=True)
@@ -1,40 +1,94 @@
 """Main logging configuration for the daily journal app. 
-All global values can be found in config.py"""
+All global values can be found in config.py.
+Records are put on a queue by the logging calls and written to the log file by a listener thread,
+so file writes and rotation never happen on the ui thread"""
 
 import config as config
 
 import logging
 import pathlib
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 #default logger name
 JOURNAL_LOGGER_NAME = 'journal'
 
+#the listener and its file handler, kept so they can be stopped when the app closes
+_listener = None
+_file_handler = None
+
+
+class SamplingFilter(logging.Filter):
+    """Lets one in every rate records through for each message, to keep high frequency events from flooding the log.
+    Warnings and errors always pass. Records are grouped by their unformatted message, so every kind of event
+    still shows up"""
+    def __init__(self, rate: int) -> None:
+        super().__init__()
+        self.rate = rate
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            count = self._counts.get(record.msg, 0)
+            self._counts[record.msg] = count + 1
+        return count % self.rate == 0
+
 
 def configure_logger(
         name = JOURNAL_LOGGER_NAME,
         log_file = config.LOGGING_FILE_NAME,
         level = config.LOGGING_LEVEL,
         size_limit = config.LOGGING_MAX_LOG_SIZE,
-        backup_count = config.LOGGING_FILE_BACKUP_COUNT):
+        backup_count = config.LOGGING_FILE_BACKUP_COUNT,
+        module_levels = config.LOGGING_MODULE_LEVELS,
+        sampling = config.LOGGING_SAMPLING):
     
     """ Sets up the default Journal logger based on the values from config """
+    global _listener, _file_handler
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
     if not logger.hasHandlers():
         # Create folder structure for log files in case it doesn't exist yet...
-        log_dir = pathlib.Path(config.LOGGING_FILE_NAME).parent
+        log_dir = pathlib.Path(log_file).parent
         log_dir.mkdir(parents=True, exist_ok=True)
         # Keep the logging configuration to a minimum
-        handler = RotatingFileHandler(log_file, maxBytes=size_limit, backupCount=backup_count)
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logger.addHandler(handler)
+        _file_handler = RotatingFileHandler(log_file, maxBytes=size_limit, backupCount=backup_count)
+        _file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+        # the logger only puts records on the queue, the listener thread does the writing
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(QueueHandler(log_queue))
+        _listener = QueueListener(log_queue, _file_handler, respect_handler_level=True)
+        _listener.start()
+
+    # module loggers are children of the journal logger, so each can have its own level
+    for module, module_level in module_levels.items():
+        logging.getLogger(f'{name}.{module}').setLevel(module_level)
+    for module, rate in sampling.items():
+        logging.getLogger(f'{name}.{module}').addFilter(SamplingFilter(rate))
+
+
+def stop_logging():
+    """Writes out any records still on the queue, then stops the listener thread and closes the log file"""
+    global _listener, _file_handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _file_handler is not None:
+        _file_handler.close()
+        _file_handler = None
 
 
-def journal_logger() -> logging.Logger:
+def journal_logger(module: str | None = None) -> logging.Logger:
     """
         Shortcut for retrieving default Journal logger. Logger will be
-        initialized in main module.
+        initialized in main module. Given a module name, this returns that
+        module's child logger, whose level can be set in config.
     """
+    if module:
+        return logging.getLogger(f'{JOURNAL_LOGGER_NAME}.{module}')
     return logging.getLogger(JOURNAL_LOGGER_NAME)
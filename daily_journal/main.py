@@ -1,6 +1,10 @@
 """Main module for daily journal app. Will initialize the controller,
 passing it both the repository and the ui"""
 
+import time
+#taken before the other imports, so the startup report includes the time spent importing the app
+STARTUP_STARTED = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
@@ -8,15 +12,22 @@ import sqlite3
 
 import controller
 import repository
+import shards
 import logger 
+from worker import DBWorker
 import config
+import metrics
 from ui import StyleManager
 
-def db_connection(logger_: logger.logging.Logger) -> sqlite3.Connection:
+def db_connection(logger_: logger.logging.Logger) -> repository.ConnectionManager | shards.Shards:
     """initialize the db connection at the beginning so that it can be passed around as needed,
-    rather than opening and closing multiple times throughout the app"""
+    rather than opening and closing multiple times throughout the app.
+    A sharded journal opens each year's connection the first time it is used"""
     try:
-        conn = sqlite3.connect(config.DB_NAME)
+        if config.DB_SHARDED:
+            return shards.Shards(config.DB_SHARD_DIR, logger_)
+        #the writer is only used by the db worker thread, the readers by the worker's reader threads
+        conn = repository.ConnectionManager(config.DB_NAME, logger_, config.DB_READER_POOL_SIZE)
         logger_.info('Connection to DB established')
 
     except sqlite3.Error:
@@ -34,6 +45,11 @@ def db_connection_error(message: str):
     root.withdraw()
     messagebox.showerror('Application error ', message)
     root.destroy()
+
+def first_paint():
+    """Runs once the window is first drawn, and logs how long startup took"""
+    metrics.mark_startup('first paint')
+    metrics.startup_report()
     
 def main():
     """This function will initialize the logger, as well as the other modules. """ 
@@ -41,32 +57,52 @@ def main():
     #the same logger every time
     logger.configure_logger()
     log = logger.journal_logger()
+    metrics.mark_startup('start', STARTUP_STARTED)
+    metrics.mark_startup('imports')
+    if config.TRACEMALLOC_AT_STARTUP:
+        metrics.start_memory_tracing()
+
+    try:
+        #initialize DB connection here to catch any errors with connecting to the database,
+        #stopping the rest of the app initialization 
+        conn = db_connection(log)
 
-    #initialize DB connection here to catch any errors with connecting to the database,
-    #stopping the rest of the app initialization 
-    conn = db_connection(log)
+        #initialize the tkinter window in main so the root window is 
+        # passed to all needed modules through controller
+        root = tk.Tk()
+        root.geometry(config.WINDOW_GEOMETRY)
+        root.resizable(*config.WINDOW_RESIZEABLE)
+        root.title('Daily Journal')
 
-    #initialize the tkinter window in main so the root window is 
-    # passed to all needed modules through controller
-    root = tk.Tk()
-    root.geometry(config.WINDOW_GEOMETRY)
-    root.resizable(*config.WINDOW_RESIZEABLE)
-    root.title('Daily Journal')
+        #Initialize the stylemanager here to have it attach to the root window at the beginning
+        _style_manager = StyleManager(root)
 
-    #Initialize the stylemanager here to have it attach to the root window at the beginning
-    _style_manager = StyleManager(root)
+        #the db worker owns the connection from here on, all repository calls are queued to it
+        #the shards have a connection each rather than a reader pool, so their reads stay on the worker
+        worker = DBWorker(conn, readers=0 if config.DB_SHARDED else conn.reader_count)
 
-    try:
-        app = controller.Controller(
-            repository_ = repository.Entries(conn),
-            root = root
-        )
-        #run the main loop for the UI after the the business logic is initialized
-        root.mainloop()
+        try:
+            repository_ = shards.ShardedEntries(conn) if config.DB_SHARDED else repository.Entries(conn)
+            metrics.mark_startup('db open')
+            worker.start()
+            app = controller.Controller(
+                repository_ = repository_,
+                root = root,
+                worker = worker
+            )
+            metrics.mark_startup('ui built')
+            #idle callbacks run after tk has drawn the pending widgets, so this marks the first paint
+            root.after_idle(first_paint)
+            #run the main loop for the UI after the the business logic is initialized
+            root.mainloop()
+        finally:
+            # the worker finishes any queued calls and closes the writer and every reader, to ensure they are closed properly when the app closes
+            worker.stop()
+            #only writes anything when metrics are turned on in config
+            metrics.dump()
     finally:
-        # the connection close is done here to ensure that the connection is closed properly when the app closes
-        conn.close()
-        log.info('DB Connection Closed')
+        #the listener writes out any records still queued before the app exits
+        logger.stop_logging()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,294 @@
+"""Opt in instrumentation for the hot paths. Instrumented calls record their count, a latency histogram
+and the rows they returned. Metrics can be read in process with snapshot() and are dumped to a json file
+when the app closes. Everything is switched on and off, and between plain timers and cProfile, in config"""
+
+import functools
+import inspect
+import json
+import pathlib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+import config
+import logger
+
+
+class Metric:
+    """Running totals for one instrumented name"""
+    __slots__ = ('count', 'total_ms', 'max_ms', 'rows', 'buckets')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        #one bucket per upper bound in config, plus one for anything slower
+        self.buckets = [0] * (len(config.METRICS_BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms: float, rows: int) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows
+        for index, bound in enumerate(config.METRICS_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def as_dict(self) -> dict:
+        labels = [f'<={bound}ms' for bound in config.METRICS_BUCKETS_MS] + [f'>{config.METRICS_BUCKETS_MS[-1]}ms']
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            'histogram': dict(zip(labels, self.buckets)),
+        }
+
+
+_metrics = {}
+_lock = threading.Lock()
+#each thread gets its own profiler, and tracks how deep it is in instrumented calls
+#so only the outermost call turns the profiler on
+_local = threading.local()
+_profilers = []
+#(phase, perf_counter time) for each startup phase, in the order they were marked
+_startup_marks = []
+#(time of day, name, ms) for the most recent calls over SLOW_CALL_MS, kept whether metrics are on or not
+_slow_calls = deque(maxlen=config.SLOW_CALL_LOG_SIZE)
+
+
+def enabled() -> bool:
+    return config.METRICS_ENABLED
+
+
+def record(name: str, elapsed_ms: float, rows: int = 0) -> None:
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = Metric()
+        metric.record(elapsed_ms, rows)
+
+
+def note_slow(name: str, elapsed_ms: float) -> None:
+    if config.SLOW_CALL_MS is not None and elapsed_ms >= config.SLOW_CALL_MS:
+        with _lock:
+            _slow_calls.append((time.strftime('%H:%M:%S'), name, round(elapsed_ms, 1)))
+
+
+def slow_calls() -> list[tuple[str, str, float]]:
+    """The most recent slow calls, newest first"""
+    with _lock:
+        return list(reversed(_slow_calls))
+
+
+def count_rows(result) -> int:
+    return len(result) if isinstance(result, list) else 0
+
+
+def thread_profiler() -> 'cProfile.Profile':
+    #the profiling modules are only imported in cprofile mode, so they stay off the startup path
+    import cProfile
+    profiler = getattr(_local, 'profiler', None)
+    if profiler is None:
+        profiler = _local.profiler = cProfile.Profile()
+        with _lock:
+            _profilers.append(profiler)
+    return profiler
+
+
+@contextmanager
+def profiling():
+    #only used in cprofile mode, nested instrumented calls are already covered by the outer one
+    depth = getattr(_local, 'depth', 0)
+    _local.depth = depth + 1
+    profiler = thread_profiler() if depth == 0 else None
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        _local.depth = depth
+
+
+@contextmanager
+def timed(name: str):
+    """Times the block under name. Rows can be reported by setting the 'rows' key of the yielded dict"""
+    if not enabled():
+        yield {}
+        return
+    info = {'rows': 0}
+    profile = profiling() if config.METRICS_MODE == 'cprofile' else None
+    if profile:
+        profile.__enter__()
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if profile:
+            profile.__exit__(None, None, None)
+        record(name, elapsed_ms, info['rows'])
+        note_slow(name, elapsed_ms)
+
+
+def instrument(name: str | None = None) -> Callable:
+    """Decorator version of timed. The name defaults to the function's qualified name,
+    and a returned list is counted as the rows returned. Generators are timed with instrument_generator"""
+    def decorator(func):
+        metric_name = name or func.__qualname__
+        if inspect.isgeneratorfunction(func):
+            return instrument_generator(func, metric_name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            #the check is done on every call so metrics can be switched on while the app is running.
+            #with metrics off the call is still timed for the slow call list, which is two clock reads
+            if not enabled():
+                if config.SLOW_CALL_MS is None:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    note_slow(metric_name, (time.perf_counter() - start) * 1000)
+            with timed(metric_name) as info:
+                result = func(*args, **kwargs)
+                info['rows'] = count_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def instrument_generator(func: Callable, metric_name: str) -> Callable:
+    """Times a generator across all of its steps, recorded once when it is used up or closed. Only the time spent
+    inside the generator counts, not the caller's work between items. Yielded lists count their length as rows,
+    anything else one row. Generators aren't profiled in cprofile mode, a profiler can't follow them between steps"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        iterator = func(*args, **kwargs)
+        elapsed_ms = 0.0
+        rows = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed_ms += (time.perf_counter() - start) * 1000
+                rows += count_rows(item) if isinstance(item, list) else 1
+                yield item
+        finally:
+            iterator.close()
+            if enabled():
+                record(metric_name, elapsed_ms, rows)
+            note_slow(metric_name, elapsed_ms)
+    return wrapper
+
+
+def snapshot() -> dict:
+    """Returns the current metrics as plain dicts, by name"""
+    with _lock:
+        return {name: metric.as_dict() for name, metric in sorted(_metrics.items())}
+
+
+def reset() -> None:
+    with _lock:
+        _metrics.clear()
+
+
+def dump(path: str = config.METRICS_DUMP_FILE) -> None:
+    """Writes the metrics to path as json. In cprofile mode the profile stats are written next to it"""
+    if not enabled():
+        return
+    dump_path = pathlib.Path(path)
+    dump_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(dump_path, 'w', encoding='utf-8') as file:
+        json.dump({'mode': config.METRICS_MODE, 'metrics': snapshot()}, file, indent=2)
+
+    write_profile(dump_path.with_suffix('.prof'))
+    logger.journal_logger('metrics').info('Metrics written to %s', dump_path)
+
+
+def write_profile(path: pathlib.Path) -> bool:
+    #the cprofile stats of every thread, merged. only there in cprofile mode
+    with _lock:
+        profilers = list(_profilers)
+    if not profilers:
+        return False
+    import pstats
+    stats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        stats.add(profiler)
+    stats.dump_stats(str(path))
+    return True
+
+
+def start_memory_tracing() -> None:
+    #tracemalloc slows every allocation down a little, so it is only started when asked for
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def memory_top(limit: int = config.TRACEMALLOC_TOP) -> list[str]:
+    """The source lines that hold the most memory allocated since tracing started, biggest first"""
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), ))
+    return [str(stat) for stat in snapshot.statistics('lineno')[:limit]]
+
+
+def dump_snapshot(diagnostics: dict, directory: str = config.DIAGNOSTICS_DUMP_DIR) -> pathlib.Path:
+    """Writes diagnostics, along with the metrics and startup times, to a timestamped json file in directory,
+    and the cprofile stats next to it when there are any. The slow calls and top allocations are added if
+    diagnostics doesn't have them already. Returns the json path"""
+    dump_path = pathlib.Path(directory) / f'diagnostics-{time.strftime("%Y%m%d-%H%M%S")}.json'
+    dump_path.parent.mkdir(parents=True, exist_ok=True)
+    snapshot_ = {
+        'diagnostics': diagnostics,
+        'metrics': snapshot(),
+        'startup': {phase: round((at - _startup_marks[0][1]) * 1000, 1) for phase, at in _startup_marks},
+    }
+    for key, read in (('slow_calls', slow_calls), ('memory_top', memory_top)):
+        if key not in diagnostics:
+            snapshot_[key] = read()
+    with open(dump_path, 'w', encoding='utf-8') as file:
+        json.dump(snapshot_, file, indent=2, default=str)
+    write_profile(dump_path.with_suffix('.prof'))
+    logger.journal_logger('metrics').info('Diagnostics snapshot written to %s', dump_path)
+    return dump_path
+
+
+def mark_startup(phase: str, at: float | None = None) -> None:
+    """Marks the end of a startup phase. at is a perf_counter time, for phases that started before this module was imported"""
+    _startup_marks.append((phase, time.perf_counter() if at is None else at))
+
+
+def startup_report(budget_ms: float = config.STARTUP_BUDGET_MS) -> dict:
+    """Logs how long each startup phase took, and warns when the total, the time to first paint, is over budget.
+    This is always logged, and also recorded as metrics when they are on. Returns {phase: ms}, plus 'total'"""
+    report = {}
+    for (_, previous), (phase, at) in zip(_startup_marks, _startup_marks[1:]):
+        report[phase] = round((at - previous) * 1000, 1)
+    report['total'] = round((_startup_marks[-1][1] - _startup_marks[0][1]) * 1000, 1) if _startup_marks else 0.0
+
+    if enabled():
+        for phase, elapsed_ms in report.items():
+            record(f'startup.{phase}', elapsed_ms)
+    log = logger.journal_logger('metrics')
+    log.info('Startup times in ms: %s', report)
+    if budget_ms is not None and report['total'] > budget_ms:
+        log.warning('Startup took %sms, over the %sms budget', report['total'], budget_ms)
+    return report
@@ -0,0 +1,462 @@
+"""Versioned schema migrations for the journal database. The schema version is kept in sqlite's
+PRAGMA user_version, so an older journal file is upgraded in place the next time it is opened.
+New migrations are only ever appended to MIGRATIONS, never changed once released"""
+
+import sqlite3
+from typing import Callable
+
+from config import (ENTRIES_TABLE, SEARCH_TABLE, SEARCH_CONTENT_VIEW, REVISIONS_TABLE, ENTRIES_TEXT_VIEW, STATS_TABLE, CHUNKS_TABLE,
+                    TAGS_TABLE, ENTRY_TAGS_TABLE)
+import logger
+from tags import extract_tags
+
+#dates are stored as python's date.toordinal() from schema version 8, where 0001-01-01 is day 1.
+#sqlite's julian day numbers are this far ahead of it, at midnight
+ORDINAL_JULIAN_OFFSET = 1721424.5
+
+
+def create_entries_table(cursor: sqlite3.Cursor) -> None:
+    """Creates the entries table. Journals from before migrations existed already have it"""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {ENTRIES_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date DATE UNIQUE,
+        entry TEXT
+        )''')
+
+
+def create_search_index(cursor: sqlite3.Cursor) -> None:
+    """Creates the full text search index for the entries table. The index uses the entries table
+    as external content, so the text is not stored twice, and triggers keep the index in sync"""
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        entry,
+        content='{ENTRIES_TABLE}',
+        content_rowid='id'
+        )''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON {ENTRIES_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, entry) VALUES (new.id, new.entry);
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON {ENTRIES_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, entry) VALUES ('delete', old.id, old.entry);
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE ON {ENTRIES_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, entry) VALUES ('delete', old.id, old.entry);
+            INSERT INTO {SEARCH_TABLE} (rowid, entry) VALUES (new.id, new.entry);
+        END''')
+    #the index has to be filled with the entries that are already in the journal
+    cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def analyze_entries(cursor: sqlite3.Cursor) -> None:
+    """The existing queries are already covered by indexes: date lookups and ranges use the UNIQUE(date) index,
+    and recent entries are ordered by id, which is the rowid. This gathers planner statistics for them"""
+    cursor.execute(f'ANALYZE {ENTRIES_TABLE}')
+
+
+def create_revisions_table(cursor: sqlite3.Cursor) -> None:
+    """Creates the revision history table. Each row is an older version of an entry, stored either in full
+    or as a delta against the next newer version, see Entries.record_revisions"""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {REVISIONS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        date DATE NOT NULL,
+        revision INTEGER NOT NULL,
+        replaced_at TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        data TEXT NOT NULL,
+        UNIQUE(date, revision)
+        )''')
+
+
+def compress_entries(cursor: sqlite3.Cursor) -> None:
+    """Adds the codec and text_length columns, so bodies can be stored compressed and the calendar can get
+    an entry's length without reading the body. The search index is moved onto a view that decompresses the
+    bodies, so it keeps indexing plain text. Needs the functions from entry_codec.register_functions"""
+    #the old triggers would reindex every row for the backfill below, the index is rebuilt at the end instead
+    for trigger in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{trigger}')
+    cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    cursor.execute(f"ALTER TABLE {ENTRIES_TABLE} ADD COLUMN codec TEXT NOT NULL DEFAULT 'plain'")
+    cursor.execute(f'ALTER TABLE {ENTRIES_TABLE} ADD COLUMN text_length INTEGER')
+    cursor.execute(f'UPDATE {ENTRIES_TABLE} SET text_length = length(entry)')
+
+    cursor.execute(f'''
+        CREATE VIEW IF NOT EXISTS {ENTRIES_TEXT_VIEW} AS
+        SELECT id, entry_text(entry, codec) AS entry
+        FROM {ENTRIES_TABLE}''')
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        entry,
+        content='{ENTRIES_TEXT_VIEW}',
+        content_rowid='id'
+        )''')
+    cursor.execute(f'''
+        CREATE TRIGGER {SEARCH_TABLE}_insert AFTER INSERT ON {ENTRIES_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, entry) VALUES (new.id, entry_text(new.entry, new.codec));
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON {ENTRIES_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, entry) VALUES ('delete', old.id, entry_text(old.entry, old.codec));
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER {SEARCH_TABLE}_update AFTER UPDATE OF entry ON {ENTRIES_TABLE} BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, entry) VALUES ('delete', old.id, entry_text(old.entry, old.codec));
+            INSERT INTO {SEARCH_TABLE} (rowid, entry) VALUES (new.id, entry_text(new.entry, new.codec));
+        END''')
+    cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def rebuild_stats(cursor: sqlite3.Cursor) -> None:
+    """Recounts the stats table from the entries table, as it was at schema version 6. See recount_stats"""
+    cursor.execute(f'DELETE FROM {STATS_TABLE}')
+    cursor.execute(f'''
+        INSERT INTO {STATS_TABLE} (month, entries, words, characters)
+        SELECT substr(date, 1, 7), COUNT(*), SUM(word_count(entry, codec)), SUM(text_length)
+        FROM {ENTRIES_TABLE}
+        GROUP BY substr(date, 1, 7)''')
+
+
+def create_stats_table(cursor: sqlite3.Cursor) -> None:
+    """Creates the per month stats table and the triggers that keep it up to date. Every write to the entries
+    table adjusts the counts of the month it touches, so views over a year read 12 rows instead of every entry.
+    Needs the functions from entry_codec.register_functions"""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+        month TEXT PRIMARY KEY,
+        entries INTEGER NOT NULL,
+        words INTEGER NOT NULL,
+        characters INTEGER NOT NULL
+        ) WITHOUT ROWID''')
+    #the baseline schema allows a NULL entry, and version 5 gave those rows a NULL length. they count as 0 characters,
+    #the stats columns can't be NULL. done here rather than in version 5, so journals already at 5 get it too
+    cursor.execute(f'UPDATE {ENTRIES_TABLE} SET text_length = 0 WHERE text_length IS NULL')
+    add_counts = f'''
+            INSERT INTO {STATS_TABLE} (month, entries, words, characters)
+            VALUES (substr(new.date, 1, 7), 1, word_count(new.entry, new.codec), new.text_length)
+            ON CONFLICT(month) DO UPDATE SET
+                entries = entries + 1,
+                words = words + excluded.words,
+                characters = characters + excluded.characters;'''
+    remove_counts = f'''
+            UPDATE {STATS_TABLE} SET
+                entries = entries - 1,
+                words = words - word_count(old.entry, old.codec),
+                characters = characters - old.text_length
+            WHERE month = substr(old.date, 1, 7);
+            DELETE FROM {STATS_TABLE} WHERE month = substr(old.date, 1, 7) AND entries <= 0;'''
+    cursor.execute(f'''
+        CREATE TRIGGER {STATS_TABLE}_insert AFTER INSERT ON {ENTRIES_TABLE} BEGIN{add_counts}
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER {STATS_TABLE}_delete AFTER DELETE ON {ENTRIES_TABLE} BEGIN{remove_counts}
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER {STATS_TABLE}_update AFTER UPDATE OF date, entry, text_length ON {ENTRIES_TABLE} BEGIN{remove_counts}{add_counts}
+        END''')
+    rebuild_stats(cursor)
+
+
+def stored_text(row: str) -> str:
+    #sql for the full text of an entries row, row being a table alias or old/new in a trigger.
+    #chunked entries are joined back together in order, the rest are decompressed
+    return f'''CASE {row}.codec
+            WHEN 'chunked' THEN (
+                SELECT group_concat(entry_text(data, codec), '')
+                FROM (SELECT data, codec FROM {CHUNKS_TABLE} WHERE date = {row}.date ORDER BY seq))
+            ELSE entry_text({row}.entry, {row}.codec) END'''
+
+
+def chunk_entries(cursor: sqlite3.Cursor) -> None:
+    """Adds the chunks table for large entries. The entries row of a chunked entry keeps its date and length,
+    the text is in the chunks table in seq order. The entries_text view joins the chunks back together, and
+    the search index and stats triggers are replaced by one trigger per write that reads the text through
+    the same sql. Rows with the pending codec are being written, the triggers skip them until their chunks are in"""
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {CHUNKS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        date DATE NOT NULL,
+        seq INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        codec TEXT NOT NULL,
+        UNIQUE(date, seq)
+        )''')
+
+    for trigger in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{trigger}')
+        cursor.execute(f'DROP TRIGGER IF EXISTS {STATS_TABLE}_{trigger}')
+    cursor.execute(f'DROP VIEW IF EXISTS {ENTRIES_TEXT_VIEW}')
+    create_entry_triggers(cursor, lambda row: f'substr({row}.date, 1, 7)')
+
+
+def create_entry_triggers(cursor: sqlite3.Cursor, month: Callable[[str], str]) -> None:
+    #the entries_text view, and the triggers that keep the search index and stats in step with the entries table.
+    #month gives the sql for the YYYY-MM stats key of old or new, which depends on how dates are stored
+    cursor.execute(f'''
+        CREATE VIEW {ENTRIES_TEXT_VIEW} AS
+        SELECT e.id, e.date, {stored_text('e')} AS entry
+        FROM {ENTRIES_TABLE} e''')
+
+    add_new = f'''
+            INSERT INTO {SEARCH_TABLE} (rowid, entry)
+            SELECT new.id, {stored_text('new')}
+            WHERE new.codec != 'pending';
+            INSERT INTO {STATS_TABLE} (month, entries, words, characters)
+            SELECT {month('new')}, 1, word_count({stored_text('new')}, 'plain'), new.text_length
+            WHERE new.codec != 'pending'
+            ON CONFLICT(month) DO UPDATE SET
+                entries = entries + 1,
+                words = words + excluded.words,
+                characters = characters + excluded.characters;'''
+    remove_old = f'''
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, entry)
+            SELECT 'delete', old.id, {stored_text('old')}
+            WHERE old.codec != 'pending';
+            UPDATE {STATS_TABLE} SET
+                entries = entries - 1,
+                words = words - word_count({stored_text('old')}, 'plain'),
+                characters = characters - old.text_length
+            WHERE month = {month('old')} AND old.codec != 'pending';
+            DELETE FROM {STATS_TABLE} WHERE month = {month('old')} AND entries <= 0;'''
+    cursor.execute(f'''
+        CREATE TRIGGER {ENTRIES_TABLE}_insert AFTER INSERT ON {ENTRIES_TABLE} BEGIN{add_new}
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER {ENTRIES_TABLE}_delete AFTER DELETE ON {ENTRIES_TABLE} BEGIN{remove_old}
+        END''')
+    cursor.execute(f'''
+        CREATE TRIGGER {ENTRIES_TABLE}_update AFTER UPDATE OF date, entry, codec, text_length ON {ENTRIES_TABLE} BEGIN{remove_old}{add_new}
+        END''')
+
+
+def day_text(day: str, format_: str = '%Y-%m-%d') -> str:
+    #sql that formats a stored day number, sqlite reads a plain number as a julian day
+    return f"strftime('{format_}', {day} + {ORDINAL_JULIAN_OFFSET})"
+
+
+def number_dates(cursor: sqlite3.Cursor) -> None:
+    """Stores every date as an integer day number instead of ISO text, so range scans compare integers and rows
+    need no parsing to find their day. The tables are rebuilt with the same ids, so the search index, which
+    only knows entry ids, stays valid. The stats table keeps its YYYY-MM keys, the triggers work them out
+    from the day number"""
+    for trigger in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {ENTRIES_TABLE}_{trigger}')
+    cursor.execute(f'DROP VIEW IF EXISTS {ENTRIES_TEXT_VIEW}')
+
+    to_day = f'CAST(julianday(date) - {ORDINAL_JULIAN_OFFSET} AS INTEGER)'
+    tables = {
+        ENTRIES_TABLE: ('''
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date INTEGER NOT NULL UNIQUE,
+            entry TEXT,
+            codec TEXT NOT NULL DEFAULT 'plain',
+            text_length INTEGER''', 'id, entry, codec, text_length'),
+        REVISIONS_TABLE: ('''
+            id INTEGER PRIMARY KEY,
+            date INTEGER NOT NULL,
+            revision INTEGER NOT NULL,
+            replaced_at TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            data TEXT NOT NULL,
+            UNIQUE(date, revision)''', 'id, revision, replaced_at, kind, data'),
+        CHUNKS_TABLE: ('''
+            id INTEGER PRIMARY KEY,
+            date INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            codec TEXT NOT NULL,
+            UNIQUE(date, seq)''', 'id, seq, data, codec'),
+    }
+    for table, (columns, copied) in tables.items():
+        cursor.execute(f'CREATE TABLE {table}_new ({columns}\n            )')
+        cursor.execute(f'INSERT INTO {table}_new (date, {copied}) SELECT {to_day}, {copied} FROM {table}')
+        cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+    create_entry_triggers(cursor, lambda row: day_text(f'{row}.date', '%Y-%m'))
+    cursor.execute(f'ANALYZE {ENTRIES_TABLE}')
+
+
+def create_tag_tables(cursor: sqlite3.Cursor) -> None:
+    """Adds the tag tables and the mood column. entry_tags is keyed on (tag, date), so the dates with a tag are
+    one range of its primary key, and indexed on (date, tag) for the tags of a date. Both are covering, neither
+    lookup reads past the index. Tags are keyed by date, like revisions and chunks, so they stay with their day.
+    The source says whether a tag was added by hand or came from a #hashtag in the text, only the latter are
+    changed when the text is saved. The hashtags already in the journal are picked up here"""
+    cursor.execute(f'ALTER TABLE {ENTRIES_TABLE} ADD COLUMN mood INTEGER')
+    cursor.execute(f'''
+        CREATE TABLE {TAGS_TABLE} (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+        )''')
+    cursor.execute(f'''
+        CREATE TABLE {ENTRY_TAGS_TABLE} (
+        tag_id INTEGER NOT NULL REFERENCES {TAGS_TABLE} (id),
+        date INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        PRIMARY KEY (tag_id, date)
+        ) WITHOUT ROWID''')
+    cursor.execute(f'CREATE INDEX {ENTRY_TAGS_TABLE}_date ON {ENTRY_TAGS_TABLE} (date, tag_id)')
+
+    #read on a cursor of its own, so the inserts below don't end the scan
+    reader = cursor.connection.cursor()
+    try:
+        reader.execute(f'SELECT date, entry FROM {ENTRIES_TEXT_VIEW}')
+        while rows := reader.fetchmany(500):
+            found = [(date, name) for date, entry in rows for name in extract_tags(entry)]
+            cursor.executemany(f'INSERT OR IGNORE INTO {TAGS_TABLE} (name) VALUES (?)', [(name, ) for _, name in found])
+            cursor.executemany(f'''
+                INSERT INTO {ENTRY_TAGS_TABLE} (tag_id, date, source)
+                SELECT id, ?, 'inline' FROM {TAGS_TABLE} WHERE name = ?
+                ''', found)
+    finally:
+        reader.close()
+    cursor.execute(f'ANALYZE {ENTRY_TAGS_TABLE}')
+
+
+def index_chunks(cursor: sqlite3.Cursor) -> None:
+    """Indexes chunked entries a chunk at a time. The triggers from version 7 joined, tokenised and counted the
+    whole old and new text of an entry on every save, which for a large entry cost far more than the chunks the
+    save rewrote. Each chunk is now a row of the search index of its own, under the negative of its id, and the
+    chunks table has triggers that index and count the words of the chunks written and removed. The entries
+    triggers only index entries stored in their row, and count the entries and characters of every entry.
+    Needs the functions from entry_codec.register_functions"""
+    for trigger in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {ENTRIES_TABLE}_{trigger}')
+    cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+    cursor.execute(f'''
+        CREATE VIEW {SEARCH_CONTENT_VIEW} AS
+        SELECT id, date, entry_text(entry, codec) AS entry
+        FROM {ENTRIES_TABLE}
+        WHERE codec IN ('plain', 'zlib')
+        UNION ALL
+        SELECT -id, date, entry_text(data, codec)
+        FROM {CHUNKS_TABLE}''')
+    #snippets read a row's text back by its index rowid, this finds a chunk from the negative of its id
+    cursor.execute(f'CREATE INDEX {CHUNKS_TABLE}_search_id ON {CHUNKS_TABLE} (-id)')
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        entry,
+        content='{SEARCH_CONTENT_VIEW}',
+        content_rowid='id'
+        )''')
+
+    #a month's row goes once it has no entries and no words left, the words of a chunked entry are added and
+    #taken away by its chunks, which can be written before or after the entries row
+    drop_empty = f'DELETE FROM {STATS_TABLE} WHERE month = {day_text("old.date", "%Y-%m")} AND entries <= 0 AND words <= 0;'
+    add_entry = f'''
+            INSERT INTO {SEARCH_TABLE} (rowid, entry)
+            SELECT new.id, entry_text(new.entry, new.codec)
+            WHERE new.codec IN ('plain', 'zlib');
+            INSERT INTO {STATS_TABLE} (month, entries, words, characters)
+            SELECT {day_text('new.date', '%Y-%m')}, 1, word_count(new.entry, new.codec), new.text_length
+            WHERE new.codec != 'pending'
+            ON CONFLICT(month) DO UPDATE SET
+                entries = entries + 1,
+                words = words + excluded.words,
+                characters = characters + excluded.characters;'''
+    remove_entry = f'''
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, entry)
+            SELECT 'delete', old.id, entry_text(old.entry, old.codec)
+            WHERE old.codec IN ('plain', 'zlib');
+            UPDATE {STATS_TABLE} SET
+                entries = entries - 1,
+                words = words - word_count(old.entry, old.codec),
+                characters = characters - old.text_length
+            WHERE month = {day_text('old.date', '%Y-%m')} AND old.codec != 'pending';
+            {drop_empty}'''
+    add_chunk = f'''
+            INSERT INTO {SEARCH_TABLE} (rowid, entry) VALUES (-new.id, entry_text(new.data, new.codec));
+            INSERT INTO {STATS_TABLE} (month, entries, words, characters)
+            SELECT {day_text('new.date', '%Y-%m')}, 0, word_count(new.data, new.codec), 0
+            WHERE true
+            ON CONFLICT(month) DO UPDATE SET words = words + excluded.words;'''
+    remove_chunk = f'''
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, entry) VALUES ('delete', -old.id, entry_text(old.data, old.codec));
+            UPDATE {STATS_TABLE} SET words = words - word_count(old.data, old.codec)
+            WHERE month = {day_text('old.date', '%Y-%m')};
+            {drop_empty}'''
+    for table, add, remove, columns in ((ENTRIES_TABLE, add_entry, remove_entry, 'date, entry, codec, text_length'),
+                                        (CHUNKS_TABLE, add_chunk, remove_chunk, 'date, data, codec')):
+        cursor.execute(f'''
+            CREATE TRIGGER {table}_insert AFTER INSERT ON {table} BEGIN{add}
+            END''')
+        cursor.execute(f'''
+            CREATE TRIGGER {table}_delete AFTER DELETE ON {table} BEGIN{remove}
+            END''')
+        cursor.execute(f'''
+            CREATE TRIGGER {table}_update AFTER UPDATE OF {columns} ON {table} BEGIN{remove}{add}
+            END''')
+
+    cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+    recount_stats(cursor)
+
+
+def recount_stats(cursor: sqlite3.Cursor) -> None:
+    """Recounts the stats table the way the triggers count it: entries and characters from the entries rows, and
+    words from the entries stored in their row and from each chunk of the chunked ones. Used by Entries.rebuild_stats"""
+    cursor.execute(f'DELETE FROM {STATS_TABLE}')
+    cursor.execute(f'''
+        INSERT INTO {STATS_TABLE} (month, entries, words, characters)
+        SELECT {day_text('date', '%Y-%m')}, SUM(entries), SUM(words), SUM(characters)
+        FROM (
+            SELECT date, 1 AS entries, word_count(entry, codec) AS words, COALESCE(text_length, 0) AS characters
+            FROM {ENTRIES_TABLE}
+            WHERE codec != 'pending'
+            UNION ALL
+            SELECT date, 0, word_count(data, codec), 0
+            FROM {CHUNKS_TABLE})
+        GROUP BY 1''')
+
+
+#the position in this list is the schema version the migration upgrades to
+MIGRATIONS = [
+    create_entries_table,
+    create_search_index,
+    analyze_entries,
+    create_revisions_table,
+    compress_entries,
+    create_stats_table,
+    chunk_entries,
+    number_dates,
+    create_tag_tables,
+    index_chunks,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, logger_: logger.logging.Logger) -> int:
+    """Runs every migration newer than the journal's schema version, each one in its own transaction.
+    Returns the schema version the journal ends up at"""
+    version = get_version(conn)
+    if version > LATEST_VERSION:
+        logger_.error('Journal schema version %s is newer than this app supports (%s)', version, LATEST_VERSION)
+        raise RuntimeError('The journal was created by a newer version of the app')
+
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            migration(cursor)
+            #user_version is part of the transaction, so a failed migration leaves the version unchanged
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+            logger_.info('Journal migrated to schema version %s: %s', number, migration.__name__)
+        except Exception:
+            conn.rollback()
+            logger_.exception('Migration to schema version %s failed:', number)
+            raise
+        finally:
+            cursor.close()
+
+    return LATEST_VERSION
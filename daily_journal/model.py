@@ -3,81 +3,190 @@ as well as other class specific methods"""
 
 import datetime
 import calendar as cal
+from array import array
 from typing import Tuple
 
+import config
 import logger
 
+#one logger for the module, rather than fetching it for every month that is built
+_logger = logger.journal_logger('model')
+
+
+def shift_month(year: int, month_num: int, months: int) -> tuple[int, int]:
+    """Returns the (year, month number) that is months away from the given month, negative to go back"""
+    index = year * 12 + month_num - 1 + months
+    return index // 12, index % 12 + 1
+
 
 class Day:
-    """Day class to hold all entries and future parts"""
-    def __init__(self, date: datetime.date):
+    """Day class to hold all entries and future parts. Days are made by their month when they are asked for,
+    the entry text itself is kept by the month, so a day is only a view onto it"""
+    __slots__ = ('date', '_month')
+
+    def __init__(self, date: datetime.date, month: 'Month'):
         self.date = date
-        self.entry = ''
-        self.date_string = self.get_date_string()
-    
+        self._month = month
+
+    @property
+    def entry(self) -> str:
+        #the full text, only there once it has been loaded. see entry_loaded.
+        #while a large entry is streaming in, this is the part that has arrived so far
+        return self._month.loaded_text(self.date.day)
+
+    @property
+    def has_entry(self) -> bool:
+        return self._month.has_entry(self.date.day)
+
+    @property
+    def entry_loaded(self) -> bool:
+        #true when entry holds the full text, or the day has no entry to load
+        return self._month.entry_loaded(self.date.day)
+
+    @property
+    def entry_streaming(self) -> bool:
+        #true while only the first chunks of a large entry have been loaded
+        return self._month.entry_streaming(self.date.day)
+
+    @property
+    def entry_length(self) -> int:
+        return self._month.entry_length(self.date.day)
+
+    @property
+    def snippet(self) -> str:
+        return self._month.snippet(self.date.day)
+
+    @property
+    def date_string(self) -> str:
+        #only formatted when the ui asks for it
+        return self.get_date_string()
+
     def get_date_string(self):
         return f'{self.date:%B} {self.date.day}, {self.date.year}'
-    
+
     def set_entry(self, entry: str):
-        self.entry = entry
+        self._month.set_entry(self.date.day, entry)
 
     def delete_entry(self):
-        self.entry = ''
+        self._month.delete_entry(self.date.day)
+
+    def add_loaded_chunks(self, chunks: list[str], complete: bool):
+        self._month.add_loaded_chunks(self.date.day, chunks, complete)
 
 
 class Month:
-    """Month class to hold all days and month calendar"""
-    def __init__(self, month_num: int, year: int) -> list[list]:
+    """Month class to hold all days and month calendar. The calendar is kept as a flat array of
+    day of month numbers. Entries are kept in two sparse day of month maps: the snippet index, which says
+    which days have an entry, and the full text, which is only filled in for days that were opened.
+    Large entries are loaded a batch of chunks at a time, the chunks are kept apart until the last one is in"""
+    __slots__ = ('month_num', 'year', 'day_numbers', 'entries_loaded', '_first_day', '_number_of_days', '_entries', '_snippets', '_partial')
+
+    def __init__(self, month_num: int, year: int) -> None:
         self.month_num = month_num
         self.year = year
-        self.month_matrix = self.build_calendar_matrix()
-        self.month_name = self.set_month_name()
-        self.last_day = 0
         self._first_day, self._number_of_days = cal.monthrange(year, month_num)
-        self.logger_ = logger.journal_logger()
+        self.day_numbers = self.build_calendar_matrix()
+        self.entries_loaded = False
+        self._entries = {}
+        self._snippets = {}
+        self._partial = {}
 
     def __getitem__(self, day_of_month) -> Day:
         """Returns the requested day object. implementing this here ensures encapsulation"""
         if not 1 <= day_of_month <= self._number_of_days: #make sure the day of month requested is in the number of days range
-            self.logger_.info(f'IndexError at Month __getitem__: day_of_month given, {day_of_month}, was outside of range 1 to {self._number_of_days}')
+            _logger.info('IndexError at Month __getitem__: day_of_month given, %s, was outside of range 1 to %s', day_of_month, self._number_of_days)
             day_of_month = self._number_of_days #set the day of month to the last day if it is out of the range
-        matrix_index = self._first_day + day_of_month - 1
-        week_index, day_index = divmod(matrix_index, 7)
-        return self.month_matrix[week_index][day_index]
-
-    def build_calendar_matrix(self) -> list[list]:
-        month_matrix = cal.monthcalendar(self.year, self.month_num)
-        if len(month_matrix) < 6:
-            month_matrix.append([0,0,0,0,0,0,0])
-        for i, week in enumerate(month_matrix):
-            for j, day_num in enumerate(week):
-                if day_num != 0:
-                    self.last_day = day_num
-                    date = datetime.date(self.year, self.month_num, day_num)
-                    month_matrix[i][j] = Day(date)
-        return month_matrix
-    
+        return Day(datetime.date(self.year, self.month_num, day_of_month), self)
+
+    @property
+    def month_matrix(self) -> list[list[Day | int]]:
+        #6 weeks of 7 days, with 0 for the cells outside the month. the days are only made when this is asked for
+        return [
+            [self[day_num] if day_num else 0 for day_num in self.day_numbers[week:week + 7]]
+            for week in range(0, 42, 7)
+            ]
+
+    @property
+    def month_name(self) -> str:
+        return self.set_month_name()
+
+    @property
+    def last_day(self) -> int:
+        return self._number_of_days
+
+    def build_calendar_matrix(self) -> array:
+        #monthrange gives the weekday of the 1st, with monday as 0, so the month starts that many cells in.
+        #the array is always 42 cells, 6 weeks, so the calendar keeps the same size every month
+        day_numbers = array('B', bytes(42))
+        for day_num in range(1, self._number_of_days + 1):
+            day_numbers[self._first_day + day_num - 1] = day_num
+        return day_numbers
+
+    def has_entry(self, day_of_month: int) -> bool:
+        #a row with no text, which older journals can have, doesn't count as an entry
+        return self.entry_length(day_of_month) > 0
+
+    def entry_loaded(self, day_of_month: int) -> bool:
+        return day_of_month in self._entries or day_of_month not in self._snippets
+
+    def snippet(self, day_of_month: int) -> str:
+        return self._snippets.get(day_of_month, (0, ''))[1]
+
+    def entry_length(self, day_of_month: int) -> int:
+        return self._snippets.get(day_of_month, (0, ''))[0]
+
+    def entry_streaming(self, day_of_month: int) -> bool:
+        return day_of_month in self._partial
+
+    def loaded_text(self, day_of_month: int) -> str:
+        if day_of_month in self._partial:
+            return ''.join(self._partial[day_of_month])
+        return self._entries.get(day_of_month, '')
+
+    def add_loaded_chunks(self, day_of_month: int, chunks: list[str], complete: bool):
+        #the chunks are only joined once, when the last of them is in
+        pieces = self._partial.setdefault(day_of_month, [])
+        pieces.extend(chunks)
+        if complete:
+            del self._partial[day_of_month]
+            self.set_entry(day_of_month, ''.join(pieces))
+
+    def set_entry(self, day_of_month: int, entry: str):
+        #empty text is kept out of the maps, so they only hold days that have an entry
+        if entry:
+            self._entries[day_of_month] = entry
+            self._snippets[day_of_month] = (len(entry), entry[:config.ENTRY_SNIPPET_LENGTH])
+            self._partial.pop(day_of_month, None)
+        else:
+            self.delete_entry(day_of_month)
+
+    def delete_entry(self, day_of_month: int):
+        self._entries.pop(day_of_month, None)
+        self._snippets.pop(day_of_month, None)
+        self._partial.pop(day_of_month, None)
+
     def populate_days_with_entries(self, entries: list[tuple]):
-        #this should take a bulk list of entries and parse them to the correct day
-        #this is in the month class to ensure any controller does not have to use this business logic
+        #this should take a bulk list of (date, length, snippet) rows from the entry index and pass them to the correct day
+        #this is in the month class to ensure any controller does not have to use this business logic.
+        #the repository hands back dates, so the day slot is read straight off them
         if entries:
-            for item in entries:
-                date, entry = item 
-                y, m, day_of_month = date.split('-')
-                day = self.__getitem__(int(day_of_month))
-                day.set_entry(entry)
-    
+            for date, length, snippet in entries:
+                day_of_month = date.day
+                self._snippets[day_of_month] = (length, snippet)
+                #a short entry fits in its snippet, so there is no full text left to fetch
+                if length <= len(snippet):
+                    self._entries[day_of_month] = snippet
+        self.entries_loaded = True
+
     def set_month_name(self):
         #this sets the string name for the month
         return cal.month_name[self.month_num]
-    
+
     def start_and_end_dates(self) -> Tuple[datetime.date, datetime.date]:
         #I put this here to ensure that the correct first and last day of the month are used
         start_date = datetime.date(self.year, self.month_num, 1)
         end_date = datetime.date(self.year, self.month_num, self._number_of_days)
         return start_date, end_date
-    
 
-    
 
-    
\ No newline at end of file
+
@@ -1,109 +1,475 @@
-"""Module will hold the entries repository, as well as the table initialization function"""
+"""Module will hold the entries repository, as well as the connection setup function.
+The tables themselves are created and upgraded in migrations.py"""
 
+import queue
 import sqlite3
 import datetime
+import threading
+from pathlib import Path
 from contextlib import contextmanager
+from enum import StrEnum
+from typing import Iterable, Iterator
 
-from config import ENTRIES_TABLE
+from config import (ENTRIES_TABLE, ENTRY_SNIPPET_LENGTH, SEARCH_TABLE, SEARCH_HIGHLIGHT, SEARCH_SNIPPET_TOKENS, DB_PRAGMAS, DB_READER_PRAGMAS,
+                    REVISIONS_TABLE, REVISION_KEYFRAME_INTERVAL, REVISION_KEEP_COUNT, REVISION_MAX_AGE_DAYS, STATS_TABLE,
+                    CHUNKS_TABLE, ENTRIES_TEXT_VIEW, TAGS_TABLE, ENTRY_TAGS_TABLE, MOOD_RANGE)
+from delta import make_delta, apply_delta
+from entry_codec import Codec, encode_entry, decode_entry, is_chunked, split_chunks, register_functions
+from tags import normalise_tag, extract_tags
 import logger
+import metrics
+import migrations
 
 
-def init_entries_table(conn: sqlite3.Connection, logger_: logger.logging.Logger) -> None:
-    """This initializes the entries table"""
-    entries_query = f'''
-    CREATE TABLE IF NOT EXISTS {ENTRIES_TABLE} (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    date DATE UNIQUE,
-    entry TEXT
-    )'''
-
-    # create the table, logging any basic error
-    cursor = None
-    try:
-        cursor = conn.cursor()
-        cursor.execute(entries_query)
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.rollback()
-        logger_.exception('SQLite error:')
-    except Exception:
-        conn.rollback()
-        logger_.exception('SQLite error:')
-        raise
-    finally:
-        if cursor is not None:
-            cursor.close()
+class ConflictPolicy(StrEnum):
+    """What to do when an imported entry has the same date as an entry already in the journal"""
+    SKIP = 'skip'
+    OVERWRITE = 'overwrite'
+    APPEND = 'append'
+
+
+class RevisionKind(StrEnum):
+    """How a revision's text is stored. A delta has to be applied to the next newer version to get the text back"""
+    FULL = 'full'
+    DELTA = 'delta'
+
+
+class TagSource(StrEnum):
+    """Where an entry's tag came from. Inline tags follow the #hashtags in the text, manual ones are only changed by hand"""
+    INLINE = 'inline'
+    MANUAL = 'manual'
+
+
+class TagMatch(StrEnum):
+    """Whether find_by_tags wants the entries that have all of the tags, or any one of them"""
+    ALL = 'all'
+    ANY = 'any'
+
+
+#dates are stored as day numbers, python's date.toordinal(), so ranges compare integers and a row's day needs no parsing.
+#a date passed as a parameter is stored as its number, and a column selected as "date [day]" comes back as a date
+#on connections opened with PARSE_COLNAMES, see open_connection
+sqlite3.register_adapter(datetime.date, datetime.date.toordinal)
+sqlite3.register_converter('day', lambda value: datetime.date.fromordinal(int(value)))
+
+
+def open_connection(database: str, logger_: logger.logging.Logger, pragmas: dict = DB_PRAGMAS, **kwargs) -> sqlite3.Connection:
+    """Connects with the day converter turned on and applies the connection profile. Connections are opened on one
+    thread and used on the db worker, or passed between reader threads, so the same thread check is off"""
+    conn = sqlite3.connect(database, detect_types=sqlite3.PARSE_COLNAMES, check_same_thread=False, **kwargs)
+    configure_connection(conn, logger_, pragmas)
+    return conn
+
+
+def configure_connection(conn: sqlite3.Connection, logger_: logger.logging.Logger, pragmas: dict = DB_PRAGMAS) -> None:
+    """Applies the connection profile from config. These have to be set on every new connection,
+    and outside of a transaction, so this is called right after connecting"""
+    for pragma, value in pragmas.items():
+        result = conn.execute(f'PRAGMA {pragma} = {value}').fetchone()
+        logger_.debug('PRAGMA %s set to %s', pragma, result[0] if result else value)
+
+
+class ConnectionManager:
+    """One writer connection, and a bounded pool of read only connections to the same file.
+    The writer is only used by the db worker. Readers are opened in uri mode with mode=ro, the first time they are
+    needed, and are lent out one per thread, so a thread that reads again inside a read gets the same one back.
+    They move between threads through the pool, so the same thread check is off for them too.
+    execute and close act on the writer, and close every reader as well, so the db worker can use this
+    in place of a single connection"""
+    def __init__(self, path: str, logger_: logger.logging.Logger, readers: int) -> None:
+        self.path = path
+        self.logger = logger_
+        #the writer is opened here but used from the db worker thread
+        self.writer = open_connection(path, logger_)
+        #an in-memory db can't be opened a second time, so everything goes through the writer
+        self.reader_count = 0 if path == ':memory:' else readers
+        self._idle = queue.LifoQueue()
+        self._readers = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def open_reader(self) -> sqlite3.Connection:
+        uri = Path(self.path).resolve().as_uri() + '?mode=ro'
+        conn = open_connection(uri, self.logger, DB_READER_PRAGMAS, uri=True)
+        #the views and the search index decompress entries through these
+        register_functions(conn)
+        self.logger.info('Opened reader connection %s', len(self._readers) + 1)
+        return conn
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Lends the calling thread a reader for the block. Waits for one to be handed back when all
+        reader_count are in use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = len(self._readers) < self.reader_count
+                if create:
+                    conn = self.open_reader()
+                    self._readers.append(conn)
+            if not create:
+                conn = self._idle.get()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._idle.put(conn)
+
+    def execute(self, sql: str) -> sqlite3.Cursor:
+        return self.writer.execute(sql)
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self.writer.close()
 
 
 class Entries:
-    """This is the entries repository, responsible for interactions with the database"""
-    def __init__(self, db_conn):
-        self.conn = db_conn
+    """This is the entries repository, responsible for interactions with the database.
+    It takes a single connection, or a ConnectionManager, in which case reads made outside of a transaction
+    are run on one of its readers and everything else on the writer"""
+    def __init__(self, db_conn: sqlite3.Connection | ConnectionManager):
+        self.connections = db_conn if isinstance(db_conn, ConnectionManager) else None
+        self.conn = db_conn.writer if self.connections else db_conn
 
         #get the logger
-        self.logger = logger.journal_logger()
+        self.logger = logger.journal_logger('repository')
+
+        #how many transaction blocks are open, while above 0 the single statements don't commit on their own.
+        #only the thread that opened the block is in it, reads from other threads still go to a reader
+        self._transaction_depth = 0
+        self._transaction_thread = None
+
+        #the search index decompresses entries through these, so they are needed before any write
+        register_functions(self.conn)
         
-        #initialize the tables
-        init_entries_table(self.conn, self.logger)
+        #create the tables, or bring an older journal up to the current schema
+        migrations.migrate(self.conn, self.logger)
+
+        #the file the journal is in, read once here so backups don't have to ask the connection for it
+        self.path = next((Path(file) for _, name, file in self.conn.execute('PRAGMA database_list') if name == 'main' and file), None)
+
+    def in_transaction(self) -> bool:
+        return self._transaction_depth > 0 and self._transaction_thread == threading.get_ident()
+
+    def database_files(self) -> list[Path]:
+        #the db files that make up the journal, an in-memory journal has none
+        return [self.path] if self.path is not None else []
 
     @contextmanager
-    def cursor_manager(self):
-        #basic context manager for connections with the database
+    def cursor_manager(self, commit: bool = True):
+        #basic context manager for connections with the database.
+        #reads pass commit=False, there is nothing for them to commit, and are given a reader when there are any.
+        #inside a transaction block the block commits or rolls back, so errors are passed up to it
+        if not commit and self.connections is not None and self.connections.reader_count and not self.in_transaction():
+            with self.connections.reader() as conn:
+                cursor = conn.cursor()
+                try:
+                    yield cursor
+                except Exception:
+                    self.logger.exception('Error at:')
+                    raise
+                finally:
+                    cursor.close()
+            return
         cursor = self.conn.cursor()
+        in_transaction = self._transaction_depth > 0
         try:
             yield cursor
-            self.conn.commit()
+            if commit and not in_transaction:
+                self.conn.commit()
         except sqlite3.IntegrityError:
+            if in_transaction:
+                raise
             self.conn.rollback()
             self.logger.exception('SQLite error:')
         except Exception:
-            self.conn.rollback()
-            self.logger.exception('Error at:')
+            if not in_transaction:
+                self.conn.rollback()
+                self.logger.exception('Error at:')
             raise
         finally:
             cursor.close()
 
+    @contextmanager
+    def transaction(self):
+        """Unit of work. Every repository call made inside the block shares one transaction, which is committed
+        when the block ends, or rolled back if it raises. Blocks can be nested, only the outermost one commits"""
+        if self._transaction_depth:
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+            return
+
+        self._transaction_depth = 1
+        self._transaction_thread = threading.get_ident()
+        self.conn.execute('BEGIN')
+        try:
+            yield self
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            self.logger.exception('Transaction rolled back:')
+            raise
+        finally:
+            self._transaction_depth = 0
+            self._transaction_thread = None
+
+    @metrics.instrument()
     def store_entry(self, date: datetime.date, text: str):
         query = f'''
-            INSERT INTO {ENTRIES_TABLE} (date, entry)
-            VALUES (?, ?)
+            INSERT INTO {ENTRIES_TABLE} (date, entry, codec, text_length)
+            VALUES (?, ?, ?, ?)
             '''
         formatted_date = self.format_date(date)[0]
 
         with self.cursor_manager() as cursor:
-            cursor.execute(query, (formatted_date, text))
-            self.logger.info(f'Entry saved for date: {formatted_date}')
+            self.write_entries(cursor, query, [(formatted_date, text)])
+            self.sync_tags(cursor, [(formatted_date, None, text)])
+            self.logger.info('Entry saved for date: %s', date)
 
-    def format_date(self, *dates: datetime.date) -> str:
-        #made this a fucntion so any format changes can be done in one place
-        return [date.isoformat() for date in dates]
+    @metrics.instrument()
+    def upsert_entry(self, date: datetime.date, text: str):
+        """Stores the entry, or replaces the text if the date already has one. The db decides which in one statement.
+        Nothing is written when the text is the same as the stored one"""
+        query = f'''
+            INSERT INTO {ENTRIES_TABLE} (date, entry, codec, text_length)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET entry = excluded.entry, codec = excluded.codec, text_length = excluded.text_length
+            '''
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager() as cursor:
+            previous = self.current_texts(cursor, [formatted_date])
+            if previous.get(formatted_date) == text:
+                self.logger.info('Entry unchanged for date: %s', date)
+                return
+            self.write_entries(cursor, query, [(formatted_date, text)])
+            self.record_revisions(cursor, [(formatted_date, previous.get(formatted_date), text)])
+            self.sync_tags(cursor, [(formatted_date, previous.get(formatted_date), text)])
+            self.logger.info('Entry upserted for date: %s', date)
 
+    @metrics.instrument()
+    def store_many(self, rows: Iterable[tuple[datetime.date, str]]) -> int:
+        """Stores many new (date, entry) rows in one transaction. If any date already has an entry nothing is stored
+        and 0 is returned, or inside a transaction block the IntegrityError is raised to it"""
+        query = f'''
+            INSERT INTO {ENTRIES_TABLE} (date, entry, codec, text_length)
+            VALUES (?, ?, ?, ?)
+            '''
+        batch = [(self.format_date(date)[0], text) for date, text in rows]
+        #only set once the writes are done, cursor_manager rolls back and carries on when a date already exists
+        stored = 0
+
+        with self.cursor_manager() as cursor:
+            self.write_entries(cursor, query, batch)
+            self.sync_tags(cursor, [(formatted_date, None, text) for formatted_date, text in batch])
+            stored = len(batch)
+            self.logger.info('Stored batch of %s entries', stored)
+        return stored
+
+    def upsert_many(self, rows: Iterable[tuple[datetime.date, str]]) -> int:
+        """Stores or replaces many (date, entry) rows in one transaction. Timed as import_entries"""
+        return self.import_entries(rows, ConflictPolicy.OVERWRITE)
+
+    @metrics.instrument()
+    def delete_many(self, dates: Iterable[datetime.date]) -> int:
+        """Deletes the entries for all the given dates in one transaction"""
+        query = f'''
+            DELETE FROM {ENTRIES_TABLE}
+            WHERE date = ?
+            '''
+        batch = [(formatted_date, ) for formatted_date in self.format_date(*dates)]
+
+        with self.cursor_manager() as cursor:
+            previous = self.current_texts(cursor, [formatted_date for formatted_date, in batch])
+            cursor.executemany(query, batch)
+            self.delete_chunks(cursor, [formatted_date for formatted_date, in batch])
+            self.record_revisions(cursor, [(formatted_date, text, None) for formatted_date, text in previous.items()])
+            self.sync_tags(cursor, [(formatted_date, text, None) for formatted_date, text in previous.items()])
+            self.logger.info('Deleted batch of %s entries', len(batch))
+        return len(batch)
+
+    def format_date(self, *dates: datetime.date) -> list[int]:
+        #made this a fucntion so any format changes can be done in one place.
+        #dates are stored as day numbers, see the adapter at the top of the module
+        return [date.toordinal() for date in dates]
+
+    def encode_row(self, formatted_date: int, text: str) -> tuple:
+        #(date, entry, codec, text_length) for writing. the length is stored so the calendar never has to read the body.
+        #a chunked entry is written as pending, write_entries puts its text in the chunks table afterwards
+        if is_chunked(text):
+            return formatted_date, None, Codec.PENDING.value, len(text)
+        data, codec = encode_entry(text)
+        return formatted_date, data, codec, len(text)
+
+    def write_entries(self, cursor: sqlite3.Cursor, query: str, rows: list[tuple[int, str]]) -> None:
+        """Runs query, an insert or update that takes encode_row's parameters, for each (date, text) row.
+        Large texts are then stored in chunks. The triggers have read the replaced text by the time the
+        chunks change, and index the new text when the row goes from pending to chunked"""
+        cursor.executemany(query, [self.encode_row(formatted_date, text) for formatted_date, text in rows])
+        chunked = [(formatted_date, text) for formatted_date, text in rows if is_chunked(text)]
+        #entries that were chunked before but aren't now have the text in their row
+        self.delete_chunks(cursor, [formatted_date for formatted_date, text in rows if not is_chunked(text)])
+        for formatted_date, text in chunked:
+            self.store_chunks(cursor, formatted_date, text)
+        cursor.executemany(f'''
+            UPDATE {ENTRIES_TABLE}
+            SET codec = ?
+            WHERE date = ?
+            ''', [(Codec.CHUNKED.value, formatted_date) for formatted_date, _ in chunked])
+
+    def store_chunks(self, cursor: sqlite3.Cursor, formatted_date: int, text: str) -> int:
+        """Stores text as the date's chunks, keeping the chunks at the start and end that are unchanged.
+        Only the chunks in between are rewritten. Returns the number of chunks written"""
+        cursor.execute(f'''
+            SELECT id, seq, data, codec
+            FROM {CHUNKS_TABLE}
+            WHERE date = ?
+            ORDER BY seq
+            ''', (formatted_date, ))
+        rows = cursor.fetchall()
+        old_chunks = [decode_entry(data, codec) for _, _, data, codec in rows]
+
+        start = kept_start = 0
+        while kept_start < len(old_chunks) and text.startswith(old_chunks[kept_start], start):
+            start += len(old_chunks[kept_start])
+            kept_start += 1
+        end = len(text)
+        kept_end = len(old_chunks)
+        while kept_end > kept_start and text.endswith(old_chunks[kept_end - 1], start, end):
+            end -= len(old_chunks[kept_end - 1])
+            kept_end -= 1
+
+        new_chunks = split_chunks(text[start:end])
+        replaced = rows[kept_start:kept_end]
+        if not new_chunks and not replaced:
+            return 0
+        #seq values are spread out, so new chunks can go between the kept ones without renumbering them
+        low = rows[kept_start - 1][1] if kept_start else 0
+        high = rows[kept_end][1] if kept_end < len(rows) else low + (len(new_chunks) + 1) * 1024
+        step = (high - low) // (len(new_chunks) + 1)
+        if step < 1:
+            #no room left between the kept chunks, so every chunk is written again
+            cursor.execute(f'DELETE FROM {CHUNKS_TABLE} WHERE date = ?', (formatted_date, ))
+            replaced, new_chunks, low, step = [], split_chunks(text), 0, 1024
+
+        cursor.executemany(f'DELETE FROM {CHUNKS_TABLE} WHERE id = ?', [(row[0], ) for row in replaced])
+        cursor.executemany(f'''
+            INSERT INTO {CHUNKS_TABLE} (date, seq, data, codec)
+            VALUES (?, ?, ?, ?)
+            ''', [(formatted_date, low + step * (index + 1), *encode_entry(chunk)) for index, chunk in enumerate(new_chunks)])
+        self.logger.debug('Rewrote %s of %s chunks for date: %s', len(new_chunks), kept_start + len(new_chunks) + len(rows) - kept_end, formatted_date)
+        return len(new_chunks)
+
+    def delete_chunks(self, cursor: sqlite3.Cursor, formatted_dates: list[int]) -> None:
+        cursor.executemany(f'DELETE FROM {CHUNKS_TABLE} WHERE date = ?', [(formatted_date, ) for formatted_date in formatted_dates])
+
+    @metrics.instrument()
     def get_entries(self, start_date: datetime.date, end_date: datetime.date) -> list[tuple]:
         query = f'''
-            SELECT date, entry
-            FROM {ENTRIES_TABLE}
+            SELECT date AS "date [day]", entry
+            FROM {ENTRIES_TEXT_VIEW}
             WHERE date BETWEEN ? and ?
             '''
         f_start_date, f_end_date = self.format_date(start_date, end_date)
        
-        with self.cursor_manager() as cursor:
+        with self.cursor_manager(commit=False) as cursor:
             cursor.execute(query, (f_start_date, f_end_date))
             entries = cursor.fetchall()
-            self.logger.info(f'Entries retrieved for month of {start_date.month}')
+            self.logger.info('Entries retrieved for month of %s', start_date.month)
             return entries
         
+    @metrics.instrument()
+    def get_entry_index(self, start_date: datetime.date, end_date: datetime.date) -> list[tuple]:
+        """Lightweight version of get_entries for the calendar. Returns (date, length, snippet) for each entry,
+        the snippet is cut in sql so the full text never leaves the db, compressed bodies are only inflated up to the snippet.
+        Rows from older journals can have a NULL entry, they come back with a length of 0 and an empty snippet"""
+        query = f'''
+            SELECT e.date AS "date [day]", COALESCE(e.text_length, 0), COALESCE(CASE e.codec
+                WHEN '{Codec.PLAIN}' THEN substr(e.entry, 1, :length)
+                WHEN '{Codec.CHUNKED}' THEN (
+                    SELECT entry_prefix(c.data, c.codec, :length) FROM {CHUNKS_TABLE} c WHERE c.date = e.date ORDER BY c.seq LIMIT 1)
+                ELSE entry_prefix(e.entry, e.codec, :length) END, '')
+            FROM {ENTRIES_TABLE} e
+            WHERE e.date BETWEEN :start and :end
+            '''
+        f_start_date, f_end_date = self.format_date(start_date, end_date)
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, {'length': ENTRY_SNIPPET_LENGTH, 'start': f_start_date, 'end': f_end_date})
+            entries = cursor.fetchall()
+            self.logger.info('Entry index retrieved for month of %s', start_date.month)
+            return entries
+
+    @metrics.instrument()
+    def get_entry(self, date: datetime.date) -> str | None:
+        """Returns the full text of a single entry, or None if the date has no entry"""
+        query = f'''
+            SELECT entry
+            FROM {ENTRIES_TEXT_VIEW}
+            WHERE date = ?
+            '''
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (formatted_date, ))
+            row = cursor.fetchone()
+            self.logger.info('Entry retrieved for date: %s', date)
+            return row[0] if row else None
+
+    @metrics.instrument()
+    def get_entry_chunks(self, date: datetime.date, start: int = 0, limit: int | None = None) -> list[str]:
+        """Returns up to limit chunks of the date's entry, starting at chunk number start, so a large entry can be
+        read a piece at a time. An entry that isn't chunked is returned as one chunk. Fewer than limit chunks means
+        the end of the entry was reached"""
+        query = f'''
+            SELECT data, codec
+            FROM {CHUNKS_TABLE}
+            WHERE date = ?
+            ORDER BY seq
+            LIMIT ? OFFSET ?
+            '''
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (formatted_date, -1 if limit is None else limit, start))
+            chunks = [decode_entry(data, codec) for data, codec in cursor.fetchall()]
+            if not chunks and start == 0:
+                text = self.current_texts(cursor, [formatted_date]).get(formatted_date)
+                chunks = [text] if text is not None else []
+            self.logger.info('Retrieved %s chunks from %s for date: %s', len(chunks), start, date)
+            return chunks
+
+    @metrics.instrument()
     def update_entry(self, date: datetime.date, text: str):
         query = f'''
             UPDATE {ENTRIES_TABLE}
-            SET entry = ?
-            WHERE date = ?
+            SET entry = ?2, codec = ?3, text_length = ?4
+            WHERE date = ?1
             '''
         formatted_date = self.format_date(date)[0]
 
         with self.cursor_manager() as cursor:
-            cursor.execute(query, (text, formatted_date))
-            self.logger.info(f'Entry updated for date: {formatted_date}')
+            previous = self.current_texts(cursor, [formatted_date])
+            #there is nothing to update, and no chunks should be written, for a date without an entry or the same text
+            if formatted_date in previous and previous[formatted_date] != text:
+                self.write_entries(cursor, query, [(formatted_date, text)])
+                self.record_revisions(cursor, [(formatted_date, previous[formatted_date], text)])
+                self.sync_tags(cursor, [(formatted_date, previous[formatted_date], text)])
+            self.logger.info('Entry updated for date: %s', date)
 
+    @metrics.instrument()
     def delete_entry(self, date: datetime.date):
         query = f'''
             DELETE FROM {ENTRIES_TABLE}
@@ -112,19 +478,617 @@ class Entries:
         formatted_date = self.format_date(date)[0]
 
         with self.cursor_manager() as cursor:
+            previous = self.current_texts(cursor, [formatted_date])
             cursor.execute(query, (formatted_date, ))
-            self.logger.info(f'Entry deleted for date: {formatted_date}')
+            self.delete_chunks(cursor, [formatted_date])
+            self.record_revisions(cursor, [(formatted_date, previous.get(formatted_date), None)])
+            self.sync_tags(cursor, [(formatted_date, previous.get(formatted_date), None)])
+            self.logger.info('Entry deleted for date: %s', date)
         
+    @metrics.instrument()
     def get_recent_entries(self, num_entries: int) -> list[tuple]:
+        #rows from older journals can have a NULL entry, they come back as empty text
         query = f'''
-            SELECT date, entry
-            FROM {ENTRIES_TABLE}
+            SELECT date AS "date [day]", COALESCE(entry, '')
+            FROM {ENTRIES_TEXT_VIEW}
             ORDER BY id DESC
-            LIMIT {num_entries}
+            LIMIT ?
             '''
         
-        with self.cursor_manager() as cursor:
-            cursor.execute(query, )
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (num_entries, ))
             data = cursor.fetchall()
             self.logger.info('Retrieved most recent entries')
             return data
+
+    def search_terms(self, query: str) -> list[str]:
+        #every word is quoted so characters like - or : in user input aren't read as fts5 syntax.
+        #a trailing * is kept outside the quotes so prefix searches still work
+        terms = []
+        for word in query.split():
+            prefix = word.endswith('*')
+            word = word.rstrip('*').replace('"', '""')
+            if word:
+                terms.append(f'"{word}"*' if prefix else f'"{word}"')
+        return terms
+
+    def format_search_query(self, query: str) -> str:
+        return ' '.join(self.search_terms(query))
+
+    def match_query(self, query: str, schema: str = 'main') -> tuple[str, list]:
+        """The sql and parameters that select (date, snippet, rank) for every entry in the schema's file that matches
+        the search query, lower ranks are better matches. Returns ('', []) for a query without any words.
+        A chunked entry is indexed a chunk at a time: it matches when each word is in one of its chunks,
+        and is shown with the snippet and rank of its best matching chunk"""
+        terms = self.search_terms(query)
+        if not terms:
+            return '', []
+        open_mark, close_mark = SEARCH_HIGHLIGHT
+        snippet = f"snippet({SEARCH_TABLE}, 0, ?, ?, '...', ?)"
+        snippet_params = [open_mark, close_mark, SEARCH_SNIPPET_TOKENS]
+        #chunks are picked by any of the words, and kept if their entry has every one of them in some chunk.
+        #the best chunk of each entry is found first, snippet can't be used under a window function
+        every_word = ''.join(f'''
+                            AND bc.date IN (
+                                SELECT wc.date FROM {schema}.{SEARCH_TABLE} w
+                                JOIN {schema}.{CHUNKS_TABLE} wc ON wc.id = -w.rowid
+                                WHERE w.{SEARCH_TABLE} MATCH ? AND w.rowid < 0)''' for _ in terms) if len(terms) > 1 else ''
+        sql = f'''
+            SELECT e.date AS date, {snippet} AS snippet, s.rank AS rank
+            FROM {schema}.{SEARCH_TABLE} s
+            JOIN {schema}.{ENTRIES_TABLE} e ON e.id = s.rowid
+            WHERE s.{SEARCH_TABLE} MATCH ? AND s.rowid > 0
+            UNION ALL
+            SELECT c.date, {snippet}, s.rank
+            FROM {schema}.{SEARCH_TABLE} s
+            JOIN {schema}.{CHUNKS_TABLE} c ON c.id = -s.rowid
+            WHERE s.{SEARCH_TABLE} MATCH ? AND s.rowid IN (
+                SELECT rowid FROM (
+                    SELECT b.rowid AS rowid, ROW_NUMBER() OVER (PARTITION BY bc.date ORDER BY b.rank) AS hit
+                    FROM {schema}.{SEARCH_TABLE} b
+                    JOIN {schema}.{CHUNKS_TABLE} bc ON bc.id = -b.rowid
+                    WHERE b.{SEARCH_TABLE} MATCH ? AND b.rowid < 0{every_word})
+                WHERE hit = 1)'''
+        params = [*snippet_params, ' '.join(terms), *snippet_params, ' OR '.join(terms), ' OR '.join(terms)]
+        if len(terms) > 1:
+            params.extend(terms)
+        return sql, params
+
+    @metrics.instrument()
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> list[tuple]:
+        """Full text search over all entries. Returns (date, snippet) tuples, best match first"""
+        match_sql, params = self.match_query(query)
+        if not match_sql:
+            return []
+        query = f'''
+            SELECT date AS "date [day]", snippet
+            FROM ({match_sql})
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+            '''
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (*params, limit, offset))
+            data = cursor.fetchall()
+            self.logger.info('Search returned %s entries', len(data))
+            return data
+
+    @metrics.instrument()
+    def rebuild_search_index(self):
+        """Rebuilds the search index from the entries table, for journals where the index got out of sync"""
+        query = f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"
+
+        with self.cursor_manager() as cursor:
+            cursor.execute(query)
+            self.logger.info('Search index rebuilt')
+
+    @metrics.instrument()
+    def get_year_stats(self, year: int) -> list[tuple]:
+        """Returns (month, entries, words, characters) for each month of the year that has entries, month as YYYY-MM.
+        Reads at most 12 rows of the stats table through its primary key"""
+        query = f'''
+            SELECT month, entries, words, characters
+            FROM {STATS_TABLE}
+            WHERE month BETWEEN ? AND ?
+            ORDER BY month
+            '''
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (f'{year:04d}-01', f'{year:04d}-12'))
+            data = cursor.fetchall()
+            self.logger.info('Stats retrieved for year %s', year)
+            return data
+
+    @metrics.instrument()
+    def rebuild_stats(self):
+        """Recounts the stats table from scratch, for journals where it got out of sync"""
+        with self.cursor_manager() as cursor:
+            migrations.recount_stats(cursor)
+            self.logger.info('Stats table rebuilt')
+
+    @metrics.instrument()
+    def iter_entries(self, chunk_size: int = 1000) -> Iterator[list[tuple]]:
+        """Yields all entries in date order as lists of (date, entry) tuples, chunk_size rows at a time,
+        so the whole table never has to be in memory"""
+        query = f'''
+            SELECT date AS "date [day]", entry
+            FROM {ENTRIES_TEXT_VIEW}
+            ORDER BY date
+            '''
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+            self.logger.info('Finished reading all entries')
+
+    @metrics.instrument()
+    def import_entries(self, rows: Iterable[tuple[datetime.date, str]], conflict: ConflictPolicy = ConflictPolicy.SKIP) -> int:
+        """Writes a batch of (date, entry) rows in a single transaction. conflict decides what happens
+        to dates that already have an entry. Returns the number of entries written, skipped dates and dates whose
+        text is unchanged aren't written or counted"""
+        conflict = ConflictPolicy(conflict)
+        query = f'''
+            INSERT INTO {ENTRIES_TABLE} (date, entry, codec, text_length)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET entry = excluded.entry, codec = excluded.codec, text_length = excluded.text_length
+            '''
+        batch = [(self.format_date(date)[0], text) for date, text in rows]
+
+        with self.cursor_manager() as cursor:
+            #the final text for each date is worked out here rather than in the ON CONFLICT clause,
+            #so the replaced text can go into the revision history
+            current = self.current_texts(cursor, {formatted_date for formatted_date, _ in batch})
+            changes = {}
+            for formatted_date, text in batch:
+                previous = current.get(formatted_date)
+                if previous is not None:
+                    if conflict is ConflictPolicy.SKIP:
+                        continue
+                    if conflict is ConflictPolicy.APPEND:
+                        text = f'{previous}\n{text}'
+                current[formatted_date] = text
+                #a date repeated in the batch keeps the text from before the batch as its previous version
+                original = changes[formatted_date][0] if formatted_date in changes else previous
+                changes[formatted_date] = (original, text)
+            changes = {formatted_date: change for formatted_date, change in changes.items() if change[0] != change[1]}
+
+            self.write_entries(cursor, query, [(formatted_date, text) for formatted_date, (_, text) in changes.items()])
+            self.record_revisions(cursor, [(formatted_date, original, text) for formatted_date, (original, text) in changes.items()])
+            self.sync_tags(cursor, [(formatted_date, original, text) for formatted_date, (original, text) in changes.items()])
+            self.logger.info('Imported %s of a batch of %s entries', len(changes), len(batch))
+        return len(changes)
+
+    def current_texts(self, cursor: sqlite3.Cursor, formatted_dates: Iterable[int]) -> dict[int, str]:
+        #the stored text for each of the dates that has an entry. the dates are looked up in chunks,
+        #sqlite limits how many parameters one statement can have
+        formatted_dates = list(formatted_dates)
+        texts = {}
+        for start in range(0, len(formatted_dates), 500):
+            chunk = formatted_dates[start:start + 500]
+            cursor.execute(f'''
+                SELECT date, entry
+                FROM {ENTRIES_TEXT_VIEW}
+                WHERE date IN ({', '.join('?' * len(chunk))})
+                ''', chunk)
+            texts.update(cursor.fetchall())
+        return texts
+
+    def record_revisions(self, cursor: sqlite3.Cursor, changes: list[tuple[int, str | None, str | None]]) -> int:
+        """Adds the replaced text of each (date, previous, new) change to the revision history. new is None
+        when the entry was deleted. The current text always stays in the entries table, so each revision is
+        stored as a delta that turns the next newer version back into it, with every REVISION_KEYFRAME_INTERVAL-th
+        revision, and the last text of a deleted entry, stored in full"""
+        changes = [change for change in changes if change[1] is not None and change[1] != change[2]]
+        if not changes:
+            return 0
+
+        latest = {}
+        dates = [formatted_date for formatted_date, _, _ in changes]
+        for start in range(0, len(dates), 500):
+            chunk = dates[start:start + 500]
+            cursor.execute(f'''
+                SELECT date, MAX(revision)
+                FROM {REVISIONS_TABLE}
+                WHERE date IN ({', '.join('?' * len(chunk))})
+                GROUP BY date
+                ''', chunk)
+            latest.update(cursor.fetchall())
+
+        rows = []
+        for formatted_date, previous, text in changes:
+            revision = latest.get(formatted_date, 0) + 1
+            if text is None or revision % REVISION_KEYFRAME_INTERVAL == 0:
+                rows.append((formatted_date, revision, RevisionKind.FULL.value, previous))
+            else:
+                rows.append((formatted_date, revision, RevisionKind.DELTA.value, make_delta(text, previous)))
+
+        cursor.executemany(f'''
+            INSERT INTO {REVISIONS_TABLE} (date, revision, replaced_at, kind, data)
+            VALUES (?, ?, datetime('now'), ?, ?)
+            ''', rows)
+        return len(rows)
+
+    def sync_tags(self, cursor: sqlite3.Cursor, changes: list[tuple[int, str | None, str | None]]) -> int:
+        """Keeps the inline tags of each (date, previous, new) change in step with its #hashtags. Only the hashtags
+        that were added to or removed from the text are written, the rest of the date's tags aren't touched.
+        new is None when the entry was deleted, which removes all of the date's tags, manual ones as well.
+        Returns the number of inline tags added and removed"""
+        added, removed, deleted = [], [], []
+        for formatted_date, previous, text in changes:
+            if text is None:
+                deleted.append(formatted_date)
+            elif previous != text:
+                old, new = extract_tags(previous), extract_tags(text)
+                added.extend((formatted_date, name) for name in new - old)
+                removed.extend((formatted_date, name) for name in old - new)
+
+        touched = {name for _, name in removed}
+        for start in range(0, len(deleted), 500):
+            chunk = deleted[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT DISTINCT t.name
+                FROM {ENTRY_TAGS_TABLE} et
+                JOIN {TAGS_TABLE} t ON t.id = et.tag_id
+                WHERE et.date IN ({placeholders})
+                ''', chunk)
+            touched.update(name for name, in cursor.fetchall())
+            cursor.execute(f'DELETE FROM {ENTRY_TAGS_TABLE} WHERE date IN ({placeholders})', chunk)
+
+        cursor.executemany(f'''
+            DELETE FROM {ENTRY_TAGS_TABLE}
+            WHERE date = ? AND tag_id = (SELECT id FROM {TAGS_TABLE} WHERE name = ?) AND source = ?
+            ''', [(formatted_date, name, TagSource.INLINE.value) for formatted_date, name in removed])
+        #a hashtag that was already added by hand keeps its manual tag
+        cursor.executemany(f'INSERT OR IGNORE INTO {TAGS_TABLE} (name) VALUES (?)', [(name, ) for name in {name for _, name in added}])
+        cursor.executemany(f'''
+            INSERT OR IGNORE INTO {ENTRY_TAGS_TABLE} (tag_id, date, source)
+            SELECT id, ?, ? FROM {TAGS_TABLE} WHERE name = ?
+            ''', [(formatted_date, TagSource.INLINE.value, name) for formatted_date, name in added])
+        self.prune_tags(cursor, touched)
+        return len(added) + len(removed)
+
+    def prune_tags(self, cursor: sqlite3.Cursor, names: Iterable[str]) -> None:
+        #tags no date has any more are removed, so the tag list only holds tags in use
+        cursor.executemany(f'''
+            DELETE FROM {TAGS_TABLE}
+            WHERE name = ? AND NOT EXISTS (SELECT 1 FROM {ENTRY_TAGS_TABLE} WHERE tag_id = {TAGS_TABLE}.id)
+            ''', [(name, ) for name in names])
+
+    @metrics.instrument()
+    def list_revisions(self, date: datetime.date) -> list[tuple]:
+        """Returns (revision, replaced_at, kind, stored size) for every revision of the date's entry, newest first.
+        replaced_at is the utc time the revision stopped being the current text"""
+        query = f'''
+            SELECT revision, replaced_at, kind, length(data)
+            FROM {REVISIONS_TABLE}
+            WHERE date = ?
+            ORDER BY revision DESC
+            '''
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (formatted_date, ))
+            data = cursor.fetchall()
+            self.logger.info('Retrieved %s revisions for date: %s', len(data), date)
+            return data
+
+    @metrics.instrument()
+    def get_revision(self, date: datetime.date, revision: int) -> str | None:
+        """Returns the text of one revision, or None if it doesn't exist or was compacted away.
+        Starts from the nearest full revision at or above it, or the current entry, and applies the deltas down to it"""
+        query = f'''
+            SELECT revision, kind, data
+            FROM {REVISIONS_TABLE}
+            WHERE date = :date AND revision >= :revision AND revision <= COALESCE(
+                (SELECT MIN(revision) FROM {REVISIONS_TABLE} WHERE date = :date AND revision >= :revision AND kind = :full),
+                (SELECT MAX(revision) FROM {REVISIONS_TABLE} WHERE date = :date))
+            ORDER BY revision DESC
+            '''
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, {'date': formatted_date, 'revision': revision, 'full': RevisionKind.FULL.value})
+            rows = cursor.fetchall()
+            if not rows or rows[-1][0] != revision:
+                return None
+            text = None
+            if rows[0][1] == RevisionKind.DELTA:
+                #the newest revision is a delta against the current text
+                text = self.current_texts(cursor, [formatted_date]).get(formatted_date)
+                if text is None:
+                    return None
+            expected = rows[0][0]
+            for number, kind, data in rows:
+                if number != expected:
+                    self.logger.warning('Revision history for %s has a gap at revision %s', date, expected)
+                    return None
+                text = data if kind == RevisionKind.FULL else apply_delta(text, data)
+                expected -= 1
+            self.logger.info('Revision %s rebuilt for date: %s', revision, date)
+            return text
+
+    @metrics.instrument()
+    def restore_revision(self, date: datetime.date, revision: int) -> bool:
+        """Makes a revision the current text again. The text it replaces becomes the newest revision,
+        so a restore can itself be undone. Returns False if the revision doesn't exist"""
+        with self.transaction():
+            text = self.get_revision(date, revision)
+            if text is None:
+                return False
+            self.upsert_entry(date, text)
+        self.logger.info('Restored revision %s for date: %s', revision, date)
+        return True
+
+    @metrics.instrument()
+    def compact_revisions(self, keep: int | None = REVISION_KEEP_COUNT, max_age_days: int | None = REVISION_MAX_AGE_DAYS) -> int:
+        """Removes revisions beyond the newest keep of each entry, and revisions replaced more than max_age_days ago.
+        Only the oldest revisions are ever removed, and the deltas point from newer to older versions, so the
+        ones left can still be rebuilt. The newest revision of each date is always kept, so numbering carries on.
+        Returns the number of revisions removed"""
+        query = f'''
+            DELETE FROM {REVISIONS_TABLE}
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, replaced_at, ROW_NUMBER() OVER (PARTITION BY date ORDER BY revision DESC) AS position
+                    FROM {REVISIONS_TABLE})
+                WHERE position > 1
+                AND ((:keep IS NOT NULL AND position > :keep)
+                    OR (:age IS NOT NULL AND replaced_at < datetime('now', '-' || :age || ' days'))))
+            '''
+
+        with self.cursor_manager() as cursor:
+            cursor.execute(query, {'keep': keep, 'age': max_age_days})
+            removed = cursor.rowcount
+            self.logger.info('Compacted revision history, removed %s revisions', removed)
+            return removed
+
+    @metrics.instrument()
+    def tag_entry(self, date: datetime.date, *names: str) -> int:
+        """Adds manual tags to the date's entry, a date without an entry can't be tagged. A tag the entry already has
+        from a #hashtag becomes a manual one, so it stays when the hashtag is taken out. Returns the number of tags
+        added or made manual. Raises ValueError for a name that isn't a valid tag"""
+        tags = {normalise_tag(name) for name in names}
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager() as cursor:
+            cursor.execute(f'SELECT 1 FROM {ENTRIES_TABLE} WHERE date = ?', (formatted_date, ))
+            if cursor.fetchone() is None:
+                self.logger.info('No entry to tag for date: %s', date)
+                return 0
+            cursor.executemany(f'INSERT OR IGNORE INTO {TAGS_TABLE} (name) VALUES (?)', [(name, ) for name in tags])
+            cursor.executemany(f'''
+                INSERT INTO {ENTRY_TAGS_TABLE} (tag_id, date, source)
+                SELECT id, ?, ? FROM {TAGS_TABLE} WHERE name = ?
+                ON CONFLICT(tag_id, date) DO UPDATE SET source = excluded.source WHERE source != excluded.source
+                ''', [(formatted_date, TagSource.MANUAL.value, name) for name in tags])
+            changed = cursor.rowcount
+            self.logger.info('Tagged date %s with %s', date, sorted(tags))
+            return changed
+
+    @metrics.instrument()
+    def untag_entry(self, date: datetime.date, *names: str) -> int:
+        """Removes tags from the date's entry, manual or inline. A removed inline tag only comes back if its hashtag
+        is typed again. Returns the number of tags removed"""
+        tags = {normalise_tag(name) for name in names}
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager() as cursor:
+            cursor.executemany(f'''
+                DELETE FROM {ENTRY_TAGS_TABLE}
+                WHERE date = ? AND tag_id = (SELECT id FROM {TAGS_TABLE} WHERE name = ?)
+                ''', [(formatted_date, name) for name in tags])
+            removed = cursor.rowcount
+            self.prune_tags(cursor, tags)
+            self.logger.info('Removed %s tags from date: %s', removed, date)
+            return removed
+
+    @metrics.instrument()
+    def get_tags(self, date: datetime.date) -> list[tuple]:
+        """Returns (name, source) for each of the date's tags, by name"""
+        query = f'''
+            SELECT t.name, et.source
+            FROM {ENTRY_TAGS_TABLE} et
+            JOIN {TAGS_TABLE} t ON t.id = et.tag_id
+            WHERE et.date = ?
+            ORDER BY t.name
+            '''
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (formatted_date, ))
+            data = cursor.fetchall()
+            self.logger.info('Retrieved %s tags for date: %s', len(data), date)
+            return data
+
+    @metrics.instrument()
+    def list_tags(self) -> list[tuple]:
+        """Returns (name, number of entries) for every tag, most used first"""
+        query = f'''
+            SELECT t.name, COUNT(*)
+            FROM {ENTRY_TAGS_TABLE} et
+            JOIN {TAGS_TABLE} t ON t.id = et.tag_id
+            GROUP BY et.tag_id
+            ORDER BY 2 DESC, 1
+            '''
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query)
+            data = cursor.fetchall()
+            self.logger.info('Retrieved %s tags', len(data))
+            return data
+
+    @metrics.instrument()
+    def find_by_tags(self, names: Iterable[str], match: TagMatch = TagMatch.ALL, start_date: datetime.date = datetime.date.min,
+                     end_date: datetime.date = datetime.date.max, exclude: Iterable[str] = ()) -> list[datetime.date]:
+        """Returns the dates in the range, in order, that have all of the tags, or any of them, and none of the
+        excluded tags. Each tag's dates are one range scan of the entry_tags primary key"""
+        tags = sorted({normalise_tag(name) for name in names})
+        excluded = sorted({normalise_tag(name) for name in exclude})
+        if not tags:
+            return []
+        match = TagMatch(match)
+        query = f'''
+            SELECT et.date AS "date [day]"
+            FROM {ENTRY_TAGS_TABLE} et
+            JOIN {TAGS_TABLE} t ON t.id = et.tag_id
+            WHERE t.name IN ({', '.join('?' * len(tags))}) AND et.date BETWEEN ? AND ?
+            AND NOT EXISTS (
+                SELECT 1 FROM {ENTRY_TAGS_TABLE} x
+                JOIN {TAGS_TABLE} xt ON xt.id = x.tag_id
+                WHERE x.date = et.date AND xt.name IN ({', '.join('?' * len(excluded))}))
+            GROUP BY et.date
+            HAVING COUNT(*) >= ?
+            ORDER BY et.date
+            '''
+        f_start_date, f_end_date = self.format_date(start_date, end_date)
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (*tags, f_start_date, f_end_date, *excluded, len(tags) if match is TagMatch.ALL else 1))
+            dates = [date for date, in cursor.fetchall()]
+            self.logger.info('Found %s entries tagged %s of %s', len(dates), match, tags)
+            return dates
+
+    @metrics.instrument()
+    def set_mood(self, date: datetime.date, mood: int | None) -> bool:
+        """Gives the date's entry a mood rating in MOOD_RANGE, or clears it with None.
+        Returns False if the date has no entry. Raises ValueError for a rating out of range"""
+        low, high = MOOD_RANGE
+        if mood is not None and not low <= mood <= high:
+            raise ValueError(f'mood has to be from {low} to {high}, not {mood}')
+        query = f'''
+            UPDATE {ENTRIES_TABLE}
+            SET mood = ?
+            WHERE date = ?
+            '''
+        formatted_date = self.format_date(date)[0]
+
+        with self.cursor_manager() as cursor:
+            cursor.execute(query, (mood, formatted_date))
+            self.logger.info('Mood set to %s for date: %s', mood, date)
+            return cursor.rowcount > 0
+
+    @metrics.instrument()
+    def get_moods(self, start_date: datetime.date, end_date: datetime.date) -> list[tuple]:
+        """Returns (date, mood) for each entry in the range that has a mood rating"""
+        query = f'''
+            SELECT date AS "date [day]", mood
+            FROM {ENTRIES_TABLE}
+            WHERE date BETWEEN ? AND ? AND mood IS NOT NULL
+            ORDER BY date
+            '''
+        f_start_date, f_end_date = self.format_date(start_date, end_date)
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query, (f_start_date, f_end_date))
+            data = cursor.fetchall()
+            self.logger.info('Retrieved %s moods from %s to %s', len(data), start_date, end_date)
+            return data
+
+    @metrics.instrument()
+    def recompress_batch(self, after_id: int = 0, batch_size: int = 500) -> tuple[int | None, int]:
+        """Re-encodes up to batch_size entries with an id above after_id using the current compression settings,
+        for journals written before compression or with another threshold. The text is unchanged, so no revisions
+        are recorded. Chunked entries are skipped, their chunks are encoded as they are written. Returns (the last id looked at, or None when there are no more entries, rows rewritten)"""
+        select_query = f'''
+            SELECT id, entry, codec
+            FROM {ENTRIES_TABLE}
+            WHERE id > ? AND codec IN ('{Codec.PLAIN}', '{Codec.ZLIB}')
+            ORDER BY id
+            LIMIT ?
+            '''
+        update_query = f'''
+            UPDATE {ENTRIES_TABLE}
+            SET entry = ?, codec = ?
+            WHERE id = ?
+            '''
+
+        with self.cursor_manager() as cursor:
+            cursor.execute(select_query, (after_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return None, 0
+            updates = []
+            for row_id, stored, codec in rows:
+                data, new_codec = encode_entry(decode_entry(stored, codec))
+                if new_codec != codec or data != stored:
+                    updates.append((data, new_codec, row_id))
+            cursor.executemany(update_query, updates)
+            self.logger.info('Recompressed %s of %s entries after id %s', len(updates), len(rows), after_id)
+            return rows[-1][0], len(updates)
+
+    @metrics.instrument()
+    def storage_stats(self) -> dict:
+        """Returns how the entry bodies are stored: row counts, bytes stored, bytes of plain text and the bytes saved
+        by compression, along with the size of the database file. Chunked entries are counted by their chunks"""
+        query = f'''
+            SELECT codec, COUNT(*), SUM(length(CAST(entry AS BLOB))), SUM(length(CAST(entry_text(entry, codec) AS BLOB)))
+            FROM {ENTRIES_TABLE}
+            GROUP BY codec
+            '''
+        chunks_query = f'''
+            SELECT COUNT(*), SUM(length(CAST(data AS BLOB))), SUM(length(CAST(entry_text(data, codec) AS BLOB)))
+            FROM {CHUNKS_TABLE}
+            '''
+
+        with self.cursor_manager(commit=False) as cursor:
+            cursor.execute(query)
+            stats = {'rows': 0, 'compressed_rows': 0, 'chunked_rows': 0, 'chunks': 0, 'stored_bytes': 0, 'text_bytes': 0}
+            for codec, count, stored_bytes, text_bytes in cursor.fetchall():
+                stats['rows'] += count
+                stats['stored_bytes'] += stored_bytes or 0
+                stats['text_bytes'] += text_bytes or 0
+                if codec == Codec.CHUNKED:
+                    stats['chunked_rows'] += count
+                elif codec != Codec.PLAIN:
+                    stats['compressed_rows'] += count
+            chunks, stored_bytes, text_bytes = cursor.execute(chunks_query).fetchone()
+            stats['chunks'] = chunks
+            stats['stored_bytes'] += stored_bytes or 0
+            stats['text_bytes'] += text_bytes or 0
+            stats['saved_bytes'] = stats['text_bytes'] - stats['stored_bytes']
+            page_count = cursor.execute('PRAGMA page_count').fetchone()[0]
+            page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+            stats['db_bytes'] = page_count * page_size
+            self.logger.info('Storage stats: %s', stats)
+            return stats
+
+    @metrics.instrument()
+    def diagnostics(self) -> dict:
+        """Returns how the db file is used: its size, pages, free pages, the size of the write ahead log,
+        the schema version and the row count of each table"""
+        with self.cursor_manager(commit=False) as cursor:
+            info = {pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+                    for pragma in ('user_version', 'page_size', 'page_count', 'freelist_count')}
+            info['db_bytes'] = info['page_count'] * info['page_size']
+            info['free_bytes'] = info['freelist_count'] * info['page_size']
+            wal = self.path.with_name(self.path.name + '-wal') if self.path is not None else None
+            info['wal_bytes'] = wal.stat().st_size if wal is not None and wal.exists() else 0
+            for table in (ENTRIES_TABLE, CHUNKS_TABLE, REVISIONS_TABLE, STATS_TABLE, TAGS_TABLE, ENTRY_TAGS_TABLE):
+                info[f'{table}_rows'] = cursor.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            self.logger.info('Diagnostics: %s', info)
+            return info
+
+    @metrics.instrument()
+    def vacuum(self) -> int:
+        """Rebuilds the db file without its free pages. Saves wait until it is done. Returns the bytes freed, 0 when
+        the rebuilt file is no smaller, which it can be by a page when there was nothing to free"""
+        with self.cursor_manager() as cursor:
+            before = cursor.execute('PRAGMA page_count').fetchone()[0]
+            cursor.execute('VACUUM')
+            after = cursor.execute('PRAGMA page_count').fetchone()[0]
+            freed = max(before - after, 0) * cursor.execute('PRAGMA page_size').fetchone()[0]
+            self.logger.info('Vacuumed the journal, freed %s bytes', freed)
+            return freed
+
+    @metrics.instrument()
+    def analyze(self):
+        """Refreshes the query planner statistics for every table"""
+        with self.cursor_manager() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute('PRAGMA optimize')
+            self.logger.info('Planner statistics refreshed')
@@ -0,0 +1,472 @@
+"""Sharded journal layout, where each year's entries are kept in their own db file in config.DB_SHARD_DIR.
+Every shard is a complete journal with the usual schema, so a year is read and written by its own repository.Entries.
+ShardedEntries has the same methods as Entries and routes each call to the year it is about. Queries that
+span every year attach the shards, read only, to an in-memory hub connection.
+split_journal copies a single file journal into shards"""
+
+import datetime
+import re
+import sqlite3
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from config import (DB_SHARD_NAME, ENTRIES_TABLE, CHUNKS_TABLE, REVISIONS_TABLE, ENTRIES_TEXT_VIEW, TAGS_TABLE, ENTRY_TAGS_TABLE,
+                    REVISION_KEEP_COUNT, REVISION_MAX_AGE_DAYS)
+from entry_codec import register_functions
+import logger
+import metrics
+import migrations
+import repository
+from repository import ConflictPolicy, TagMatch
+
+
+def schema_name(year: int) -> str:
+    #the name a shard is attached under on the hub connection
+    return f'shard_{year}'
+
+
+class Shards:
+    """Owns the connections of a sharded journal: one for each year's file, opened when the year is first used,
+    and the hub that the shards are attached to for queries across years.
+    execute and close act on every open connection, so the db worker can use this in place of a single connection"""
+    def __init__(self, shard_dir: str, logger_: logger.logging.Logger) -> None:
+        self.shard_dir = Path(shard_dir)
+        self.logger = logger_
+        self._connections = {}
+        self._hub = None
+        #years attached to the hub, least recently used first
+        self._attached = OrderedDict()
+        self._name_pattern = re.compile(re.escape(DB_SHARD_NAME).replace(re.escape('{year}'), r'(\d{4})'))
+
+    def path(self, year: int) -> Path:
+        return self.shard_dir / DB_SHARD_NAME.format(year=year)
+
+    def years(self) -> list[int]:
+        """The years that have a shard file, oldest first"""
+        if not self.shard_dir.is_dir():
+            return []
+        matches = (self._name_pattern.fullmatch(path.name) for path in self.shard_dir.iterdir())
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def exists(self, year: int) -> bool:
+        return year in self._connections or self.path(year).exists()
+
+    def connect(self, year: int) -> sqlite3.Connection:
+        """Returns the year's connection, opening it, and creating the file, the first time"""
+        conn = self._connections.get(year)
+        if conn is None:
+            self.shard_dir.mkdir(parents=True, exist_ok=True)
+            conn = repository.open_connection(self.path(year), self.logger)
+            self._connections[year] = conn
+            self.logger.info('Opened shard for %s', year)
+        return conn
+
+    @property
+    def hub(self) -> sqlite3.Connection:
+        #the hub has nothing of its own, it only holds the attached shards. it needs the codec functions,
+        #the shards' views decompress the entries through them
+        if self._hub is None:
+            self._hub = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_COLNAMES, uri=True, check_same_thread=False)
+            register_functions(self._hub)
+        return self._hub
+
+    def attached(self, years: list[int]) -> Iterator[list[str]]:
+        """Attaches the years' shards to the hub and yields their schema names, in groups no bigger than sqlite's
+        limit on attached databases. Shards stay attached for later queries until the room is needed"""
+        limit = self.hub.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        for start in range(0, len(years), limit):
+            group = years[start:start + limit]
+            for year in group:
+                self.attach(year, keep=group)
+            yield [schema_name(year) for year in group]
+
+    def attach(self, year: int, keep: list[int]) -> None:
+        if year in self._attached:
+            self._attached.move_to_end(year)
+            return
+        limit = self.hub.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        while len(self._attached) >= limit:
+            evicted = next(attached for attached in self._attached if attached not in keep)
+            self.hub.execute(f'DETACH DATABASE {schema_name(evicted)}')
+            del self._attached[evicted]
+        #read only, so nothing run on the hub can change a shard behind its own connection
+        self.hub.execute(f'ATTACH DATABASE ? AS {schema_name(year)}', (self.path(year).resolve().as_uri() + '?mode=ro', ))
+        self._attached[year] = True
+
+    def execute(self, sql: str) -> None:
+        #runs a statement, like PRAGMA optimize, on every shard that is open
+        for conn in self._connections.values():
+            conn.execute(sql)
+
+    def close(self) -> None:
+        if self._hub is not None:
+            self._hub.close()
+            self._hub = None
+            self._attached.clear()
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+
+class ShardedEntries:
+    """The entries repository for a sharded journal. Calls about one date go to that year's Entries,
+    calls about every year are run on each shard, or on the hub, and the results put together"""
+    #these don't depend on the connection, so they are shared with Entries
+    format_date = repository.Entries.format_date
+    search_terms = repository.Entries.search_terms
+    format_search_query = repository.Entries.format_search_query
+    match_query = repository.Entries.match_query
+
+    def __init__(self, shards: Shards) -> None:
+        self.shards = shards
+        self.logger = logger.journal_logger('shards')
+        self._entries = {}
+        #the stack of shard transactions while a transaction block is open, shards join it when they are first used
+        self._transaction = None
+        self._in_transaction = set()
+
+    def shard(self, year: int, create: bool = True) -> repository.Entries | None:
+        """The year's repository. Reads pass create=False, and get None for a year that has no shard"""
+        entries = self._entries.get(year)
+        if entries is None:
+            if not create and not self.shards.exists(year):
+                return None
+            entries = self._entries[year] = repository.Entries(self.shards.connect(year))
+        if self._transaction is not None and year not in self._in_transaction:
+            self._transaction.enter_context(entries.transaction())
+            self._in_transaction.add(year)
+        return entries
+
+    def database_files(self) -> list[Path]:
+        return [self.shards.path(year) for year in self.shards.years()]
+
+    def all_shards(self) -> Iterator[repository.Entries]:
+        for year in self.shards.years():
+            yield self.shard(year)
+
+    @contextmanager
+    def transaction(self):
+        """Unit of work across shards. Each shard used inside the block gets its own transaction, and they are
+        committed together when the block ends. A shard can fail to commit after another has, so this is only
+        atomic for each year"""
+        if self._transaction is not None:
+            yield self
+            return
+        with ExitStack() as stack:
+            self._transaction = stack
+            try:
+                yield self
+            finally:
+                self._transaction = None
+                self._in_transaction.clear()
+
+    def by_year(self, rows: Iterable[tuple], key=lambda row: row[0]) -> dict[int, list]:
+        #groups rows by the year of their date, keeping their order
+        years = {}
+        for row in rows:
+            years.setdefault(key(row).year, []).append(row)
+        return years
+
+    def year_ranges(self, start_date: datetime.date, end_date: datetime.date) -> Iterator[tuple[int, datetime.date, datetime.date]]:
+        #splits a date range into the part of it in each year
+        for year in range(start_date.year, end_date.year + 1):
+            yield year, max(start_date, datetime.date(year, 1, 1)), min(end_date, datetime.date(year, 12, 31))
+
+    #------------------------------ one date ------------------------------
+
+    def store_entry(self, date: datetime.date, text: str):
+        self.shard(date.year).store_entry(date, text)
+
+    def upsert_entry(self, date: datetime.date, text: str):
+        self.shard(date.year).upsert_entry(date, text)
+
+    def update_entry(self, date: datetime.date, text: str):
+        entries = self.shard(date.year, create=False)
+        if entries is not None:
+            entries.update_entry(date, text)
+
+    def delete_entry(self, date: datetime.date):
+        entries = self.shard(date.year, create=False)
+        if entries is not None:
+            entries.delete_entry(date)
+
+    def get_entry(self, date: datetime.date) -> str | None:
+        entries = self.shard(date.year, create=False)
+        return entries.get_entry(date) if entries is not None else None
+
+    def get_entry_chunks(self, date: datetime.date, start: int = 0, limit: int | None = None) -> list[str]:
+        entries = self.shard(date.year, create=False)
+        return entries.get_entry_chunks(date, start, limit) if entries is not None else []
+
+    def list_revisions(self, date: datetime.date) -> list[tuple]:
+        entries = self.shard(date.year, create=False)
+        return entries.list_revisions(date) if entries is not None else []
+
+    def get_revision(self, date: datetime.date, revision: int) -> str | None:
+        entries = self.shard(date.year, create=False)
+        return entries.get_revision(date, revision) if entries is not None else None
+
+    def restore_revision(self, date: datetime.date, revision: int) -> bool:
+        entries = self.shard(date.year, create=False)
+        return entries.restore_revision(date, revision) if entries is not None else False
+
+    def get_year_stats(self, year: int) -> list[tuple]:
+        entries = self.shard(year, create=False)
+        return entries.get_year_stats(year) if entries is not None else []
+
+    def tag_entry(self, date: datetime.date, *names: str) -> int:
+        entries = self.shard(date.year, create=False)
+        return entries.tag_entry(date, *names) if entries is not None else 0
+
+    def untag_entry(self, date: datetime.date, *names: str) -> int:
+        entries = self.shard(date.year, create=False)
+        return entries.untag_entry(date, *names) if entries is not None else 0
+
+    def get_tags(self, date: datetime.date) -> list[tuple]:
+        entries = self.shard(date.year, create=False)
+        return entries.get_tags(date) if entries is not None else []
+
+    def set_mood(self, date: datetime.date, mood: int | None) -> bool:
+        entries = self.shard(date.year, create=False)
+        return entries.set_mood(date, mood) if entries is not None else False
+
+    #------------------------------ date ranges and batches ------------------------------
+
+    def get_entries(self, start_date: datetime.date, end_date: datetime.date) -> list[tuple]:
+        rows = []
+        for year, start, end in self.year_ranges(start_date, end_date):
+            entries = self.shard(year, create=False)
+            if entries is not None:
+                rows.extend(entries.get_entries(start, end))
+        return rows
+
+    def get_entry_index(self, start_date: datetime.date, end_date: datetime.date) -> list[tuple]:
+        rows = []
+        for year, start, end in self.year_ranges(start_date, end_date):
+            entries = self.shard(year, create=False)
+            if entries is not None:
+                rows.extend(entries.get_entry_index(start, end))
+        return rows
+
+    def get_moods(self, start_date: datetime.date, end_date: datetime.date) -> list[tuple]:
+        rows = []
+        for year, start, end in self.year_ranges(start_date, end_date):
+            entries = self.shard(year, create=False)
+            if entries is not None:
+                rows.extend(entries.get_moods(start, end))
+        return rows
+
+    def find_by_tags(self, names: Iterable[str], match: TagMatch = TagMatch.ALL, start_date: datetime.date = datetime.date.min,
+                     end_date: datetime.date = datetime.date.max, exclude: Iterable[str] = ()) -> list[datetime.date]:
+        #a date's tags are all in its own year, so each shard answers for its part of the range.
+        #only the years with a shard are looked at, the default range covers every year there could be
+        names, exclude = list(names), list(exclude)
+        dates = []
+        for year in self.shards.years():
+            if start_date.year <= year <= end_date.year:
+                start, end = max(start_date, datetime.date(year, 1, 1)), min(end_date, datetime.date(year, 12, 31))
+                dates.extend(self.shard(year).find_by_tags(names, match, start, end, exclude))
+        return dates
+
+    def import_entries(self, rows: Iterable[tuple[datetime.date, str]], conflict: ConflictPolicy = ConflictPolicy.SKIP) -> int:
+        count = 0
+        with self.transaction():
+            for year, batch in self.by_year(rows).items():
+                count += self.shard(year).import_entries(batch, conflict)
+        return count
+
+    def store_many(self, rows: Iterable[tuple[datetime.date, str]]) -> int:
+        count = 0
+        with self.transaction():
+            for year, batch in self.by_year(rows).items():
+                count += self.shard(year).store_many(batch)
+        return count
+
+    def upsert_many(self, rows: Iterable[tuple[datetime.date, str]]) -> int:
+        return self.import_entries(rows, ConflictPolicy.OVERWRITE)
+
+    def delete_many(self, dates: Iterable[datetime.date]) -> int:
+        dates = list(dates)
+        with self.transaction():
+            for year, batch in self.by_year(dates, key=lambda date: date).items():
+                entries = self.shard(year, create=False)
+                if entries is not None:
+                    entries.delete_many(batch)
+        return len(dates)
+
+    def iter_entries(self, chunk_size: int = 1000) -> Iterator[list[tuple]]:
+        #the shards are read oldest first, so the entries still come out in date order
+        for entries in self.all_shards():
+            yield from entries.iter_entries(chunk_size)
+
+    #------------------------------ every year ------------------------------
+
+    @metrics.instrument()
+    def get_recent_entries(self, num_entries: int) -> list[tuple]:
+        """The newest years' most recently written entries. Unlike Entries.get_recent_entries this is not the order
+        the entries were written in across years: the ids of each file only order the entries within it, and no write
+        time is stored, so every entry of a later year comes before any entry of an earlier one"""
+        rows = []
+        for schemas in self.shards.attached(self.shards.years()[::-1]):
+            query = ' UNION ALL '.join(
+                f'SELECT date AS "date [day]", COALESCE(entry, \'\'), {index} AS shard, id FROM {schema}.{ENTRIES_TEXT_VIEW}' for index, schema in enumerate(schemas))
+            query += ' ORDER BY shard, id DESC LIMIT ?'
+            rows.extend(row[:2] for row in self.shards.hub.execute(query, (num_entries - len(rows), )))
+            if len(rows) >= num_entries:
+                break
+        self.logger.info('Retrieved most recent entries')
+        return rows
+
+    @metrics.instrument()
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> list[tuple]:
+        """Full text search over every year. Each shard ranks its own matches, but the ranks of different files
+        can't be compared, bm25 scales them by the word counts of the file they are in. So the results are merged
+        by their place in their own year: every year's best match first, newest year first, then every year's
+        second best match, and so on"""
+        if not self.search_terms(query):
+            return []
+        matches = []
+        shard = 0
+        for schemas in self.shards.attached(self.shards.years()):
+            for schema in schemas:
+                match_sql, params = self.match_query(query, schema)
+                rows = self.shards.hub.execute(f'''
+                    SELECT date AS "date [day]", snippet
+                    FROM ({match_sql})
+                    ORDER BY rank
+                    LIMIT ?
+                    ''', (*params, limit + offset))
+                #shards are attached oldest first, so a higher shard number is a newer year
+                matches.extend((position, -shard, date, snippet) for position, (date, snippet) in enumerate(rows))
+                shard += 1
+        matches.sort(key=lambda match: match[:2])
+        data = [(date, snippet) for _, _, date, snippet in matches[offset:offset + limit]]
+        self.logger.info('Search returned %s entries', len(data))
+        return data
+
+    def list_tags(self) -> list[tuple]:
+        """Entries.list_tags added up over the shards, most used first"""
+        counts = {}
+        for entries in self.all_shards():
+            for name, count in entries.list_tags():
+                counts[name] = counts.get(name, 0) + count
+        return sorted(counts.items(), key=lambda tag: (-tag[1], tag[0]))
+
+    def rebuild_search_index(self):
+        for entries in self.all_shards():
+            entries.rebuild_search_index()
+
+    def rebuild_stats(self):
+        for entries in self.all_shards():
+            entries.rebuild_stats()
+
+    def compact_revisions(self, keep: int | None = REVISION_KEEP_COUNT, max_age_days: int | None = REVISION_MAX_AGE_DAYS) -> int:
+        return sum(entries.compact_revisions(keep, max_age_days) for entries in self.all_shards())
+
+    def recompress_batch(self, after: tuple[int, int] | int = 0, batch_size: int = 500) -> tuple[tuple[int, int] | None, int]:
+        """Entries.recompress_batch over every shard. after is 0 to start, then the (year, id) that was returned"""
+        years = self.shards.years()
+        after_year, after_id = after or (years[0] if years else 0, 0)
+        for year in years:
+            if year < after_year:
+                continue
+            last_id, count = self.shard(year).recompress_batch(after_id if year == after_year else 0, batch_size)
+            if last_id is not None:
+                return (year, last_id), count
+        return None, 0
+
+    def diagnostics(self) -> dict:
+        """Entries.diagnostics added up over the shards. The page size and schema version are the same for each"""
+        info = {'shards': 0}
+        for entries in self.all_shards():
+            info['shards'] += 1
+            for key, value in entries.diagnostics().items():
+                info[key] = value if key in ('page_size', 'user_version') else info.get(key, 0) + value
+        return info
+
+    def vacuum(self) -> int:
+        return sum(entries.vacuum() for entries in self.all_shards())
+
+    def analyze(self):
+        for entries in self.all_shards():
+            entries.analyze()
+
+    def storage_stats(self) -> dict:
+        """Entries.storage_stats added up over the shards"""
+        stats = {'shards': 0}
+        for entries in self.all_shards():
+            stats['shards'] += 1
+            for key, value in entries.storage_stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+
+def split_journal(source: str, shard_dir: str, logger_: logger.logging.Logger) -> dict[int, int]:
+    """Copies a single file journal into one shard per year. The source is brought up to the current schema first
+    and is otherwise left as it is. Each year is copied in sql with the source attached to the shard, the shard's
+    triggers fill in its search index and stats as the rows go in. Returns the number of entries in each year.
+    Raises ValueError if there is no journal at source"""
+    #connect would make an empty journal for a path that doesn't exist, and the split would then succeed with nothing
+    if not Path(source).is_file():
+        raise ValueError(f'{source} is not a journal file')
+    conn = sqlite3.connect(source)
+    try:
+        register_functions(conn)
+        migrations.migrate(conn, logger_)
+        years = [int(year) for year, in conn.execute(f'''
+            SELECT {migrations.day_text('date', '%Y')} FROM {ENTRIES_TABLE}
+            UNION
+            SELECT {migrations.day_text('date', '%Y')} FROM {REVISIONS_TABLE}
+            ''')]
+    finally:
+        conn.close()
+
+    shards = Shards(shard_dir, logger_)
+    if shards.years():
+        raise ValueError(f'{shard_dir} already has shards, split into an empty folder')
+
+    counts = {}
+    try:
+        for year in years:
+            shard = repository.Entries(shards.connect(year))
+            span = (datetime.date(year, 1, 1), datetime.date(year, 12, 31))
+            shard.conn.execute('ATTACH DATABASE ? AS source', (source, ))
+            try:
+                with shard.transaction(), shard.cursor_manager() as cursor:
+                    #chunks index and count the words of themselves, the entries rows add the entry and its length
+                    cursor.execute(f'''
+                        INSERT INTO {CHUNKS_TABLE} (date, seq, data, codec)
+                        SELECT date, seq, data, codec FROM source.{CHUNKS_TABLE} WHERE date BETWEEN ? AND ?
+                        ''', span)
+                    #in id order, so the most recently written entries stay the most recent
+                    cursor.execute(f'''
+                        INSERT INTO {ENTRIES_TABLE} (date, entry, codec, text_length, mood)
+                        SELECT date, entry, codec, text_length, mood FROM source.{ENTRIES_TABLE} WHERE date BETWEEN ? AND ? ORDER BY id
+                        ''', span)
+                    counts[year] = cursor.rowcount
+                    #tag ids are only unique within a file, the shard's tags are matched up with the source's by name
+                    cursor.execute(f'''
+                        INSERT INTO {TAGS_TABLE} (name)
+                        SELECT DISTINCT t.name FROM source.{ENTRY_TAGS_TABLE} et
+                        JOIN source.{TAGS_TABLE} t ON t.id = et.tag_id
+                        WHERE et.date BETWEEN ? AND ?
+                        ''', span)
+                    cursor.execute(f'''
+                        INSERT INTO {ENTRY_TAGS_TABLE} (tag_id, date, source)
+                        SELECT t.id, et.date, et.source FROM source.{ENTRY_TAGS_TABLE} et
+                        JOIN source.{TAGS_TABLE} st ON st.id = et.tag_id
+                        JOIN {TAGS_TABLE} t ON t.name = st.name
+                        WHERE et.date BETWEEN ? AND ?
+                        ''', span)
+                    cursor.execute(f'''
+                        INSERT INTO {REVISIONS_TABLE} (date, revision, replaced_at, kind, data)
+                        SELECT date, revision, replaced_at, kind, data FROM source.{REVISIONS_TABLE} WHERE date BETWEEN ? AND ?
+                        ''', span)
+            finally:
+                shard.conn.execute('DETACH DATABASE source')
+            logger_.info('Split %s entries for %s into %s', counts[year], year, shards.path(year))
+    finally:
+        shards.close()
+    return counts
@@ -0,0 +1,28 @@
+"""Tag names and the inline #hashtags in entry text. Tags are stored in their own tables, see Entries.tag_entry,
+and the hashtags of an entry are picked up when it is saved, see Entries.sync_tags"""
+
+import re
+
+from config import TAG_MAX_LENGTH
+
+#a tag starts with a letter and goes on with letters, digits, _ and -, so #1 isn't a tag
+TAG_NAME = r'[^\W\d_][\w-]*'
+_name_pattern = re.compile(TAG_NAME)
+#a # straight after a word, another # or & is part of something else, like a url fragment or an html entity
+_inline_pattern = re.compile(rf'(?<![\w#&/])#({TAG_NAME})')
+
+
+def normalise_tag(name: str) -> str:
+    """The stored form of a tag name, without the # and case folded, so #Work and work are the same tag.
+    Raises ValueError for a name that isn't a valid tag"""
+    tag = name.strip().removeprefix('#').casefold()
+    if not _name_pattern.fullmatch(tag) or len(tag) > TAG_MAX_LENGTH:
+        raise ValueError(f'not a tag: {name!r}')
+    return tag
+
+
+def extract_tags(text: str | None) -> set[str]:
+    """The normalised names of the #hashtags in text. Names longer than TAG_MAX_LENGTH are left out"""
+    if not text or '#' not in text:
+        return set()
+    return {tag for tag in (match.casefold() for match in _inline_pattern.findall(text)) if len(tag) <= TAG_MAX_LENGTH}
@@ -0,0 +1,126 @@
+"""Bulk import and export of journal entries. Supported formats are csv, jsonl and plain text.
+Everything here streams: exports read the entries table in chunks and write as they go,
+imports parse the file lazily and write it in batched transactions"""
+
+import csv
+import datetime
+import json
+import re
+from itertools import islice
+from typing import Callable, Iterator, TextIO
+
+import config
+import logger
+from repository import ConflictPolicy
+
+#plain text entries start with a header line like '=== 2024-12-07 ==='
+TXT_HEADER = '=== {date} ==='
+TXT_HEADER_PATTERN = re.compile(r'^=== (\d{4}-\d{2}-\d{2}) ===$')
+#a line of an entry that looks like a header is written with a \ in front, as is one that already starts with \s and
+#looks like a header after them, so the backslashes an entry had are kept. one \ is taken off again on import
+TXT_ESCAPE_PATTERN = re.compile(r'^(\\*=== \d{4}-\d{2}-\d{2} ===)$', re.MULTILINE)
+TXT_ESCAPED_PATTERN = re.compile(r'^\\+=== \d{4}-\d{2}-\d{2} ===$')
+
+SUPPORTED_FORMATS = ('csv', 'jsonl', 'txt')
+
+
+def detect_format(path: str) -> str:
+    #the format is taken from the file extension
+    file_format = path.rsplit('.', 1)[-1].lower()
+    if file_format not in SUPPORTED_FORMATS:
+        raise ValueError(f'Unsupported file format: {file_format}. Use one of {", ".join(SUPPORTED_FORMATS)}')
+    return file_format
+
+
+#------------------------------ export ------------------------------
+
+def write_csv(file: TextIO) -> Callable[[list[tuple]], None]:
+    writer = csv.writer(file)
+    writer.writerow(('date', 'entry'))
+    return writer.writerows
+
+def write_jsonl(file: TextIO) -> Callable[[list[tuple]], None]:
+    def write_rows(rows):
+        file.writelines(json.dumps({'date': date.isoformat(), 'entry': entry}, ensure_ascii=False) + '\n' for date, entry in rows)
+    return write_rows
+
+def escape_txt(entry: str) -> str:
+    return TXT_ESCAPE_PATTERN.sub(r'\\\1', entry)
+
+def write_txt(file: TextIO) -> Callable[[list[tuple]], None]:
+    def write_rows(rows):
+        file.writelines(f'{TXT_HEADER.format(date=date)}\n{escape_txt(entry)}\n\n' for date, entry in rows)
+    return write_rows
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'txt': write_txt}
+
+
+def export_entries(entries, path: str, file_format: str | None = None,
+                   chunk_size: int = config.EXPORT_CHUNK_SIZE,
+                   progress: Callable[[int], None] | None = None) -> int:
+    """Writes every entry to path. progress is called with the running row count after each chunk.
+    Returns the number of exported entries"""
+    file_format = file_format or detect_format(path)
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        write_rows = WRITERS[file_format](file)
+        for rows in entries.iter_entries(chunk_size):
+            write_rows(rows)
+            count += len(rows)
+            if progress:
+                progress(count)
+    logger.journal_logger('transfer').info('Exported %s entries to %s', count, path)
+    return count
+
+
+#------------------------------ import ------------------------------
+
+def read_csv(file: TextIO) -> Iterator[tuple[str, str]]:
+    for row in csv.DictReader(file):
+        yield row['date'], row['entry']
+
+def read_jsonl(file: TextIO) -> Iterator[tuple[str, str]]:
+    for line in file:
+        if line.strip():
+            item = json.loads(line)
+            yield item['date'], item['entry']
+
+def read_txt(file: TextIO) -> Iterator[tuple[str, str]]:
+    date, lines = None, []
+    for line in file:
+        match = TXT_HEADER_PATTERN.match(line.rstrip('\n'))
+        if match:
+            if date is not None:
+                yield date, ''.join(lines).removesuffix('\n\n')
+            date, lines = match.group(1), []
+        elif date is not None:
+            lines.append(line[1:] if TXT_ESCAPED_PATTERN.match(line.rstrip('\n')) else line)
+    if date is not None:
+        yield date, ''.join(lines).removesuffix('\n\n')
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'txt': read_txt}
+
+
+def parse_entries(file: TextIO, file_format: str) -> Iterator[tuple[datetime.date, str]]:
+    for date, entry in READERS[file_format](file):
+        yield datetime.date.fromisoformat(date), entry
+
+
+def import_entries(entries, path: str, file_format: str | None = None,
+                   conflict: ConflictPolicy = ConflictPolicy.SKIP,
+                   batch_size: int = config.IMPORT_BATCH_SIZE,
+                   progress: Callable[[int], None] | None = None) -> int:
+    """Reads entries from path and writes them to the journal in batches of batch_size rows.
+    progress is called with the running count of rows read after each batch. Returns the number of entries written,
+    which leaves out rows skipped by the conflict policy"""
+    file_format = file_format or detect_format(path)
+    read = written = 0
+    with open(path, encoding='utf-8', newline='') as file:
+        rows = parse_entries(file, file_format)
+        while batch := list(islice(rows, batch_size)):
+            written += entries.import_entries(batch, conflict)
+            read += len(batch)
+            if progress:
+                progress(read)
+    logger.journal_logger('transfer').info('Imported %s of %s entries from %s', written, read, path)
+    return written
@@ -1,10 +1,15 @@
 """This module will contain the main UI classes; today's page (main page), calendar page, and settings page"""
 
+import datetime
 import tkinter as tk
 from tkinter import ttk
+from tkinter import filedialog
+from tkinter import messagebox
 from functools import partial
 
 import logger
+import config
+import metrics
 
 
 class StyleManager:
@@ -36,6 +41,13 @@ class StyleManager:
         # Calendar day buttons
         self.style.configure('CalendarButton.TButton', background='#e6f7ff', foreground='#004080')
         self.style.map('CalendarButton.TButton', background=[('active', '#cce7ff')])
+        self.style.configure('CalendarEntry.TButton', background='#b3e0ff', foreground='#004080')
+        self.style.map('CalendarEntry.TButton', background=[('active', '#cce7ff')])
+        self.style.configure('CalendarToday.TButton', background='#e6f7ff', foreground='#c05000')
+        self.style.map('CalendarToday.TButton', background=[('active', '#cce7ff')])
+        self.style.configure('CalendarFocus.TButton', background='#004080', foreground='#ffffff')
+        self.style.map('CalendarFocus.TButton', background=[('active', '#0056b3')])
+        self.style.configure('CalendarBlank.TButton', relief='flat')
 
         # Save button
         self.style.configure('SaveButton.TButton', background='#4CAF50', foreground='#ffffff')
@@ -64,7 +76,7 @@ class MainPage(ttk.Frame):
         #initialize the frame inheritance
         super().__init__(root)
 
-        self.log = logger.journal_logger()
+        self.log = logger.journal_logger('ui')
 
         #place the main page frame
         self.place(x=0, y=0, relwidth=1, relheight=1)
@@ -75,14 +87,29 @@ class MainPage(ttk.Frame):
         #initialize tk variables
         self.date_str = tk.StringVar()
 
+        #autosave state. dirty is set by edits to the text box, the job is the pending debounced save
+        self.dirty = False
+        self._autosave_job = None
+
+        #large entries stream into the text box a chunk per after callback, the box is read only until they are all in
+        self.day = None
+        self._pending_chunks = []
+        self._entry_complete = True
+        self._stream_job = None
+
         self.populate_frame()
         self.init_day_info(init_day)
     
     def init_day_info(self, day):
         #this takes the day object and passes the needed info to the proper locations
+        self.day = day
+        self.cancel_streaming()
         self.clear_textbox()
         self.set_date_str(day)
         self.populate_textbox(day)
+        #loading a day isn't an edit, so there is nothing to autosave yet
+        self.cancel_autosave()
+        self.dirty = False
         
     def set_date_str(self, day):
         #this sets the tk.stringvar to the currently focused date
@@ -93,6 +120,7 @@ class MainPage(ttk.Frame):
         self.date_label = ttk.Label(self, textvariable=self.date_str)
         self.cal_page_button = ttk.Button(self, text='Calendar Page', style='NavButton.TButton', command=lambda: self.cont.show_page('calendar'))
         self.entry_textbox = tk.Text(self, wrap='none')
+        self.entry_textbox.bind('<<Modified>>', self.text_modified)
         self.save_entry_button = ttk.Button(self, text='Save Entry', style='SaveButton.TButton', command=self.save_entry_button_clicked)
 
         #place the widgets
@@ -104,9 +132,52 @@ class MainPage(ttk.Frame):
     def save_entry_button_clicked(self):
         #this should grab the text in the tkinter text widget, then send it to the controller,
         #the controller should already be aware of the days date
+        if self.loading:
+            return
+        self.cancel_autosave()
+        self.dirty = False
         entry = self.entry_textbox.get('1.0', 'end-1c')
         self.cont.save_day(entry)
 
+    def text_modified(self, event=None):
+        #tk only fires <<Modified>> when the modified flag changes, so it is reset to catch the next edit.
+        #resetting the flag fires the event again, which is ignored here
+        if not self.entry_textbox.edit_modified():
+            return
+        self.entry_textbox.edit_modified(False)
+        if self.loading:
+            return
+        self.dirty = True
+        if config.AUTOSAVE_ENABLED:
+            #every edit pushes the save back, so a burst of typing ends in a single save
+            self.cancel_autosave()
+            self._autosave_job = self.after(config.AUTOSAVE_DELAY, self.autosave)
+
+    def autosave(self):
+        self._autosave_job = None
+        self.flush_autosave()
+
+    def flush_autosave(self):
+        """Saves the entry straight away if it has unsaved edits. Called on page switch and window close"""
+        self.cancel_autosave()
+        if self.dirty:
+            self.save_entry_button_clicked()
+
+    def cancel_autosave(self):
+        if self._autosave_job is not None:
+            self.after_cancel(self._autosave_job)
+            self._autosave_job = None
+
+    def set_saving(self, saving: bool):
+        #the save runs in the background, the button shows it is pending until the db is done
+        if saving:
+            self.save_entry_button.configure(text='Saving...', state='disabled')
+        else:
+            self.save_entry_button.configure(text='Save Entry', state='normal')
+
+    def show_save_error(self):
+        messagebox.showerror('Save error', 'The entry could not be saved. Please try again.')
+
     def clear_textbox(self):
         #this should be called any time a new date is selected
         self.entry_textbox.delete('1.0', 'end')
@@ -114,6 +185,49 @@ class MainPage(ttk.Frame):
     def populate_textbox(self, day):
         entry = day.entry
         self.entry_textbox.insert('1.0', entry)
+        #a large entry opens with its first chunks, the rest come through append_chunks
+        self._entry_complete = not day.entry_streaming
+        self.set_loading_state()
+
+    @property
+    def loading(self) -> bool:
+        return not self._entry_complete or bool(self._pending_chunks)
+
+    def append_chunks(self, day, chunks, complete):
+        """Queues the next chunks of a streaming entry. Each chunk is inserted from its own after callback,
+        so the window keeps responding while a very large entry loads"""
+        if self.day is None or day.date != self.day.date:
+            return
+        self._pending_chunks.extend(chunks)
+        self._entry_complete = complete
+        if self._stream_job is None:
+            self._stream_job = self.after(1, self.insert_next_chunk)
+
+    def insert_next_chunk(self):
+        self._stream_job = None
+        if self._pending_chunks:
+            self.entry_textbox.configure(state='normal')
+            self.entry_textbox.insert('end-1c', self._pending_chunks.pop(0))
+        if self._pending_chunks:
+            self._stream_job = self.after(1, self.insert_next_chunk)
+        self.set_loading_state()
+
+    def cancel_streaming(self):
+        if self._stream_job is not None:
+            self.after_cancel(self._stream_job)
+            self._stream_job = None
+        self._pending_chunks = []
+        self._entry_complete = True
+        self.entry_textbox.configure(state='normal')
+
+    def set_loading_state(self):
+        #the text box can't be edited, or saved, until every chunk is in
+        if self.loading:
+            self.entry_textbox.configure(state='disabled')
+            self.save_entry_button.configure(text='Loading...', state='disabled')
+        else:
+            self.entry_textbox.configure(state='normal')
+            self.save_entry_button.configure(text='Save Entry', state='normal')
 
 
 class CalendarPage(ttk.Frame):
@@ -123,7 +237,7 @@ class CalendarPage(ttk.Frame):
         
         super().__init__(root)
 
-        self.log = logger.journal_logger()
+        self.log = logger.journal_logger('ui')
 
         #use place for the curent frame as it is more versitile
         self.place(anchor='ne',relx=1, y=0, relwidth=.85, relheight=1)
@@ -148,6 +262,7 @@ class CalendarPage(ttk.Frame):
         self.calendar_frame = CalendarFrame(self, self.cont)
         self.refresh_calendar_frame()
         self.today_button = ttk.Button(self, text='Today', command=self.cont.today_clicked)
+        self.options_button = ttk.Button(self, text='Options', command=lambda: self.cont.show_page('options'))
         self.recent_entries = RecentEntriesFrame(self, self.cont)
 
         
@@ -156,11 +271,12 @@ class CalendarPage(ttk.Frame):
         self.prev_month_button.place(anchor='n', relx=.25, y=5, width=75, height=40)
         self.next_month_button.place(anchor='n', relx=.75, y=5, width=75, height=40)
         self.today_button.place(x=5, rely=.15, width=50, height=45)
+        self.options_button.place(x=5, rely=.46, width=80, height=40)
         self.recent_entries.place(anchor='se', relx=.99, rely=.99, relwidth=.97, relheight=.45)
 
-        recent_entries_data = self.cont.get_recent_entries()
-
-        self.recent_entries.set_date_entry_text(recent_entries_data)
+        #the recent entries are filled in once the db worker returns them
+        self.recent_entries.set_loading()
+        self.cont.get_recent_entries(self.recent_entries.set_date_entry_text)
 
     def refresh_calendar_frame(self):
         """This function was made separate from the calendar frame class to make it easier for the controller to call"""
@@ -183,24 +299,24 @@ class CalendarPage(ttk.Frame):
 
   
 class CalendarFrame(ttk.Frame):
-    """this class holds the building and populating of the calendar frame for the calendar page"""
+    """this class holds the building and populating of the calendar frame for the calendar page.
+    The 6x7 grid of day buttons is built once, changing month only updates the buttons that changed"""
     def __init__(self, parent, controller_):
         super().__init__(parent)
         
-        self.log = logger.journal_logger()
+        self.log = logger.journal_logger('ui')
 
         self.cont = controller_
         self._callback = controller_.calendar_button_clicked
 
-    def populate_calendar_frame(self):
-        """This function is called by the calendar page class to allow the controller easier access"""
+        #day of month shown on each pooled button, 0 for the blank cells before and after the month
+        self._day_numbers = [0] * 42
+        #last options given to each button, so only the ones that changed get reconfigured
+        self._button_options = [{} for _ in range(42)]
 
-        #to keep the calendar consistant the previous widgets have to be cleared
-        for widget in self.winfo_children():
-            widget.destroy()
-
-        self.calendar_matrix = self.build_calendar_matrix()    
+        self.build_calendar_grid()
 
+    def build_calendar_grid(self):
         #set row and column weight to keep size uniform
         for i in range(7):
             self.grid_columnconfigure(i,weight=1, uniform='calendar_column')
@@ -210,37 +326,65 @@ class CalendarFrame(ttk.Frame):
         days = ['Mon', 'Tues', 'Wed', 'Thurs', 'Fri', 'Sat', 'Sun']
         for i,day in enumerate(days):
             ttk.Label(self, text = day).grid(row=0, column=i)
-        for r,week in enumerate(self.calendar_matrix, start=1):
-            for c, button in enumerate(week):
-                if button is not None:
-                    button.grid(row=r, column=c, sticky='nsew')
-        
-    def build_calendar_matrix(self) -> list[list]:
-        """Helper Method for conversion of model.Month.month_matrix into tkinter button grid"""
-        
-        calendar_matrix = []
-        for week in self.cont.month_cal:
-            new_week = []
-            for day in week:
-                if day:
-                    day_ = day.date.day
-                    button = ttk.Button(
-                        self, 
-                        text = day_, 
-                        command=lambda d=day_: self._callback(d)
-                        )
-                    new_week.append(button)
-                else:
-                    new_week.append(None)
-            calendar_matrix.append(new_week)
-        
-        return calendar_matrix
+
+        #the buttons look up their day when clicked, so the command never has to change
+        self.calendar_buttons = []
+        for index in range(42):
+            button = ttk.Button(self, style='CalendarBlank.TButton', state='disabled', command=lambda i=index: self.day_button_clicked(i))
+            row, column = divmod(index, 7)
+            button.grid(row=row + 1, column=column, sticky='nsew')
+            self.calendar_buttons.append(button)
+
+    @metrics.instrument()
+    def populate_calendar_frame(self):
+        """This function is called by the calendar page class to allow the controller easier access"""
+        #while the month's entries are loading the days can't be opened yet
+        state = 'normal' if self.cont.month_loaded else 'disabled'
+        month = self.cont.focus_month
+        #today and the focused day only get their own style if they are in the month being shown
+        today = datetime.date.today()
+        today_num = today.day if (today.year, today.month) == (month.year, month.month_num) else 0
+        focus_date = self.cont.focus_day.date
+        focus_num = focus_date.day if (focus_date.year, focus_date.month) == (month.year, month.month_num) else 0
+
+        #the month keeps its calendar as a flat array of day numbers, so no day objects are made here
+        for index, day_num in enumerate(month.day_numbers):
+            self._day_numbers[index] = day_num
+            if day_num:
+                style = self.day_style(day_num, month.has_entry(day_num), today_num, focus_num)
+                options = {'text': day_num, 'state': state, 'style': style}
+            else:
+                options = {'text': '', 'state': 'disabled', 'style': 'CalendarBlank.TButton'}
+            self.update_button(index, options)
+
+    def update_button(self, index: int, options: dict):
+        #configuring a ttk widget redraws it, so options that are already set are skipped
+        last_options = self._button_options[index]
+        changed = {key: value for key, value in options.items() if last_options.get(key) != value}
+        if changed:
+            self.calendar_buttons[index].configure(**changed)
+            last_options.update(changed)
+
+    def day_style(self, day_num: int, has_entry: bool, today_num: int, focus_num: int) -> str:
+        #the focused day is the most important to see, then today, then whether there is an entry
+        if day_num == focus_num:
+            return 'CalendarFocus.TButton'
+        if day_num == today_num:
+            return 'CalendarToday.TButton'
+        if has_entry:
+            return 'CalendarEntry.TButton'
+        return 'CalendarButton.TButton'
+
+    def day_button_clicked(self, index: int):
+        day_of_month = self._day_numbers[index]
+        if day_of_month:
+            self._callback(day_of_month)
     
 
 class RecentEntriesFrame(ttk.Frame):
     def __init__(self, parent, controller_) -> None:
         super().__init__(parent)
-        self.log = logger.journal_logger()
+        self.log = logger.journal_logger('ui')
         self.cont = controller_
         self.date1 = tk.StringVar()
         self.date2 = tk.StringVar()
@@ -270,7 +414,11 @@ class RecentEntriesFrame(ttk.Frame):
         entry_label2.grid(column=1, row=2, columnspan=2)
         entry_label3.grid(column=1, row=3, columnspan=2)
     
+    def set_loading(self):
+        self.date1.set('Loading...')
+
     def set_date_entry_text(self, data: list[tuple]):
+        self.date1.set('')
         dates = [self.date1, self.date2, self.date3]
         entry_snips = [self.entry_snip1, self.entry_snip2, self.entry_snip3]
         index = 0
@@ -289,4 +437,147 @@ class OptionsPage(ttk.Frame):
         super().__init__(root)
         #place the main page frame
         self.place(x = 0, y = 0, relwidth=1, relheight=1)
-        
\ No newline at end of file
+        self.log = logger.journal_logger('ui')
+
+        self.cont = controller_
+
+        self.conflict_var = tk.StringVar(value='skip')
+        self.progress_var = tk.StringVar()
+        self.backup_var = tk.StringVar()
+        self.diagnostics_var = tk.StringVar()
+
+        self.populate_frame()
+
+    def populate_frame(self):
+        self.back_button = ttk.Button(self, text='Calendar Page', style='NavButton.TButton', command=lambda: self.cont.show_page('calendar'))
+        self.transfer_label = ttk.Label(self, text='Import / Export')
+        self.export_button = ttk.Button(self, text='Export Entries', command=self.export_button_clicked)
+        self.import_button = ttk.Button(self, text='Import Entries', command=self.import_button_clicked)
+        self.conflict_label = ttk.Label(self, text='Existing dates:')
+        self.conflict_box = ttk.Combobox(self, textvariable=self.conflict_var, values=('skip', 'overwrite', 'append'), state='readonly')
+        self.progress_label = ttk.Label(self, textvariable=self.progress_var)
+        self.backup_label = ttk.Label(self, text='Backups')
+        self.backup_button = ttk.Button(self, text='Back Up Now', command=self.backup_button_clicked)
+        self.backup_status_label = ttk.Label(self, textvariable=self.backup_var)
+        self.diagnostics_label = ttk.Label(self, text='Diagnostics')
+        self.diagnostics_status_label = ttk.Label(self, textvariable=self.diagnostics_var)
+        self.refresh_button = ttk.Button(self, text='Refresh', command=self.refresh_diagnostics)
+        self.vacuum_button = ttk.Button(self, text='Vacuum', command=lambda: self.maintenance_clicked('vacuum'))
+        self.analyze_button = ttk.Button(self, text='Analyze', command=lambda: self.maintenance_clicked('analyze'))
+        self.dump_button = ttk.Button(self, text='Snapshot', command=self.dump_button_clicked)
+        self.diagnostics_box = tk.Text(self, wrap='none', font=('Courier', 9), state='disabled')
+
+        self.back_button.place(anchor='ne', relx=.995, y=5, width=150, height=40)
+        self.transfer_label.place(x=10, y=60, width=200, height=30)
+        self.export_button.place(x=10, y=95, width=150, height=40)
+        self.import_button.place(x=170, y=95, width=150, height=40)
+        self.conflict_label.place(x=10, y=140, width=150, height=30)
+        self.conflict_box.place(x=170, y=140, width=150, height=30)
+        self.progress_label.place(x=10, y=175, relwidth=.95, height=30)
+        self.backup_label.place(x=10, y=220, width=200, height=30)
+        self.backup_button.place(x=10, y=255, width=150, height=40)
+        self.backup_status_label.place(x=10, y=300, relwidth=.95, height=30)
+        self.diagnostics_label.place(x=10, y=345, width=150, height=30)
+        self.diagnostics_status_label.place(x=170, y=345, width=310, height=30)
+        self.refresh_button.place(x=10, y=380, width=110, height=40)
+        self.vacuum_button.place(x=130, y=380, width=110, height=40)
+        self.analyze_button.place(x=250, y=380, width=110, height=40)
+        self.dump_button.place(x=370, y=380, width=110, height=40)
+        self.diagnostics_box.place(x=10, y=430, relwidth=.96, height=360)
+
+    def export_button_clicked(self):
+        path = filedialog.asksaveasfilename(
+            defaultextension='.csv',
+            filetypes=[('CSV', '*.csv'), ('JSON Lines', '*.jsonl'), ('Text', '*.txt')]
+            )
+        if not path:
+            return
+        self.set_transfer_running(True)
+        self.cont.export_entries(path, self.show_progress, self.export_done, self.transfer_failed)
+
+    def export_done(self, count: int):
+        self.set_transfer_running(False)
+        self.progress_var.set(f'Exported {count} entries')
+
+    def import_button_clicked(self):
+        path = filedialog.askopenfilename(
+            filetypes=[('Journal exports', '*.csv *.jsonl *.txt')]
+            )
+        if not path:
+            return
+        self.set_transfer_running(True)
+        self.cont.import_entries(path, self.conflict_var.get(), self.show_progress, self.import_done, self.transfer_failed)
+
+    def import_done(self, count: int):
+        self.set_transfer_running(False)
+        self.progress_var.set(f'Imported {count} entries')
+
+    def transfer_failed(self, error: Exception):
+        #a badly formatted file shouldn't take the app down, the user just needs to know
+        self.set_transfer_running(False)
+        self.progress_var.set('')
+        messagebox.showerror('Import/export error', f'The entries could not be transferred:\n{error}')
+
+    def set_transfer_running(self, running: bool):
+        #only one import or export can run at a time
+        state = 'disabled' if running else 'normal'
+        self.export_button.configure(state=state)
+        self.import_button.configure(state=state)
+        if running:
+            self.progress_var.set('Working...')
+
+    def show_progress(self, count: int):
+        self.progress_var.set(f'{count} entries processed...')
+
+    def backup_button_clicked(self):
+        self.backup_button.configure(state='disabled')
+        self.backup_var.set('Backing up...')
+        self.cont.backup_now(self.show_backup_progress, self.backup_done, self.backup_failed)
+
+    def show_backup_progress(self, copied: int, total: int):
+        self.backup_var.set(f'Backing up... {copied * 100 // max(total, 1)}%')
+
+    def backup_done(self, snapshots: list):
+        self.backup_button.configure(state='normal')
+        self.backup_var.set(f'Saved {snapshots[-1].name}' if snapshots else 'Nothing to back up')
+
+    def backup_failed(self, error: Exception):
+        self.backup_button.configure(state='normal')
+        self.backup_var.set('')
+        messagebox.showerror('Backup error', f'The journal could not be backed up:\n{error}')
+
+    def refresh_diagnostics(self):
+        self.cont.load_diagnostics(self.show_diagnostics, self.diagnostics_failed)
+
+    def show_diagnostics(self, info: dict):
+        db, cache = info['db'], info['month_cache']
+        lines = [f'{key:<22}{value:>14,}' for key, value in db.items()]
+        lines += ['', f'month cache           {cache["months"]} months, {cache["hits"]} hits, {cache["misses"]} misses, {cache["hit_rate"]:.0%} hit rate']
+        lines += ['', 'slow calls:'] + ([f'  {at}  {ms:>8}ms  {name}' for at, name, ms in info['slow_calls']] or ['  none'])
+        lines += ['', 'top allocations:'] + ([f'  {line}' for line in info['memory_top']] or ['  tracing started, refresh again to see them'])
+        self.diagnostics_box.configure(state='normal')
+        self.diagnostics_box.delete('1.0', 'end')
+        self.diagnostics_box.insert('1.0', '\n'.join(lines))
+        self.diagnostics_box.configure(state='disabled')
+
+    def maintenance_clicked(self, task: str):
+        #vacuum and analyze run on the db worker, the buttons stay off until it is done
+        self.set_maintenance_running(True)
+        self.cont.run_maintenance(task, lambda result: self.maintenance_done(task, result), self.diagnostics_failed)
+
+    def maintenance_done(self, task: str, result):
+        self.set_maintenance_running(False)
+        self.diagnostics_var.set(f'Vacuum freed {result:,} bytes' if task == 'vacuum' else 'Statistics refreshed')
+        self.refresh_diagnostics()
+
+    def set_maintenance_running(self, running: bool):
+        state = 'disabled' if running else 'normal'
+        self.vacuum_button.configure(state=state)
+        self.analyze_button.configure(state=state)
+
+    def dump_button_clicked(self):
+        self.cont.dump_diagnostics(lambda path: self.diagnostics_var.set(f'Saved {path.name}'), self.diagnostics_failed)
+
+    def diagnostics_failed(self, error: Exception):
+        self.set_maintenance_running(False)
+        messagebox.showerror('Diagnostics error', f'The diagnostics could not be run:\n{error}')
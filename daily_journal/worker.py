@@ -0,0 +1,88 @@
+"""Background worker for the database. The worker thread owns the sqlite connection and every
+repository call is queued to it, so the tkinter mainloop never has to wait on the database.
+With a pool of reader connections, reads can also run on a few reader threads next to it"""
+
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+import logger
+
+
+class DBWorker:
+    """Runs submitted calls one at a time, in the order they were submitted, on a single background thread.
+    Every call gets a Future that is resolved with its result or with the exception it raised.
+    Reads given to submit_read run on one of readers threads instead, as long as nothing is waiting on the worker"""
+    def __init__(self, conn: sqlite3.Connection | Any, readers: int = 0) -> None:
+        #conn can also be a repository.ConnectionManager or a shards.Shards, which close all of their connections
+        self.conn = conn
+        self.logger = logger.journal_logger('worker')
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-worker', daemon=True)
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix='db-reader') if readers else None
+        #calls submitted to the worker that haven't finished, a read can only skip ahead when there are none
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def start(self) -> None:
+        self._thread.start()
+        self.logger.info('DB worker started')
+
+    def submit(self, func: Callable, *args: Any, **kwargs: Any) -> Future:
+        future = Future()
+        with self._pending_lock:
+            self._pending += 1
+        self._requests.put((future, func, args, kwargs))
+        return future
+
+    def submit_read(self, func: Callable, *args: Any, **kwargs: Any) -> Future:
+        """Runs a call that only reads on a reader thread. While writes are waiting on the worker it is queued
+        behind them instead, so a read never misses a save that was made before it"""
+        with self._pending_lock:
+            writes_waiting = self._pending > 0
+        if self._readers is None or writes_waiting:
+            return self.submit(func, *args, **kwargs)
+        return self._readers.submit(func, *args, **kwargs)
+
+    def _run(self) -> None:
+        while True:
+            request = self._requests.get()
+            #None is the signal to stop, it is queued behind any calls that are still waiting
+            if request is None:
+                break
+            future, func, args, kwargs = request
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+            finally:
+                with self._pending_lock:
+                    self._pending -= 1
+        self.close_connection()
+
+    def close_connection(self) -> None:
+        #the connection is closed by the thread that has been using it.
+        #optimize lets sqlite refresh planner statistics for the queries run this session
+        try:
+            self.conn.execute('PRAGMA optimize')
+        except sqlite3.Error:
+            self.logger.exception('PRAGMA optimize failed:')
+        self.conn.close()
+        self.logger.info('DB Connection Closed')
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Lets the queued calls finish, then closes the connection and stops the thread"""
+        if self._readers is not None:
+            self._readers.shutdown(wait=True)
+        if self._thread.is_alive():
+            self._requests.put(None)
+            self._thread.join(timeout)
+        else:
+            self.close_connection()
@@ -0,0 +1,63 @@
+import logging
+import pathlib
+import sqlite3
+import sys
+
+import pytest
+
+#the app modules import each other by their plain names, so the app folder has to be on the path
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / 'daily_journal'
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
+
+import repository
+from worker import DBWorker
+
+
+@pytest.fixture(autouse=True)
+def run_in_tmp(tmp_path, monkeypatch):
+    #anything written relative to the working directory, like logs, stays out of the repository
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def log():
+    return logging.getLogger('tests')
+
+
+@pytest.fixture
+def entries(log):
+    """A repository over a new in-memory journal"""
+    conn = repository.open_connection(':memory:', log)
+    yield repository.Entries(conn)
+    conn.close()
+
+
+@pytest.fixture
+def worker(entries):
+    """A db worker that owns the connection of the entries fixture"""
+    db_worker = DBWorker(entries.conn)
+    db_worker.start()
+    yield db_worker
+    db_worker.stop()
+
+
+@pytest.fixture
+def baseline_journal(tmp_path, log):
+    """Makes a journal file in the baseline format, a single entries table with ISO text dates, from (date, entry)
+    rows, and opens it with Entries, which upgrades it to the current schema"""
+    conns = []
+
+    def make(rows: list[tuple[str, str | None]], name: str = 'journal.db') -> repository.Entries:
+        path = tmp_path / name
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE entries (id INTEGER PRIMARY KEY AUTOINCREMENT, date DATE UNIQUE, entry TEXT)')
+        conn.executemany('INSERT INTO entries (date, entry) VALUES (?, ?)', rows)
+        conn.commit()
+        conn.close()
+        conns.append(repository.open_connection(path, log))
+        return repository.Entries(conns[-1])
+
+    yield make
+    for conn in conns:
+        conn.close()
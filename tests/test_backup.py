@@ -0,0 +1,108 @@
+"""Online backups: snapshots of a live journal, the one step fallback for copies restarted by commits,
+integrity checks and removing old snapshots"""
+
+import datetime
+import sqlite3
+import threading
+
+import pytest
+
+import backup
+from backup import BackupManager, BackupError, copy_database, list_snapshots, prune_snapshots, snapshot_path
+
+
+@pytest.fixture
+def journal(tmp_path):
+    path = tmp_path / 'journal.db'
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE entries (id INTEGER PRIMARY KEY, entry TEXT)')
+    conn.executemany('INSERT INTO entries (entry) VALUES (?)', [('some text ' * 50, ) for _ in range(200)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def count_rows(path) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def make_snapshots(source, backup_dir, *ages_days):
+    now = datetime.datetime.now().replace(microsecond=0)
+    for age in ages_days:
+        snapshot_path(source, backup_dir, now - datetime.timedelta(days=age, seconds=1)).touch()
+
+
+def test_backup_keeps_a_checked_snapshot(journal, tmp_path):
+    manager = BackupManager(tmp_path / 'backups')
+    #left behind by a backup that was cut short
+    manager.backup_dir.mkdir()
+    (manager.backup_dir / 'journal-20240101-000000.db.partial').touch()
+    progress = []
+
+    snapshots = manager.start([journal], progress=lambda copied, total: progress.append((copied, total))).result()
+    assert [path.name for _, path in list_snapshots(journal, manager.backup_dir)] == [snapshots[0].name]
+    assert list(manager.backup_dir.glob('*.partial')) == []
+    assert count_rows(snapshots[0]) == 200
+    assert progress[-1][0] == progress[-1][1]
+
+
+def test_only_one_backup_runs_at_a_time(journal, tmp_path, monkeypatch):
+    release = threading.Event()
+    copy = backup.copy_database
+    monkeypatch.setattr(backup, 'copy_database', lambda *args, **kwargs: release.wait(5) and copy(*args, **kwargs))
+    manager = BackupManager(tmp_path / 'backups')
+    first = manager.start([journal])
+    assert manager.start([journal]) is first
+    release.set()
+    first.result()
+    #once it has finished the next start runs a new backup
+    second = manager.start([journal])
+    assert second is not first
+    second.result()
+
+
+def test_a_copy_restarted_by_commits_finishes_in_one_step(journal, tmp_path):
+    writer = sqlite3.connect(journal)
+    steps = []
+
+    def commit_between_steps(copied, total):
+        steps.append(copied)
+        writer.execute('INSERT INTO entries (entry) VALUES (?)', ('written during the backup', ))
+        writer.commit()
+
+    try:
+        restarts = copy_database(journal, tmp_path / 'copy.db', pages=2, step_sleep=0, progress=commit_between_steps,
+                                 max_restarts=2)
+    finally:
+        writer.close()
+    assert restarts == 3
+    #the one step copy has every row committed before it started
+    assert count_rows(tmp_path / 'copy.db') >= 200 + restarts
+    assert steps[-1] > 2
+
+
+def test_a_damaged_snapshot_is_not_kept(journal, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'check_integrity', lambda path: ['*** in database main ***'])
+    manager = BackupManager(tmp_path / 'backups')
+    with pytest.raises(BackupError):
+        manager.start([journal]).result()
+    assert list(manager.backup_dir.iterdir()) == []
+
+
+def test_old_snapshots_are_pruned(journal, tmp_path):
+    backup_dir = tmp_path / 'backups'
+    backup_dir.mkdir()
+    make_snapshots(journal, backup_dir, 0, 1, 2, 3, 40)
+    (backup_dir / 'journal-not-a-time.db').touch()
+
+    removed = prune_snapshots(journal, backup_dir, keep=3, max_age_days=None)
+    assert len(removed) == 2
+    assert len(list_snapshots(journal, backup_dir)) == 3
+    #the newest snapshot is kept even when it is too old
+    assert len(prune_snapshots(journal, backup_dir, keep=None, max_age_days=0)) == 2
+    assert len(list_snapshots(journal, backup_dir)) == 1
+    assert (backup_dir / 'journal-not-a-time.db').exists()
@@ -0,0 +1,139 @@
+"""The LRU month cache, and how the controller fills it and prefetches the months around the focus month"""
+
+import datetime
+
+import pytest
+
+import config
+import controller as controller_module
+from cache import LRUCache
+from controller import PageId
+
+D = datetime.date
+
+
+class StubRoot:
+    """Stands in for tk.Tk. Scheduled callbacks only run when run_pending is called"""
+    def __init__(self) -> None:
+        self.jobs = {}
+        self._next_id = 0
+
+    def after(self, ms, func=None, *args):
+        self._next_id += 1
+        self.jobs[self._next_id] = (func, args)
+        return self._next_id
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, job_id) -> None:
+        self.jobs.pop(job_id, None)
+
+    def protocol(self, *args) -> None:
+        pass
+
+    def run_pending(self) -> None:
+        jobs, self.jobs = self.jobs, {}
+        for func, args in jobs.values():
+            func(*args)
+
+
+class StubPage:
+    """Stands in for every ui page, any method call is accepted and ignored"""
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+@pytest.fixture
+def root():
+    return StubRoot()
+
+
+@pytest.fixture
+def controller(entries, worker, root, monkeypatch):
+    monkeypatch.setattr(config, 'BACKUP_INTERVAL_MINUTES', None)
+    monkeypatch.setattr(config, 'MONTH_PREFETCH', True)
+    monkeypatch.setattr(config, 'MONTH_CACHE_SIZE', 4)
+    #every month index the controller asks the db for
+    requested = []
+    get_entry_index = entries.get_entry_index
+    monkeypatch.setattr(entries, 'get_entry_index', lambda start, end: requested.append(start) or get_entry_index(start, end))
+
+    class HeadlessController(controller_module.Controller):
+        def init_ui_pages(self, init_day):
+            return {page: StubPage() for page in (PageId.MAIN, )}
+
+    cont = HeadlessController(entries, root, worker)
+    cont.requested = requested
+    return cont
+
+
+def settle(cont, root):
+    #waits for the worker to finish what was queued, then runs the callbacks it handed back
+    cont.data_controller.worker.submit(lambda: None).result()
+    root.run_pending()
+
+
+def test_lru_drops_the_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache and len(cache) == 2
+    #peek doesn't count as a use, so a is dropped next
+    assert cache.peek('a') == 1
+    assert cache.get('c') == 3
+    cache.put('d', 4)
+    assert 'a' not in cache
+    assert cache.get('missing', 'default') == 'default'
+    assert (cache.hits, cache.misses) == (2, 1)
+    cache.invalidate('c')
+    assert list(cache._items) == ['d']
+
+
+def test_cached_months_are_not_read_again(controller, root):
+    first = controller.requested[:]
+    controller.focus_month = D(2020, 5, 1)
+    settle(controller, root)
+    assert controller.month_loaded
+    controller.focus_month = D(2020, 6, 1)
+    controller.focus_month = D(2020, 5, 10)
+    settle(controller, root)
+    assert controller.requested == first + [D(2020, 5, 1), D(2020, 6, 1)]
+
+    #the months used longest ago are dropped once there are more than MONTH_CACHE_SIZE
+    for month_num in range(7, 11):
+        controller.focus_month = D(2020, month_num, 1)
+    assert (2020, 5) not in controller.month_cache
+    assert len(controller.month_cache) == config.MONTH_CACHE_SIZE
+
+
+def test_adjacent_months_are_prefetched_when_idle(controller, root):
+    controller.focus_month = D(2020, 5, 1)
+    settle(controller, root)
+    #nothing is prefetched until the calendar has been opened
+    assert (2020, 4) not in controller.month_cache and (2020, 6) not in controller.month_cache
+
+    controller.ui_pages[PageId.CALENDAR] = StubPage()
+    controller.focus_month = D(2020, 5, 2)
+    controller.focus_month = D(2021, 1, 1)
+    #only the latest prefetch is left waiting for tk to be idle
+    assert [func for func, _ in root.jobs.values()].count(controller.prefetch_adjacent_months) == 1
+    assert (2020, 12) not in controller.month_cache
+
+    settle(controller, root)
+    settle(controller, root)
+    assert controller.month_cache.peek((2020, 12)).entries_loaded
+    assert controller.month_cache.peek((2021, 2)).entries_loaded
+    assert (2020, 4) not in controller.month_cache
+
+
+def test_an_invalidated_month_is_read_again(controller, root, entries, worker):
+    controller.focus_month = D(2020, 5, 1)
+    settle(controller, root)
+    worker.submit(entries.upsert_entry, D(2020, 5, 3), 'written behind the cache').result()
+    controller.invalidate_month(D(2020, 5, 3))
+    controller.focus_month = D(2020, 5, 3)
+    settle(controller, root)
+    assert controller.focus_day.has_entry
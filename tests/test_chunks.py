@@ -0,0 +1,102 @@
+"""Large entries stored in chunks: round trips, and saves that only touch the chunks an edit changed"""
+
+import datetime
+
+import pytest
+
+import repository
+from config import CHUNKS_TABLE, ENTRY_CHUNK_THRESHOLD, REVISIONS_TABLE, STATS_TABLE
+from entry_codec import count_words, split_chunks
+
+D = datetime.date
+
+
+@pytest.fixture
+def long_text():
+    lines = [f'line {number} of a very long entry\n' for number in range(ENTRY_CHUNK_THRESHOLD // 20)]
+    return ''.join(lines)
+
+
+def chunk_ids(entries):
+    return [row_id for row_id, in entries.conn.execute(f'SELECT id FROM {CHUNKS_TABLE} ORDER BY seq')]
+
+
+def test_chunked_entry_round_trip(entries, long_text):
+    day = D(2024, 3, 1)
+    entries.upsert_entry(day, long_text)
+    original_ids = chunk_ids(entries)
+    assert len(original_ids) > 2
+
+    #an edit near the end only rewrites the chunks around it
+    edited = long_text[:-100] + 'an edit at the end\n'
+    entries.upsert_entry(day, edited)
+    assert chunk_ids(entries)[:len(original_ids) - 1] == original_ids[:-1]
+
+    assert entries.get_entry(day) == edited
+    assert ''.join(entries.get_entry_chunks(day)) == edited
+    assert entries.get_revision(day, 1) == long_text
+    assert entries.get_entry_index(day, day) == [(day, len(edited), edited[:repository.ENTRY_SNIPPET_LENGTH])]
+
+
+def test_saves_only_count_the_chunks_they_rewrote(entries, long_text):
+    day = D(2024, 3, 1)
+    entries.upsert_entry(day, long_text)
+    counted = []
+    entries.conn.create_function('word_count', 2, lambda data, codec: counted.append(data) or count_words(data, codec))
+
+    entries.upsert_entry(day, long_text[:-100] + 'an edit at the end\n')
+    #the triggers decode the replaced and the new chunk, not the whole entry twice
+    assert sum(len(data or '') for data in counted) < len(long_text) / 2
+
+    live = entries.conn.execute(f'SELECT * FROM {STATS_TABLE}').fetchall()
+    entries.rebuild_stats()
+    assert entries.conn.execute(f'SELECT * FROM {STATS_TABLE}').fetchall() == live
+
+
+@pytest.mark.parametrize('final', ['now a short entry', None])
+def test_stats_follow_entries_in_and_out_of_chunks(entries, long_text, final):
+    day = D(2024, 3, 1)
+    entries.upsert_entry(D(2024, 3, 2), 'another day')
+    entries.upsert_entry(day, 'short to begin with')
+    entries.upsert_entry(day, long_text)
+    assert entries.get_year_stats(2024) == [('2024-03', 2, 2 + len(long_text.split()), 11 + len(long_text))]
+
+    if final is None:
+        entries.delete_entry(day)
+        assert entries.get_year_stats(2024) == [('2024-03', 1, 2, 11)]
+    else:
+        entries.upsert_entry(day, final)
+        assert entries.get_year_stats(2024) == [('2024-03', 2, 6, 28)]
+    assert entries.conn.execute(f'SELECT COUNT(*) FROM {CHUNKS_TABLE}').fetchone() == (0, )
+
+
+def test_chunked_entries_are_searched_by_chunk(entries, long_text):
+    day = D(2024, 3, 1)
+    entries.upsert_entry(day, 'zebra ' + long_text + 'giraffe\n')
+    entries.upsert_entry(D(2024, 3, 2), 'a zebra at the zoo')
+
+    assert [date for date, _ in entries.search('zebra')] == [D(2024, 3, 2), day]
+    #the words can be in different chunks, the entry is listed once with its best chunk
+    [(date, snippet)] = entries.search('zebra giraffe')
+    assert date == day and '[' in snippet
+    assert entries.search('giraffe zoo') == []
+    assert len(entries.search('line')) == 1
+
+
+def test_unchanged_saves_write_nothing(entries, long_text):
+    day = D(2024, 3, 1)
+    entries.upsert_entry(day, long_text)
+    changes = entries.conn.total_changes
+    entries.upsert_entry(day, long_text)
+    entries.update_entry(day, long_text)
+    assert entries.import_entries([(day, long_text)], repository.ConflictPolicy.OVERWRITE) == 0
+    assert entries.conn.total_changes == changes
+    assert entries.conn.execute(f'SELECT COUNT(*) FROM {REVISIONS_TABLE}').fetchone() == (0, )
+
+
+def test_long_lines_are_split_between_words():
+    text = 'word ' * 100
+    chunks = split_chunks(text, 32)
+    assert ''.join(chunks) == text
+    assert all(chunk.endswith(' ') and len(chunk) <= 32 for chunk in chunks)
+    assert sum(len(chunk.split()) for chunk in chunks) == 100
@@ -0,0 +1,54 @@
+"""Saves queued through the data controller, which are coalesced while they wait on the worker"""
+
+import datetime
+import threading
+
+import pytest
+
+from data_controller import DataController
+
+D = datetime.date
+
+
+@pytest.fixture
+def data(entries, worker, monkeypatch):
+    controller = DataController(entries, worker)
+    #every text the repository is asked to write
+    controller.written = []
+    upsert_entry = entries.upsert_entry
+    monkeypatch.setattr(entries, 'upsert_entry', lambda date, text: controller.written.append(text) or upsert_entry(date, text))
+    return controller
+
+
+def test_waiting_saves_for_a_date_are_written_once(data, worker):
+    release = threading.Event()
+    worker.submit(release.wait, 5)
+    first = data.queue_save(D(2024, 1, 1), 'draft')
+    second = data.queue_save(D(2024, 1, 1), 'draft, longer')
+    other_day = data.queue_save(D(2024, 1, 2), 'another day')
+    assert first is second and other_day is not first
+
+    release.set()
+    first.result()
+    other_day.result()
+    assert sorted(data.written) == ['another day', 'draft, longer']
+    assert data.get_entry(D(2024, 1, 1)).result() == 'draft, longer'
+
+
+def test_a_save_after_the_write_started_is_written_again(data):
+    data.queue_save(D(2024, 1, 1), 'first').result()
+    later = data.queue_save(D(2024, 1, 1), 'second')
+    later.result()
+    assert data.written == ['first', 'second']
+    assert data.get_entry(D(2024, 1, 1)).result() == 'second'
+
+
+def test_transactions_commit_together(data):
+    def unit_of_work(entries):
+        entries.upsert_entry(D(2024, 1, 1), 'one')
+        entries.upsert_entry(D(2024, 1, 2), 'two')
+        raise RuntimeError('stop')
+
+    with pytest.raises(RuntimeError):
+        data.run_in_transaction(unit_of_work).result()
+    assert data.get_entry(D(2024, 1, 1)).result() is None
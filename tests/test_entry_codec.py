@@ -0,0 +1,86 @@
+"""Compression of entry bodies: encoding round trips, the size threshold, partial decoding and recompressing old rows"""
+
+import datetime
+
+import pytest
+
+import entry_codec
+from config import ENTRIES_TABLE, ENTRY_COMPRESS_THRESHOLD
+from entry_codec import Codec, encode_entry, decode_entry, decode_prefix, count_words, split_chunks
+
+D = datetime.date
+LONG_TEXT = 'a day with some words in it, ünïcödé as well\n' * 200
+
+
+@pytest.mark.parametrize('text, codec', [
+    ('', Codec.PLAIN),
+    ('short entry', Codec.PLAIN),
+    (LONG_TEXT, Codec.ZLIB),
+])
+def test_encoding_round_trip(text, codec):
+    data, stored_codec = encode_entry(text)
+    assert stored_codec == codec
+    assert decode_entry(data, stored_codec) == text
+
+
+def test_compression_threshold(monkeypatch):
+    text = 'x' * ENTRY_COMPRESS_THRESHOLD
+    assert encode_entry(text[:-1])[1] == Codec.PLAIN
+    assert encode_entry(text)[1] == Codec.ZLIB
+    monkeypatch.setattr(entry_codec, 'ENTRY_COMPRESS_THRESHOLD', None)
+    assert encode_entry(text) == (text, Codec.PLAIN)
+
+
+def test_text_that_doesnt_shrink_stays_plain(monkeypatch):
+    #zlib adds a header, so a few characters come out bigger
+    monkeypatch.setattr(entry_codec, 'ENTRY_COMPRESS_THRESHOLD', 1)
+    assert encode_entry('a day') == ('a day', Codec.PLAIN)
+    assert encode_entry('day ' * 10)[1] == Codec.ZLIB
+
+
+@pytest.mark.parametrize('text', ['short entry', LONG_TEXT])
+def test_prefix_and_word_count_without_decoding_everything(text):
+    data, codec = encode_entry(text)
+    assert decode_prefix(data, codec, 30) == text[:30]
+    assert count_words(data, codec) == len(text.split())
+    assert decode_prefix(None, Codec.PLAIN, 30) is None and count_words(None, Codec.PLAIN) == 0
+
+
+def test_chunks_end_after_a_line_break():
+    text = 'one line\n' * 10
+    chunks = split_chunks(text, size=20)
+    assert ''.join(chunks) == text
+    assert all(chunk.endswith('\n') and len(chunk) <= 20 for chunk in chunks)
+    #a line with no breaks or spaces is cut at the chunk size
+    assert split_chunks('x' * 25, size=10) == ['x' * 10, 'x' * 10, 'x' * 5]
+
+
+def test_large_entries_are_stored_compressed(entries):
+    entries.upsert_entry(D(2024, 1, 1), LONG_TEXT)
+    entries.upsert_entry(D(2024, 1, 2), 'short')
+    codecs = dict(entries.conn.execute(f'SELECT date, codec FROM {ENTRIES_TABLE} ORDER BY date').fetchall())
+    assert sorted(codecs.values()) == [Codec.PLAIN, Codec.ZLIB]
+    assert entries.get_entry(D(2024, 1, 1)) == LONG_TEXT
+    assert [date for date, _ in entries.search('ünïcödé')] == [D(2024, 1, 1)]
+    stats = entries.storage_stats()
+    assert (stats['rows'], stats['compressed_rows']) == (2, 1)
+    assert stats['saved_bytes'] > 0
+
+
+def test_recompress_old_rows_in_batches(entries, monkeypatch):
+    monkeypatch.setattr(entry_codec, 'ENTRY_COMPRESS_THRESHOLD', None)
+    for day in range(1, 6):
+        entries.upsert_entry(D(2024, 1, day), LONG_TEXT + str(day))
+    assert entries.storage_stats()['compressed_rows'] == 0
+
+    monkeypatch.setattr(entry_codec, 'ENTRY_COMPRESS_THRESHOLD', 1024)
+    after_id, total = 0, 0
+    while after_id is not None:
+        after_id, rewritten = entries.recompress_batch(after_id, batch_size=2)
+        total += rewritten
+    assert total == 5
+    assert entries.storage_stats()['compressed_rows'] == 5
+    #a second pass finds nothing to change
+    assert entries.recompress_batch(0) == (5, 0)
+    assert [entries.get_entry(D(2024, 1, day)) for day in range(1, 6)] == [LONG_TEXT + str(day) for day in range(1, 6)]
+    assert entries.list_revisions(D(2024, 1, 1)) == []
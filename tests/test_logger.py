@@ -0,0 +1,74 @@
+"""Logging through the queue listener, per module levels and sampling of frequent records"""
+
+import logging
+import logging.handlers
+
+import pytest
+
+import logger
+
+NAME = 'journal_tests'
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    yield tmp_path / 'logs' / 'journal.log'
+    logger.stop_logging()
+    for name in (NAME, f'{NAME}.noisy', f'{NAME}.quiet'):
+        current = logging.getLogger(name)
+        current.handlers.clear()
+        current.filters.clear()
+        current.setLevel(logging.NOTSET)
+
+
+def configure(log_file):
+    #configure_logger only adds its queue handler to a logger without handlers, so the test logger is cut off
+    #from the handlers pytest puts on the root logger, and on loggers that don't propagate
+    test_logger = logging.getLogger(NAME)
+    test_logger.propagate = False
+    test_logger.handlers = [handler for handler in test_logger.handlers if isinstance(handler, logging.handlers.QueueHandler)]
+    logger.configure_logger(name=NAME, log_file=str(log_file), level='DEBUG',
+                            module_levels={'quiet': 'WARNING'}, sampling={'noisy': 3})
+
+
+def test_records_are_written_by_the_listener(log_file):
+    configure(log_file)
+    logging.getLogger(f'{NAME}.app').info('opened %s', 'journal.db')
+    logging.getLogger(f'{NAME}.quiet').info('left out')
+    logging.getLogger(f'{NAME}.quiet').warning('kept')
+    #stopping writes out whatever is still on the queue
+    logger.stop_logging()
+
+    lines = log_file.read_text().splitlines()
+    assert [line.split(' - ', 1)[1] for line in lines] == [
+        f'INFO - {NAME}.app - opened journal.db',
+        f'WARNING - {NAME}.quiet - kept',
+    ]
+
+
+def test_frequent_records_are_sampled(log_file):
+    configure(log_file)
+    noisy = logging.getLogger(f'{NAME}.noisy')
+    for number in range(7):
+        noisy.debug('tick %s', number)
+        noisy.info('other message')
+    noisy.error('always kept')
+    logger.stop_logging()
+
+    messages = [line.rsplit(' - ', 1)[1] for line in log_file.read_text().splitlines()]
+    assert messages == ['tick 0', 'other message', 'tick 3', 'other message', 'tick 6', 'other message', 'always kept']
+
+
+def test_sampling_filter_lets_warnings_through():
+    sampling = logger.SamplingFilter(100)
+    records = [logging.LogRecord('x', level, __file__, 1, 'same message', None, None)
+               for level in (logging.INFO, logging.INFO, logging.WARNING, logging.ERROR)]
+    assert [sampling.filter(record) for record in records] == [True, False, True, True]
+
+
+def test_configuring_twice_keeps_one_handler(log_file):
+    configure(log_file)
+    configure(log_file)
+    assert len(logging.getLogger(NAME).handlers) == 1
+    #the second call adds another sampling filter, both are on the module logger
+    assert len(logging.getLogger(f'{NAME}.noisy').filters) == 2
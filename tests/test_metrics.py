@@ -0,0 +1,110 @@
+import datetime
+
+import pytest
+
+import config
+import metrics
+
+
+@pytest.fixture
+def metrics_on(monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(config, 'METRICS_MODE', 'timer')
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture(autouse=True)
+def no_slow_calls(monkeypatch):
+    monkeypatch.setattr(metrics, '_slow_calls', metrics.deque(maxlen=config.SLOW_CALL_LOG_SIZE))
+    monkeypatch.setattr(metrics, '_startup_marks', [])
+
+
+def test_instrument_counts_calls_and_rows(metrics_on):
+    @metrics.instrument('rows')
+    def rows(count):
+        return list(range(count))
+
+    assert rows(3) == [0, 1, 2]
+    rows(4)
+    metric = metrics.snapshot()['rows']
+    assert metric['count'] == 2
+    assert metric['rows'] == 7
+    assert sum(metric['histogram'].values()) == 2
+
+
+def test_instrument_records_nothing_when_off(monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_ENABLED', False)
+    metrics.reset()
+
+    @metrics.instrument()
+    def quiet():
+        return [1]
+
+    assert quiet() == [1]
+    assert metrics.snapshot() == {}
+
+
+def test_instrumented_generator_is_timed_over_every_step(metrics_on):
+    @metrics.instrument('batches')
+    def batches():
+        yield [1, 2]
+        yield [3]
+
+    generator = batches()
+    #nothing is recorded until the generator is used up
+    assert next(generator) == [1, 2]
+    assert metrics.snapshot() == {}
+    assert list(generator) == [[3]]
+    metric = metrics.snapshot()['batches']
+    assert metric['count'] == 1
+    assert metric['rows'] == 3
+
+
+def test_closed_generator_is_still_recorded(metrics_on):
+    @metrics.instrument('batches')
+    def batches():
+        yield from ([n] for n in range(10))
+
+    generator = batches()
+    next(generator)
+    generator.close()
+    assert metrics.snapshot()['batches']['rows'] == 1
+
+
+def test_iter_entries_is_instrumented(metrics_on, entries):
+    entries.store_many([(datetime.date(2024, 1, day), f'day {day}') for day in range(1, 6)])
+    assert sum(len(batch) for batch in entries.iter_entries(chunk_size=2)) == 5
+    assert metrics.snapshot()['Entries.iter_entries']['rows'] == 5
+
+
+def test_slow_calls_are_kept_with_metrics_off(monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_ENABLED', False)
+    monkeypatch.setattr(config, 'SLOW_CALL_MS', 0)
+
+    @metrics.instrument('first')
+    def first():
+        pass
+
+    @metrics.instrument('second')
+    def second():
+        pass
+
+    first()
+    second()
+    assert [name for _, name, _ in metrics.slow_calls()] == ['second', 'first']
+
+
+def test_startup_report_times_each_phase(monkeypatch, caplog):
+    monkeypatch.setattr(config, 'METRICS_ENABLED', False)
+    metrics.mark_startup('launch', at=10.0)
+    metrics.mark_startup('imports', at=10.1)
+    metrics.mark_startup('first paint', at=10.6)
+
+    report = metrics.startup_report(budget_ms=1000)
+    assert report == {'imports': 100.0, 'first paint': 500.0, 'total': 600.0}
+    assert 'over the' not in caplog.text
+
+    metrics.startup_report(budget_ms=500)
+    assert 'Startup took 600.0ms, over the 500ms budget' in caplog.text
@@ -0,0 +1,83 @@
+"""Upgrades a journal in the baseline format, a single entries table with ISO text dates, to the current schema
+and checks what the migrations left behind"""
+
+import datetime
+
+import pytest
+
+import migrations
+from config import ENTRIES_TABLE, SEARCH_TABLE
+
+D = datetime.date
+BASELINE_ROWS = [
+    ('2023-12-31', 'last day of the year #review'),
+    ('2024-01-01', 'new year, went for a run #Health #goals'),
+    ('2024-01-02', 'back at #work'),
+    ('2024-02-10', None),
+]
+
+
+@pytest.fixture
+def upgraded(baseline_journal):
+    return baseline_journal(BASELINE_ROWS)
+
+
+def test_baseline_is_upgraded_to_the_latest_version(upgraded):
+    assert migrations.get_version(upgraded.conn) == migrations.LATEST_VERSION
+    assert upgraded.conn.execute('PRAGMA integrity_check').fetchone() == ('ok', )
+
+
+def test_migrating_again_changes_nothing(entries, log):
+    changes = entries.conn.total_changes
+    assert migrations.migrate(entries.conn, log) == migrations.LATEST_VERSION
+    assert entries.conn.total_changes == changes
+
+
+def test_a_newer_journal_is_not_opened(entries, log):
+    entries.conn.execute(f'PRAGMA user_version = {migrations.LATEST_VERSION + 1}')
+    with pytest.raises(RuntimeError):
+        migrations.migrate(entries.conn, log)
+
+
+def test_a_failed_migration_keeps_the_old_version(entries, log, monkeypatch):
+    def broken(cursor):
+        cursor.execute('CREATE TABLE half_done (id INTEGER)')
+        raise RuntimeError('broken migration')
+
+    monkeypatch.setattr(migrations, 'MIGRATIONS', [*migrations.MIGRATIONS, broken])
+    with pytest.raises(RuntimeError):
+        migrations.migrate(entries.conn, log)
+    assert migrations.get_version(entries.conn) == migrations.LATEST_VERSION
+    assert entries.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+
+
+def test_dates_are_stored_as_day_numbers(upgraded):
+    stored = upgraded.conn.execute(f'SELECT DISTINCT typeof(date) FROM {ENTRIES_TABLE}').fetchall()
+    assert stored == [('integer', )]
+    rows = upgraded.get_entries(D(2024, 1, 1), D(2024, 1, 31))
+    assert sorted(rows) == [(D(2024, 1, 1), BASELINE_ROWS[1][1]), (D(2024, 1, 2), BASELINE_ROWS[2][1])]
+    assert upgraded.get_entry(D(2023, 12, 31)) == BASELINE_ROWS[0][1]
+
+
+def test_stats_are_keyed_by_month(upgraded):
+    assert [month for month, *_ in upgraded.get_year_stats(2024)] == ['2024-01', '2024-02']
+    assert upgraded.get_year_stats(2023)[0][:2] == ('2023-12', 1)
+
+
+def test_search_index_matches_the_entries(upgraded):
+    #with rank 1 the check compares the index against the content it was built from
+    upgraded.conn.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('integrity-check', 1)")
+    assert [date for date, _ in upgraded.search('run')] == [D(2024, 1, 1)]
+
+
+def test_null_entries_load_as_empty(upgraded):
+    assert upgraded.get_entry_index(D(2024, 2, 1), D(2024, 2, 29)) == [(D(2024, 2, 10), 0, '')]
+    assert upgraded.get_year_stats(2024)[1] == ('2024-02', 1, 0, 0)
+    upgraded.delete_entry(D(2024, 2, 10))
+    assert [month for month, *_ in upgraded.get_year_stats(2024)] == ['2024-01']
+
+
+def test_hashtags_already_in_the_journal_become_tags(upgraded):
+    assert upgraded.get_tags(D(2024, 1, 1)) == [('goals', 'inline'), ('health', 'inline')]
+    assert dict(upgraded.list_tags()) == {'goals': 1, 'health': 1, 'review': 1, 'work': 1}
+
@@ -0,0 +1,45 @@
+"""The two tier loading of a month: the snippet index the calendar is drawn from, and full entries on demand"""
+
+import datetime
+
+import config
+import model
+
+D = datetime.date
+
+
+def test_index_gives_lengths_and_snippets(entries):
+    long_text = 'word ' * 100
+    entries.upsert_entry(D(2024, 1, 5), 'short')
+    entries.upsert_entry(D(2024, 1, 6), long_text)
+    index = entries.get_entry_index(D(2024, 1, 1), D(2024, 1, 31))
+    assert sorted(index) == [(D(2024, 1, 5), 5, 'short'), (D(2024, 1, 6), len(long_text), long_text[:config.ENTRY_SNIPPET_LENGTH])]
+
+
+def test_month_only_keeps_full_text_that_fits_in_the_snippet(entries):
+    long_text = 'word ' * 100
+    entries.upsert_entry(D(2024, 1, 5), 'short')
+    entries.upsert_entry(D(2024, 1, 6), long_text)
+    month = model.Month(1, 2024)
+    month.populate_days_with_entries(entries.get_entry_index(*month.start_and_end_dates()))
+    assert month[5].entry_loaded and month[5].entry == 'short'
+    assert month[6].has_entry and not month[6].entry_loaded
+    assert month[6].snippet == long_text[:config.ENTRY_SNIPPET_LENGTH]
+    month[6].set_entry(long_text)
+    assert month[6].entry_loaded and month[6].entry_length == len(long_text)
+    assert not month[7].has_entry and month[7].entry_loaded
+
+
+def test_null_entries_from_older_journals_are_not_entries(baseline_journal):
+    journal = baseline_journal([('2024-02-10', None), ('2024-02-11', 'text')])
+    index = journal.get_entry_index(D(2024, 2, 1), D(2024, 2, 29))
+    assert sorted(index) == [(D(2024, 2, 10), 0, ''), (D(2024, 2, 11), 4, 'text')]
+    month = model.Month(2, 2024)
+    month.populate_days_with_entries(index)
+    assert not month[10].has_entry and month[11].has_entry
+    assert sorted(journal.get_recent_entries(5)) == [(D(2024, 2, 10), ''), (D(2024, 2, 11), 'text')]
+    #the stats count the row, with no characters
+    assert journal.get_year_stats(2024) == [('2024-02', 2, 1, 4)]
+    journal.delete_entry(D(2024, 2, 11))
+    journal.delete_entry(D(2024, 2, 10))
+    assert journal.get_year_stats(2024) == []
@@ -0,0 +1,90 @@
+"""Batched writes and the unit of work transaction in the entries repository"""
+
+import datetime
+
+import pytest
+
+from repository import ConflictPolicy
+
+D = datetime.date
+
+
+def test_transaction_commits_everything_at_the_end(entries):
+    with entries.transaction() as unit:
+        unit.upsert_entry(D(2024, 1, 1), 'one')
+        unit.store_many([(D(2024, 1, 2), 'two'), (D(2024, 1, 3), 'three')])
+        assert entries.in_transaction() and entries.conn.in_transaction
+    assert not entries.in_transaction()
+    assert [date for date, _ in sorted(entries.get_entries(D(2024, 1, 1), D(2024, 1, 31)))] == [
+        D(2024, 1, 1), D(2024, 1, 2), D(2024, 1, 3)]
+
+
+def test_transaction_rolls_back_when_the_block_raises(entries):
+    entries.upsert_entry(D(2024, 1, 1), 'before')
+    with pytest.raises(RuntimeError):
+        with entries.transaction():
+            entries.upsert_entry(D(2024, 1, 1), 'changed')
+            entries.delete_entry(D(2024, 1, 1))
+            entries.upsert_entry(D(2024, 1, 2), 'new')
+            raise RuntimeError('stop')
+    assert entries.get_entry(D(2024, 1, 1)) == 'before'
+    assert entries.get_entry(D(2024, 1, 2)) is None
+    assert entries.get_year_stats(2024) == [('2024-01', 1, 1, 6)]
+
+
+def test_nested_blocks_commit_with_the_outermost(entries):
+    with pytest.raises(RuntimeError):
+        with entries.transaction():
+            with entries.transaction():
+                entries.upsert_entry(D(2024, 1, 1), 'inner')
+            #the inner block ending doesn't commit
+            assert entries.conn.in_transaction
+            raise RuntimeError('stop')
+    assert entries.get_entry(D(2024, 1, 1)) is None
+
+
+def test_store_many_reports_a_rolled_back_batch(entries):
+    entries.store_entry(D(2024, 5, 1), 'first')
+    assert entries.store_many([(D(2024, 5, 1), 'again'), (D(2024, 5, 2), 'new')]) == 0
+    assert entries.get_entry(D(2024, 5, 2)) is None
+    assert entries.import_entries([(D(2024, 5, 1), 'skipped'), (D(2024, 5, 3), 'new')]) == 1
+
+    #inside a block the error goes to the block, which rolls back everything in it
+    with pytest.raises(Exception):
+        with entries.transaction():
+            entries.upsert_entry(D(2024, 5, 4), 'in the block')
+            entries.store_many([(D(2024, 5, 1), 'again')])
+    assert entries.get_entry(D(2024, 5, 4)) is None
+
+
+@pytest.mark.parametrize('conflict, written, text', [
+    (ConflictPolicy.SKIP, 1, 'kept'),
+    (ConflictPolicy.OVERWRITE, 2, 'replaced'),
+    (ConflictPolicy.APPEND, 2, 'kept\nreplaced'),
+])
+def test_import_counts_only_written_entries(entries, conflict, written, text):
+    entries.upsert_entry(D(2024, 3, 1), 'kept')
+    rows = [(D(2024, 3, 1), 'replaced'), (D(2024, 3, 2), 'new'), (D(2024, 3, 2), 'new')]
+    assert entries.import_entries(rows, conflict) == written
+    assert entries.get_entry(D(2024, 3, 1)) == text
+    #the same rows again change nothing, unless they are appended
+    assert entries.import_entries(rows, conflict) == (written if conflict is ConflictPolicy.APPEND else 0)
+
+
+def test_batch_delete_and_upsert(entries):
+    assert entries.upsert_many([(D(2024, 6, day), f'day {day}') for day in range(1, 6)]) == 5
+    assert entries.upsert_many([(D(2024, 6, 1), 'day 1'), (D(2024, 6, 2), 'changed')]) == 1
+    entries.delete_many([D(2024, 6, 1), D(2024, 6, 3), D(2024, 6, 30)])
+    assert [date.day for date, _ in sorted(entries.get_entries(D(2024, 6, 1), D(2024, 6, 30)))] == [2, 4, 5]
+    assert entries.get_year_stats(2024)[0][:2] == ('2024-06', 3)
+
+
+def test_a_failed_write_is_rolled_back(entries, monkeypatch):
+    def fail(cursor, changes):
+        raise RuntimeError('tags failed')
+
+    monkeypatch.setattr(entries, 'sync_tags', fail)
+    with pytest.raises(RuntimeError):
+        entries.upsert_entry(D(2024, 7, 1), 'never stored')
+    assert not entries.conn.in_transaction
+    assert entries.get_entry(D(2024, 7, 1)) is None
@@ -0,0 +1,102 @@
+"""Revision history: line deltas between versions, keyframes, rebuilding and restoring old versions, and compaction"""
+
+import datetime
+import json
+
+import pytest
+
+import repository
+from config import REVISIONS_TABLE
+from delta import make_delta, apply_delta
+
+D = datetime.date
+DAY = D(2024, 1, 2)
+
+
+@pytest.mark.parametrize('source, target', [
+    ('', ''),
+    ('', 'new text\n'),
+    ('old text', ''),
+    ('one\ntwo\nthree\n', 'one\n2\nthree\n'),
+    ('one\ntwo\nthree', 'zero\none\ntwo\nthree\nfour'),
+    ('no newline at the end', 'no newline at the end\n'),
+    ('a\r\nb\r\n', 'a\nb\r\n'),
+    ('same\n' * 3, 'same\n' * 5),
+])
+def test_deltas_round_trip(source, target):
+    assert apply_delta(source, make_delta(source, target)) == target
+    assert apply_delta(target, make_delta(target, source)) == source
+
+
+def test_common_start_and_end_are_copied():
+    source = ''.join(f'line {number}\n' for number in range(100))
+    target = source.replace('line 50\n', 'changed\n')
+    assert json.loads(make_delta(source, target)) == [50, -1, 'changed\n', 49]
+
+
+def test_big_changes_are_replaced_whole():
+    source = ''.join(f'line {number}\n' for number in range(10))
+    target = source.replace('line 3\n', 'three\n').replace('line 6\n', 'six\n')
+    assert json.loads(make_delta(source, target, max_lines=None)) == [3, -1, 'three\n', 2, -1, 'six\n', 3]
+    #the changed lines in between are more than max_lines, so they aren't diffed
+    assert json.loads(make_delta(source, target, max_lines=3)) == [3, -4, 'three\nline 4\nline 5\nsix\n', 3]
+    assert apply_delta(source, make_delta(source, target, max_lines=3)) == target
+
+
+def test_revisions_rebuild_older_versions(entries):
+    entries.upsert_entry(DAY, 'back at #work')
+    entries.upsert_entry(DAY, 'back at #work, long day')
+    entries.upsert_entry(DAY, 'back at work')
+    assert [revision for revision, *_ in entries.list_revisions(DAY)] == [2, 1]
+    assert entries.get_revision(DAY, 1) == 'back at #work'
+    assert entries.get_revision(DAY, 2) == 'back at #work, long day'
+    assert entries.get_revision(DAY, 3) is None
+    assert entries.get_tags(DAY) == []
+
+    #a deleted entry keeps its last text in full
+    entries.delete_entry(DAY)
+    assert entries.list_revisions(DAY)[0][::2] == (3, 'full')
+    assert entries.get_revision(DAY, 3) == 'back at work'
+    assert entries.get_revision(DAY, 1) == 'back at #work'
+
+
+def test_every_nth_revision_is_stored_in_full(entries, monkeypatch):
+    monkeypatch.setattr(repository, 'REVISION_KEYFRAME_INTERVAL', 3)
+    texts = [f'version {number}\n' + 'unchanged line\n' * 5 for number in range(8)]
+    for text in texts:
+        entries.upsert_entry(DAY, text)
+    kinds = {revision: kind for revision, _, kind, _ in entries.list_revisions(DAY)}
+    assert [revision for revision, kind in sorted(kinds.items()) if kind == 'full'] == [3, 6]
+    assert [entries.get_revision(DAY, revision) for revision in range(1, 8)] == texts[:7]
+
+
+def test_restoring_a_revision_can_be_undone(entries):
+    entries.upsert_entry(DAY, 'first')
+    entries.upsert_entry(DAY, 'second')
+    assert entries.restore_revision(DAY, 1)
+    assert entries.get_entry(DAY) == 'first'
+    assert entries.get_revision(DAY, 2) == 'second'
+    assert entries.restore_revision(DAY, 2)
+    assert entries.get_entry(DAY) == 'second'
+    assert not entries.restore_revision(DAY, 10)
+
+
+def test_compaction_keeps_the_newest_revisions(entries):
+    for number in range(6):
+        entries.upsert_entry(DAY, f'version {number}')
+    entries.upsert_entry(D(2024, 1, 3), 'other day')
+    entries.upsert_entry(D(2024, 1, 3), 'other day, edited')
+    assert entries.compact_revisions(keep=2, max_age_days=None) == 3
+    assert [revision for revision, *_ in entries.list_revisions(DAY)] == [5, 4]
+    assert entries.get_revision(DAY, 4) == 'version 3'
+    assert entries.get_revision(DAY, 1) is None
+
+    #old revisions go as well, except the newest one of each date
+    entries.conn.execute(f"UPDATE {REVISIONS_TABLE} SET replaced_at = datetime('now', '-2 days')")
+    entries.conn.commit()
+    assert entries.compact_revisions(keep=None, max_age_days=1) == 1
+    assert [revision for revision, *_ in entries.list_revisions(DAY)] == [5]
+    assert entries.get_revision(DAY, 5) == 'version 4'
+    #numbering carries on after compaction
+    entries.upsert_entry(DAY, 'version 6')
+    assert [revision for revision, *_ in entries.list_revisions(DAY)] == [6, 5]
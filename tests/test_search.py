@@ -0,0 +1,45 @@
+"""Full text search over the entries, and the recent entries list"""
+
+import datetime
+
+import pytest
+
+D = datetime.date
+
+
+@pytest.fixture
+def journal(entries):
+    entries.upsert_entry(D(2024, 1, 1), 'walked the dog in the park')
+    entries.upsert_entry(D(2024, 1, 2), 'the dog barked all night, dogs')
+    entries.upsert_entry(D(2024, 1, 3), 'rainy day-trip: museum')
+    return entries
+
+
+def test_search_finds_words_with_snippets(journal):
+    results = journal.search('dog')
+    assert {date for date, _ in results} == {D(2024, 1, 1), D(2024, 1, 2)}
+    assert all('[dog]' in snippet for _, snippet in results)
+
+
+def test_prefix_search_and_paging(journal):
+    assert len(journal.search('dog*')) == 2
+    assert len(journal.search('dog*', limit=1)) == 1
+    assert journal.search('dog*', limit=1, offset=1) == journal.search('dog*')[1:]
+
+
+def test_user_input_is_not_read_as_query_syntax(journal):
+    assert [date for date, _ in journal.search('day-trip: "museum')] == [D(2024, 1, 3)]
+    assert journal.search('   ') == []
+
+
+def test_index_follows_updates_and_deletes(journal):
+    journal.upsert_entry(D(2024, 1, 1), 'walked the cat')
+    assert [date for date, _ in journal.search('dog')] == [D(2024, 1, 2)]
+    journal.delete_entry(D(2024, 1, 2))
+    assert journal.search('dog') == []
+    assert [date for date, _ in journal.search('cat')] == [D(2024, 1, 1)]
+
+
+def test_recent_entries_are_newest_written_first(journal):
+    assert [date for date, _ in journal.get_recent_entries(2)] == [D(2024, 1, 3), D(2024, 1, 2)]
+    assert journal.get_recent_entries(0) == []
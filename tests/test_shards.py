@@ -0,0 +1,86 @@
+"""The per-year journal layout: routing each call to its year, queries across years and splitting a journal"""
+
+import datetime
+
+import pytest
+
+import shards
+from config import ENTRIES_TABLE
+
+D = datetime.date
+
+
+@pytest.fixture
+def sharded(tmp_path, log):
+    journal = shards.ShardedEntries(shards.Shards(tmp_path / 'shards', log))
+    yield journal
+    journal.shards.close()
+
+
+def test_writes_go_to_the_year_of_their_date(sharded, tmp_path):
+    sharded.upsert_entry(D(2023, 12, 31), 'old year')
+    sharded.store_many([(D(2024, 1, 1), 'new year'), (D(2024, 1, 2), 'next day')])
+    assert sharded.shards.years() == [2023, 2024]
+    assert sorted(path.name for path in (tmp_path / 'shards').glob('*.db')) == ['journal_2023.db', 'journal_2024.db']
+    assert sharded.shard(2023).get_entry(D(2023, 12, 31)) == 'old year'
+    assert sharded.shard(2024, create=False).get_entry(D(2023, 12, 31)) is None
+    assert sharded.shard(2022, create=False) is None
+
+    assert sharded.get_entries(D(2023, 12, 1), D(2024, 1, 31)) == [
+        (D(2023, 12, 31), 'old year'), (D(2024, 1, 1), 'new year'), (D(2024, 1, 2), 'next day')]
+    assert [len(batch) for batch in sharded.iter_entries(chunk_size=2)] == [1, 2]
+
+
+def test_recent_entries_are_newest_year_first(sharded):
+    sharded.upsert_entry(D(2024, 1, 1), 'written first')
+    sharded.upsert_entry(D(2023, 6, 1), 'written second')
+    sharded.upsert_entry(D(2024, 1, 2), 'written third')
+    assert [date for date, _ in sharded.get_recent_entries(3)] == [D(2024, 1, 2), D(2024, 1, 1), D(2023, 6, 1)]
+    assert len(sharded.get_recent_entries(1)) == 1
+
+
+def test_search_merges_years_by_place_not_rank(sharded):
+    #the 2023 file has many matches, so its bm25 ranks are on a different scale to 2024's
+    sharded.store_many([(D(2023, 1, day), f'apple day {day}' + ' apple' * day) for day in range(1, 6)])
+    sharded.store_many([(D(2024, 1, 1), 'apple'), (D(2024, 1, 2), 'an apple and a pear')])
+
+    results = [date for date, _ in sharded.search('apple')]
+    assert results[:2] == [D(2024, 1, 1), sharded.shard(2023).search('apple')[0][0]]
+    assert results[2] == D(2024, 1, 2)
+    assert len(results) == 7
+    assert [date for date, _ in sharded.search('apple', limit=2, offset=2)] == results[2:4]
+    assert sharded.search('"') == []
+
+
+def test_split_copies_each_year_into_its_own_file(tmp_path, log, baseline_journal):
+    source = baseline_journal([('2023-12-31', 'last day #review'), ('2024-01-01', 'first day #review'), ('2024-01-02', 'second day')])
+    source.upsert_entry(D(2024, 1, 2), 'second day, edited')
+    source.conn.close()
+
+    assert shards.split_journal(str(source.path), tmp_path / 'split', log) == {2023: 1, 2024: 2}
+    sharded = shards.ShardedEntries(shards.Shards(tmp_path / 'split', log))
+    try:
+        assert sharded.get_entry(D(2024, 1, 2)) == 'second day, edited'
+        assert sharded.get_revision(D(2024, 1, 2), 1) == 'second day'
+        assert sharded.find_by_tags(['review']) == [D(2023, 12, 31), D(2024, 1, 1)]
+        assert [date for date, _ in sharded.search('day')] == [D(2024, 1, 1), D(2023, 12, 31), D(2024, 1, 2)]
+        assert sharded.shard(2024).get_year_stats(2024) == [('2024-01', 2, 6, 35)]
+    finally:
+        sharded.shards.close()
+
+    with pytest.raises(ValueError):
+        shards.split_journal(str(source.path), tmp_path / 'split', log)
+    with pytest.raises(ValueError):
+        shards.split_journal(str(tmp_path / 'missing.db'), tmp_path / 'other', log)
+    assert not (tmp_path / 'missing.db').exists()
+
+
+def test_a_failed_transaction_leaves_every_year_as_it_was(sharded):
+    sharded.upsert_entry(D(2023, 1, 1), 'kept')
+    with pytest.raises(RuntimeError):
+        with sharded.transaction():
+            sharded.upsert_entry(D(2023, 1, 1), 'changed')
+            sharded.upsert_entry(D(2024, 1, 1), 'added')
+            raise RuntimeError('stop')
+    assert sharded.get_entry(D(2023, 1, 1)) == 'kept'
+    assert sharded.shard(2024).conn.execute(f'SELECT COUNT(*) FROM {ENTRIES_TABLE}').fetchone() == (0, )
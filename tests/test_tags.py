@@ -0,0 +1,88 @@
+"""Tags and moods: hashtags picked up from entry text, manual tags, lookups by tag, and mood ratings"""
+
+import datetime
+
+import pytest
+
+from config import TAG_MAX_LENGTH
+from repository import TagMatch
+from tags import extract_tags, normalise_tag
+
+D = datetime.date
+
+
+@pytest.mark.parametrize('text, tags', [
+    (None, set()),
+    ('no tags here', set()),
+    ('#Work and #work-life, #day_2', {'work', 'work-life', 'day_2'}),
+    ('#1 is a number, ##double and a&#39; entity', set()),
+    ('see example.com/#anchor or a#b', set()),
+    ('(#walk) #lunch.', {'walk', 'lunch'}),
+    ('#' + 'x' * (TAG_MAX_LENGTH + 1), set()),
+])
+def test_hashtags_in_text(text, tags):
+    assert extract_tags(text) == tags
+
+
+def test_tag_names_are_normalised():
+    assert normalise_tag(' #Health ') == 'health'
+    for name in ('', '#', '2024', 'two words', 'x' * (TAG_MAX_LENGTH + 1)):
+        with pytest.raises(ValueError):
+            normalise_tag(name)
+
+
+def test_only_changed_hashtags_are_touched(entries):
+    day = D(2024, 4, 1)
+    entries.upsert_entry(day, 'a #walk and #lunch')
+    entries.tag_entry(day, 'lunch', 'family')
+    entries.upsert_entry(day, 'a #walk only')
+    #lunch was made manual, so taking the hashtag out of the text keeps it
+    assert entries.get_tags(day) == [('family', 'manual'), ('lunch', 'manual'), ('walk', 'inline')]
+    assert entries.find_by_tags(['walk', 'family']) == [day]
+    assert entries.find_by_tags(['walk'], exclude=['family']) == []
+    entries.delete_entry(day)
+    assert entries.get_tags(day) == [] and entries.list_tags() == []
+
+
+def test_manual_tags_need_an_entry(entries):
+    assert entries.tag_entry(D(2024, 4, 1), 'walk') == 0
+    entries.upsert_entry(D(2024, 4, 1), 'a walk')
+    assert entries.tag_entry(D(2024, 4, 1), '#Walk', 'walk') == 1
+    #tagging again changes nothing
+    assert entries.tag_entry(D(2024, 4, 1), 'walk') == 0
+    with pytest.raises(ValueError):
+        entries.tag_entry(D(2024, 4, 1), 'not a tag')
+
+    assert entries.untag_entry(D(2024, 4, 1), 'walk', 'missing') == 1
+    #tags no entry has any more are removed from the list
+    assert entries.list_tags() == []
+
+
+def test_find_by_tags(entries):
+    entries.upsert_many([
+        (D(2024, 1, 1), '#run #goals'),
+        (D(2024, 1, 5), '#run'),
+        (D(2024, 2, 1), '#goals'),
+        (D(2024, 3, 1), '#run #goals #sick'),
+    ])
+    assert entries.find_by_tags(['run', 'goals']) == [D(2024, 1, 1), D(2024, 3, 1)]
+    assert entries.find_by_tags(['run', 'goals'], TagMatch.ANY) == [D(2024, 1, 1), D(2024, 1, 5), D(2024, 2, 1), D(2024, 3, 1)]
+    assert entries.find_by_tags(['#RUN'], start_date=D(2024, 1, 2), end_date=D(2024, 2, 28)) == [D(2024, 1, 5)]
+    assert entries.find_by_tags(['run'], exclude=['sick']) == [D(2024, 1, 1), D(2024, 1, 5)]
+    assert entries.find_by_tags([]) == []
+    assert entries.list_tags() == [('goals', 3), ('run', 3), ('sick', 1)]
+
+
+def test_moods(entries):
+    assert not entries.set_mood(D(2024, 1, 1), 3)
+    entries.upsert_entry(D(2024, 1, 1), 'a good day')
+    entries.upsert_entry(D(2024, 1, 2), 'no rating')
+    assert entries.set_mood(D(2024, 1, 1), 5)
+    with pytest.raises(ValueError):
+        entries.set_mood(D(2024, 1, 1), 100)
+    assert entries.get_moods(D(2024, 1, 1), D(2024, 1, 31)) == [(D(2024, 1, 1), 5)]
+    #editing the text keeps the rating
+    entries.upsert_entry(D(2024, 1, 1), 'a very good day')
+    assert entries.get_moods(D(2024, 1, 1), D(2024, 1, 31)) == [(D(2024, 1, 1), 5)]
+    assert entries.set_mood(D(2024, 1, 1), None)
+    assert entries.get_moods(D(2024, 1, 1), D(2024, 1, 31)) == []
@@ -0,0 +1,63 @@
+"""Export to and import from csv, jsonl and plain text files"""
+
+import datetime
+
+import pytest
+
+import repository
+import transfer
+from repository import ConflictPolicy
+
+D = datetime.date
+#text that each format has to carry through unchanged: quotes, commas, blank lines, unicode,
+#and lines that look like the headers of the txt format
+ROWS = [
+    (D(2024, 1, 1), 'plain entry'),
+    (D(2024, 1, 2), 'a "quoted", comma\n\nand a blank line\n'),
+    (D(2024, 1, 3), 'café ☕\n=== 2024-01-04 ===\n\\=== 2024-01-05 ===\nlast line === 2024-01-06 ==='),
+    (D(2024, 1, 4), '=== 2024-01-07 ==='),
+    (D(2024, 1, 5), ''),
+]
+
+
+@pytest.fixture
+def other(log):
+    conn = repository.open_connection(':memory:', log)
+    yield repository.Entries(conn)
+    conn.close()
+
+
+@pytest.mark.parametrize('file_format', transfer.SUPPORTED_FORMATS)
+def test_round_trip(entries, other, tmp_path, file_format):
+    entries.store_many(ROWS)
+    path = str(tmp_path / f'journal.{file_format}')
+    exported = []
+    assert transfer.export_entries(entries, path, chunk_size=2, progress=exported.append) == len(ROWS)
+    assert exported == [2, 4, 5]
+
+    read = []
+    assert transfer.import_entries(other, path, batch_size=3, progress=read.append) == len(ROWS)
+    assert read == [3, 5]
+    assert other.get_entries(D(2024, 1, 1), D(2024, 1, 31)) == ROWS
+
+
+def test_conflicts_follow_the_policy(entries, other, tmp_path):
+    entries.store_many(ROWS[:2])
+    path = str(tmp_path / 'journal.jsonl')
+    transfer.export_entries(entries, path)
+    other.store_entry(D(2024, 1, 1), 'already here')
+
+    assert transfer.import_entries(other, path) == 1
+    assert other.get_entry(D(2024, 1, 1)) == 'already here'
+    assert transfer.import_entries(other, path, conflict=ConflictPolicy.APPEND) == 2
+    assert other.get_entry(D(2024, 1, 1)) == 'already here\nplain entry'
+    assert transfer.import_entries(other, path, conflict=ConflictPolicy.OVERWRITE) == 2
+    #the same file again changes nothing, so nothing is written
+    assert transfer.import_entries(other, path, conflict=ConflictPolicy.OVERWRITE) == 0
+    assert other.get_entries(D(2024, 1, 1), D(2024, 1, 31)) == ROWS[:2]
+
+
+def test_unknown_formats_are_refused(entries, tmp_path):
+    with pytest.raises(ValueError):
+        transfer.export_entries(entries, str(tmp_path / 'journal.xml'))
+    assert not (tmp_path / 'journal.xml').exists()
@@ -0,0 +1,79 @@
+"""The background db worker: call order, results and errors, reads on reader threads, and shutting down"""
+
+import threading
+
+import pytest
+
+from worker import DBWorker
+
+
+class RecordingConnection:
+    """Stands in for the connection the worker closes when it stops"""
+    def __init__(self) -> None:
+        self.calls = []
+
+    def execute(self, sql: str) -> None:
+        self.calls.append(sql)
+
+    def close(self) -> None:
+        self.calls.append('close')
+
+
+@pytest.fixture
+def conn():
+    return RecordingConnection()
+
+
+@pytest.fixture
+def reading_worker(conn):
+    db_worker = DBWorker(conn, readers=2)
+    db_worker.start()
+    yield db_worker
+    db_worker.stop()
+
+
+def thread_name() -> str:
+    return threading.current_thread().name
+
+
+def test_calls_run_in_order_on_the_worker_thread(conn):
+    db_worker = DBWorker(conn)
+    db_worker.start()
+    order = []
+    futures = [db_worker.submit(order.append, number) for number in range(20)]
+    assert db_worker.submit(thread_name).result() == 'db-worker'
+    assert [future.result() for future in futures] == [None] * 20
+    assert order == list(range(20))
+
+    failed = db_worker.submit(lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        failed.result()
+    #an error doesn't stop the worker
+    assert db_worker.submit(lambda: 'still running').result() == 'still running'
+
+    #queued calls finish before the connection is closed
+    slow = db_worker.submit(order.append, 'last')
+    db_worker.stop()
+    assert slow.done() and order[-1] == 'last'
+    assert conn.calls == ['PRAGMA optimize', 'close']
+
+
+def test_reads_use_a_reader_thread_when_nothing_is_waiting(reading_worker):
+    assert reading_worker.submit_read(thread_name).result().startswith('db-reader')
+
+
+def test_reads_wait_behind_queued_writes(reading_worker):
+    release = threading.Event()
+    blocked = reading_worker.submit(release.wait, 5)
+    written = reading_worker.submit(lambda: 'saved')
+    #a read made now must see the writes before it, so it is queued on the worker behind them
+    read = reading_worker.submit_read(lambda: (written.done(), thread_name()))
+    assert not read.done()
+    release.set()
+    assert blocked.result() is True
+    assert read.result() == (True, 'db-worker')
+
+
+def test_stop_without_starting_still_closes(conn):
+    DBWorker(conn).stop()
+    assert conn.calls == ['PRAGMA optimize', 'close']